@@ -1,9 +1,13 @@
 import asyncio
+import functools
 import logging
+import threading
 import time
 import re
 from urllib.parse import urljoin
 from io import BytesIO
+
+from startup import LazyModule, Subsystem, report as startup_report
 from selenium.common.exceptions import TimeoutException
 
 
@@ -13,11 +17,6 @@ from PIL import Image
 import os
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
-try:
-    from tensorflow import keras
-except ImportError:
-    import keras
-
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -28,12 +27,35 @@ from telegram.ext import (
     ContextTypes,
 )
 
-import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 
+# Тяжёлая часть selenium импортируется в фоне после старта (или при первом поиске)
+uc = LazyModule("undetected_chromedriver")
+EC = LazyModule("selenium.webdriver.support.expected_conditions")
+support_ui = LazyModule("selenium.webdriver.support.ui")
+
+import metrics
+from batching import MicroBatcher
+from inference import load_engine
+from inference_workers import InferenceWorkerPool
+from driver_pool import DriverPool, DriverPoolTimeout
+from search_stream import SearchStream
+from stores import GLORIA_JEANS, STORES, StoreAdapter, fan_out
+from search_cache import SearchCache, normalize_query
+from catalog_index import CatalogCrawler, CatalogIndex, parse_price_filter
+from result_store import ResultSet, ResultStore
+from singleflight import SingleFlight
+from prefetch import Prefetcher
+from scheduler import Lane, LaneFull
+from send_queue import STATUS, SendQueue
+from sessions import SessionPersistence, SessionStore
+from sharding import serve_worker
+from inference_cache import InferenceCache, perceptual_hash
+from visual_index import VisualIndex, VisualIndexer
+
+startup_report.mark("imports")
+
 
 # ================== НАСТРОЙКИ МОДЕЛИ ==================
 MODEL_PATH = "path_to_app.py\\clothing_multitask_mobilenetv2.keras"  
@@ -85,40 +107,105 @@ PRINT_RU = {
 COLOR_RU_QUERY = COLOR_RU_HUMAN
 TYPE_RU_QUERY = TYPE_RU
 
+# Движок инференса: "keras", "tflite_fp16", "tflite_int8" или "onnx".
+# Артефакты для tflite/onnx собираются из MODEL_PATH командой `python export_model.py convert`
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+INFERENCE_THREADS = None  # None — на усмотрение движка (intra-op потоки)
+
+# Модель в отдельных процессах: предобработка и predict не делят GIL с хендлерами бота.
+# 0 — модель в процессе бота
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+INFERENCE_INTER_OP_THREADS = None   # inter-op потоки TF в каждом процессе
+INFERENCE_PIN_CPUS = False          # закрепить процессы за своими ядрами
+
+# Запасные варианты распознавания (тип + цвет): предлагаются после «Нет» и ищутся заранее
+PREDICTION_ALTERNATIVES = 3
+PREDICTION_ALTERNATIVE_MIN_PROB = 0.05   # совместная вероятность тип × цвет
+
 _model = None
+_model_lock = threading.Lock()
 
 
 def get_model():
     """Ленивая загрузка модели, чтобы не грузить её лишний раз."""
     global _model
-    if _model is None:
-        _model = keras.models.load_model(MODEL_PATH)
+    if _model is not None:
+        return _model
+    # Фоновая предзагрузка и первый запрос могут прийти сюда одновременно
+    with _model_lock:
+        if _model is not None:
+            return _model
+        head_sizes = (len(TYPE_CLASSES), len(COLOR_CLASSES), len(PRINT_CLASSES))
+        if INFERENCE_WORKERS:
+            model = InferenceWorkerPool(
+                INFERENCE_BACKEND,
+                MODEL_PATH,
+                head_sizes=head_sizes,
+                workers=INFERENCE_WORKERS,
+                max_batch=BATCH_MAX_SIZE,
+                image_shape=(IMG_SIZE[1], IMG_SIZE[0], 3),
+                intra_op_threads=INFERENCE_THREADS,
+                inter_op_threads=INFERENCE_INTER_OP_THREADS,
+                pin_cpus=INFERENCE_PIN_CPUS,
+            )
+        else:
+            model = load_engine(INFERENCE_BACKEND, MODEL_PATH, head_sizes=head_sizes,
+                                num_threads=INFERENCE_THREADS)
+        _model = model
     return _model
 
 
-def preprocess_image_bytes(image_bytes: bytes) -> np.ndarray:
-    img = Image.open(BytesIO(image_bytes)).convert("RGB")
-    img = img.resize(IMG_SIZE)
-    arr = np.array(img, dtype='float32') / 255.0
-    arr = np.expand_dims(arr, axis=0)
-    return arr
+_INV_255 = np.float32(1.0 / 255.0)
 
 
-def predict_labels_from_bytes(image_bytes: bytes):
-    """Возвращает (type_label, color_label, print_label) по байтам картинки."""
-    model = get_model()
-    x = preprocess_image_bytes(image_bytes)
-    preds = model.predict(x)
+def choose_photo_size(photos):
+    """
+    Telegram присылает несколько размеров одного фото. Берём самый маленький,
+    который по обеим сторонам не меньше входа модели, — больше качать незачем.
+    """
+    min_w, min_h = IMG_SIZE
+    suitable = [p for p in photos if p.width >= min_w and p.height >= min_h]
+    if suitable:
+        return min(suitable, key=lambda p: p.width * p.height)
+    return max(photos, key=lambda p: p.width * p.height)
+
+
+def load_image(image_bytes: bytes) -> Image.Image:
+    img = Image.open(BytesIO(image_bytes))
+    # Для JPEG декодируем сразу в уменьшенном масштабе (DCT-scaling), но не меньше входа модели
+    img.draft("RGB", IMG_SIZE)
+    return img.convert("RGB")
+
+
+def image_to_uint8(img: Image.Image) -> np.ndarray:
+    """Картинка модели в uint8, форма (1, H, W, 3) — в 4 раза меньше float32."""
+    return np.asarray(img.resize(IMG_SIZE))[np.newaxis]
+
+
+def preprocess_image(img: Image.Image, out: np.ndarray | None = None) -> np.ndarray:
+    """Вход модели float32 [0, 1] формы (1, H, W, 3); пишется в out, если он передан."""
+    u8 = image_to_uint8(img)
+    if out is None:
+        out = np.empty(u8.shape, dtype=np.float32)
+    np.multiply(u8, _INV_255, out=out)
+    return out
+
+
+def preprocess_image_bytes(image_bytes: bytes) -> np.ndarray:
+    return preprocess_image(load_image(image_bytes))
+
 
+def decode_predictions(preds, i: int = 0):
+    """Достаёт (type_label, color_label, print_label) для i-й картинки батча."""
     # Ожидаем три выхода: тип, цвет, принт
     if isinstance(preds, list) and len(preds) == 3:
         type_probs, color_probs, print_probs = preds
     else:
         raise ValueError("Модель должна выдавать три выхода: тип, цвет, принт")
 
-    type_idx = int(np.argmax(type_probs[0]))
-    color_idx = int(np.argmax(color_probs[0]))
-    print_idx = int(np.argmax(print_probs[0]))
+    type_idx = int(np.argmax(type_probs[i]))
+    color_idx = int(np.argmax(color_probs[i]))
+    print_idx = int(np.argmax(print_probs[i]))
 
     type_label = TYPE_CLASSES[type_idx]
     color_label = COLOR_CLASSES[color_idx]
@@ -127,6 +214,181 @@ def predict_labels_from_bytes(image_bytes: bytes):
     return type_label, color_label, print_label
 
 
+def decode_alternatives(preds, i: int = 0, k: int = PREDICTION_ALTERNATIVES) -> list:
+    """
+    Следующие за лучшей пары [type_label, color_label, p] для i-й картинки батча,
+    по убыванию совместной вероятности p = p(тип) * p(цвет).
+    """
+    type_probs, color_probs = np.asarray(preds[0][i]), np.asarray(preds[1][i])
+    top_types = np.argsort(type_probs)[::-1][:k + 1]
+    top_colors = np.argsort(color_probs)[::-1][:k + 1]
+    pairs = sorted(
+        ((float(type_probs[t] * color_probs[c]), int(t), int(c)) for t in top_types for c in top_colors),
+        reverse=True,
+    )
+    # Первая пара — сам ответ модели
+    return [[TYPE_CLASSES[t], COLOR_CLASSES[c], p] for p, t, c in pairs[1:k + 1]
+            if p >= PREDICTION_ALTERNATIVE_MIN_PROB]
+
+
+def predict_labels_batch(x: np.ndarray):
+    """
+    Один прогон модели на батче (N, H, W, 3) -> список из N
+    (type_label, color_label, print_label, alternatives).
+    Процессам инференса можно отдавать и uint8 — в [0, 1] переведут они сами.
+    """
+    model = get_model()
+    with metrics.span("model_predict"):
+        preds = model.predict(x)
+    metrics.observe("bot_inference_batch_size", x.shape[0])
+    return [decode_predictions(preds, i) + (decode_alternatives(preds, i),) for i in range(x.shape[0])]
+
+
+def predict_labels_from_bytes(image_bytes: bytes):
+    """Возвращает (type_label, color_label, print_label, alternatives) по байтам картинки."""
+    x = preprocess_image_bytes(image_bytes)
+    return predict_labels_batch(x)[0]
+
+
+# ====== Микро-батчинг инференса ======
+# Картинки от одновременно пришедших пользователей прогоняются через модель одним батчем
+BATCH_MAX_SIZE = 16        # максимум картинок в одном прогоне
+BATCH_MAX_WAIT_MS = 15.0   # сколько ждать добора батча после первой картинки
+
+_batcher = None
+_batch_buffer = None
+
+
+def collate_uint8(items) -> np.ndarray:
+    """
+    Собирает батч из uint8-картинок прямо в заранее выделенный float32-буфер.
+    Вызывается только из потока батчера, поэтому буфер один на процесс.
+    """
+    global _batch_buffer
+    if _batch_buffer is None:
+        _batch_buffer = np.empty((BATCH_MAX_SIZE, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+    batch = _batch_buffer[:len(items)]
+    for i, u8 in enumerate(items):
+        np.multiply(u8[0], _INV_255, out=batch[i])
+    return batch
+
+
+def get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(
+            predict_labels_batch,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            # С процессами инференса батч уходит в общую память как есть, в uint8,
+            # и считается параллельно — по батчу на процесс
+            collate=None if INFERENCE_WORKERS else collate_uint8,
+            threads=max(1, INFERENCE_WORKERS),
+        )
+        _batcher.start()
+    return _batcher
+
+
+# ====== Кэш распознавания ======
+# Повторно присланное (или пересжатое) фото не прогоняем через модель заново
+INFERENCE_CACHE_SIZE = 5000
+INFERENCE_CACHE_MAX_DISTANCE = 4                       # допустимое расхождение pHash, бит
+INFERENCE_CACHE_PATH = "inference_cache.sqlite3"       # None — только в памяти
+
+_inference_cache = None
+
+
+def get_inference_cache() -> InferenceCache:
+    global _inference_cache
+    if _inference_cache is None:
+        _inference_cache = InferenceCache(
+            max_entries=INFERENCE_CACHE_SIZE,
+            max_distance=INFERENCE_CACHE_MAX_DISTANCE,
+            path=INFERENCE_CACHE_PATH,
+        )
+    return _inference_cache
+
+
+def _decode_and_hash(image_bytes: bytes):
+    img = load_image(image_bytes)
+    return img, perceptual_hash(img)
+
+
+async def classify_photo(photo) -> tuple:
+    """
+    (type_label, color_label, print_label, alternatives) для PhotoSize с учётом кэша распознавания.
+    В записях кэша от прошлых версий alternatives может не быть.
+    """
+    # Кэш перебирает хэши и пишет в SQLite — всё это в потоках полосы инференса
+    loop = asyncio.get_event_loop()
+    executor = get_inference_lane().executor
+    cache = get_inference_cache()
+    cached = await loop.run_in_executor(executor, cache.get_by_file_id, photo.file_unique_id)
+    if cached is not None:
+        return cached
+
+    with metrics.span("photo_download"):
+        file = await photo.get_file()
+        bio = BytesIO()
+        await file.download_to_memory(out=bio)
+        image_bytes = bio.getvalue()
+
+    with metrics.span("photo_decode"):
+        img, phash = await loop.run_in_executor(executor, _decode_and_hash, image_bytes)
+    cached = await loop.run_in_executor(executor, cache.get_by_hash, phash, photo.file_unique_id)
+    if cached is not None:
+        return cached
+
+    with metrics.span("photo_preprocess"):
+        x = await loop.run_in_executor(executor, image_to_uint8, img)
+    # Очередь батчера + сам прогон; чистое время модели — стадия model_predict
+    with metrics.span("photo_inference"):
+        labels = await get_batcher().predict(x)
+    await loop.run_in_executor(executor, cache.put, phash, labels, photo.file_unique_id)
+    return labels
+
+
+# ====== Визуальный поиск похожих товаров ======
+# Эмбеддинги картинок собранных парсером товаров копятся в локальном индексе,
+# фото пользователя сравнивается с ними напрямую, без браузера
+VISUAL_SEARCH_ENABLED = True
+VISUAL_INDEX_WRITER = os.environ.get("VISUAL_INDEX_WRITER", "1") == "1"   # пополнять индекс; из нескольких процессов — только один
+VISUAL_INDEX_PATH = "visual_index"
+VISUAL_EMBEDDING_DIM = 1280   # размер пулингового выхода MobileNetV2
+VISUAL_TOP_K = 15
+
+_visual_index = None
+_visual_indexer = None
+
+
+def embed_images(x: np.ndarray) -> np.ndarray:
+    """
+    Эмбеддинги backbone для батча (N, H, W, 3) — тем же движком, что и распознавание
+    (в процессах инференса, если они есть), без второй копии модели в процессе бота.
+    """
+    return get_model().embed(x)
+
+
+def get_visual_index() -> VisualIndex:
+    global _visual_index
+    if _visual_index is None:
+        _visual_index = VisualIndex(VISUAL_INDEX_PATH, VISUAL_EMBEDDING_DIM, writable=VISUAL_INDEX_WRITER)
+    return _visual_index
+
+
+def get_visual_indexer() -> VisualIndexer:
+    global _visual_indexer
+    if _visual_indexer is None:
+        _visual_indexer = VisualIndexer(get_visual_index(), embed_images, preprocess_image_bytes)
+    return _visual_indexer
+
+
+def find_similar_products(image_bytes: bytes) -> list:
+    x = preprocess_image_bytes(image_bytes)
+    embedding = embed_images(x)[0]
+    return [product for _, product in get_visual_index().search(embedding, k=VISUAL_TOP_K)]
+
+
 def build_description_and_query(type_label: str, color_label: str, print_label: str | None = None):
     """
     Формируем человеческое описание и строку поиска.
@@ -191,19 +453,8 @@ def normalize_price(raw: str) -> str:
     return r
 
 
-def find_search_input(driver):
-    input_selectors = [
-        'input[type="search"]',
-        'input[name*="search"]',
-        'input[placeholder*="Поиск"]',
-        'input[placeholder*="поиск"]',
-        'input[aria-label*="Поиск"]',
-        'input[aria-label*="search"]',
-        '.header-controls_control input',
-        '.search-input input',
-        'input'
-    ]
-    for sel in input_selectors:
+def find_search_input(driver, store: StoreAdapter = GLORIA_JEANS):
+    for sel in store.search_input_selectors:
         try:
             el = driver.find_element(By.CSS_SELECTOR, sel)
             if el.is_displayed():
@@ -213,30 +464,24 @@ def find_search_input(driver):
     return None
 
 
-def extract_products(driver, wait):
-    base = "https://www.gloria-jeans.ru/"
-    card_selectors = [
-        'gj-product-mini-card',
-        '.product-mini-card',
-        '.listing-grid__col',
-        '.product-mini-card__image-wrapper',
-        '.product-card',
-        '.product-item',
-        '.catalog-card',
-        '.catalog__item',
-        '[data-testid="product-card"]',
-        'article'
-    ]
+# Селекторы карточек товара — в адаптере магазина (stores.py). Используются
+# и в WebDriver-извлечении, и в JS-извлечении
+MAX_CARDS = 1000
+PRICE_IN_HTML_RE = re.compile(r'(\d{1,3}(?:[\s\u00A0]\d{3})*\s*₽)')
+
+
+def extract_products(driver, wait, store: StoreAdapter = GLORIA_JEANS):
+    base = store.base_url
 
     cards = []
-    for sel in card_selectors:
+    for sel in store.card_selectors:
         elems = driver.find_elements(By.CSS_SELECTOR, sel)
         if elems:
             cards = elems
             break
 
     if not cards:
-        anchors = driver.find_elements(By.CSS_SELECTOR, 'a[href*="/product/"], a[href*="/catalog/"]')
+        anchors = driver.find_elements(By.CSS_SELECTOR, store.anchor_fallback_selector)
         seen = set()
         tmp = []
         for a in anchors:
@@ -254,7 +499,7 @@ def extract_products(driver, wait):
     results = []
     seen_links = set()
 
-    for c in cards[:1000]:
+    for c in cards[:MAX_CARDS]:
         try:
             outer = (c.get_attribute("outerHTML") or "")[:2000]
             link = ""
@@ -263,12 +508,12 @@ def extract_products(driver, wait):
             try:
                 prod_anchor = None
                 try:
-                    prod_anchor = c.find_element(By.CSS_SELECTOR, '.product-mini-card__name a, a[href*="/product/"]')
+                    prod_anchor = c.find_element(By.CSS_SELECTOR, store.product_anchor_selector)
                 except Exception:
                     anchors = c.find_elements(By.CSS_SELECTOR, 'a[href]')
                     for a in anchors:
                         h = a.get_attribute('href') or ""
-                        if '/product/' in h:
+                        if store.product_path in h:
                             prod_anchor = a
                             break
                 if prod_anchor:
@@ -285,7 +530,7 @@ def extract_products(driver, wait):
                     anchors = c.find_elements(By.CSS_SELECTOR, 'a[href]')
                     for a in anchors:
                         h = a.get_attribute('href') or ""
-                        if '/catalog/' in h:
+                        if store.catalog_path in h:
                             continue
                         if h:
                             if h.startswith('/'):
@@ -299,7 +544,7 @@ def extract_products(driver, wait):
 
             if not title:
                 try:
-                    el = c.find_element(By.CSS_SELECTOR, '.product-mini-card__name, .product-mini-card__name a, .product-mini-card__name span')
+                    el = c.find_element(By.CSS_SELECTOR, store.title_selector)
                     title = (el.text or "").strip()
                 except Exception:
                     pass
@@ -310,7 +555,7 @@ def extract_products(driver, wait):
                 seen_links.add(link)
 
             image_url = ""
-            for sel in ['img.product-mini-card__image, img.product-mini-card__img', 'img', 'picture img']:
+            for sel in store.image_selectors:
                 try:
                     im = c.find_element(By.CSS_SELECTOR, sel)
                     image_url = im.get_attribute('src') or im.get_attribute('data-src') or ""
@@ -322,19 +567,7 @@ def extract_products(driver, wait):
                     continue
 
             price = ""
-            price_selectors = [
-                'span.button__label',
-                '.button__label',
-                'span.price-new',
-                'span.price-old',
-                'span.price',
-                '.product-card__price-current',
-                '.product-card__price',
-                '.price-current',
-                '.price',
-                'gj-button-price'
-            ]
-            for ps in price_selectors:
+            for ps in store.price_selectors:
                 try:
                     els = c.find_elements(By.CSS_SELECTOR, ps)
                     if els:
@@ -349,7 +582,7 @@ def extract_products(driver, wait):
                     continue
 
             if not price:
-                m = re.search(r'(\d{1,3}(?:[\s\u00A0]\d{3})*\s*₽)', outer)
+                m = PRICE_IN_HTML_RE.search(outer)
                 if m:
                     price = m.group(1).strip()
 
@@ -367,88 +600,877 @@ def extract_products(driver, wait):
     return results
 
 
-def run_parser(search_query: str):
-    driver = uc.Chrome(headless=False)
-    wait = WebDriverWait(driver, 5)
+# ====== Извлечение товаров одним JS-вызовом ======
+# "js" — все карточки читаются одним execute_script, уже прочитанные карточки помечаются
+# и при следующем вызове не возвращаются. "webdriver" — старое поэлементное извлечение.
+EXTRACT_MODE = "js"
+
+# Та же логика, что и в extract_products, но выполняется в браузере за один вызов.
+# Селекторы передаются аргументами, чтобы адаптер магазина оставался единственным источником.
+EXTRACT_PRODUCTS_JS = """
+const [cardSelectors, anchorFallbackSel, productAnchorSel, titleSel,
+       imageSelectors, priceSelectors, maxCards, mark, productPath, catalogPath] = arguments;
+const text = (el) => ((el && (el.innerText || el.textContent)) || '').trim();
+
+let cards = [];
+for (const sel of cardSelectors) {
+  const els = document.querySelectorAll(sel);
+  if (els.length) { cards = Array.from(els); break; }
+}
+if (!cards.length) {
+  const seen = new Set();
+  for (const a of document.querySelectorAll(anchorFallbackSel)) {
+    const href = a.href || a.innerHTML || '';
+    if (seen.has(href)) continue;
+    seen.add(href);
+    const parent = a.parentElement && a.parentElement.closest('div');
+    if (parent) cards.push(parent);
+  }
+}
+
+const out = [];
+for (const c of cards.slice(0, maxCards)) {
+  if (c.hasAttribute(mark)) continue;
+  try {
+    let link = '', title = '';
+    let prodAnchor = c.querySelector(productAnchorSel);
+    if (!prodAnchor) {
+      prodAnchor = Array.from(c.querySelectorAll('a[href]')).find(a => (a.href || '').includes(productPath));
+    }
+    if (prodAnchor) {
+      link = prodAnchor.href || '';
+      title = text(prodAnchor);
+    }
+    if (!link) {
+      for (const a of c.querySelectorAll('a[href]')) {
+        const h = a.href || '';
+        if (h.includes(catalogPath)) continue;
+        if (h) { link = h; if (!title) title = text(a); break; }
+      }
+    }
+    if (!title) title = text(c.querySelector(titleSel));
+
+    let image = '';
+    for (const sel of imageSelectors) {
+      const im = c.querySelector(sel);
+      if (!im) continue;
+      image = im.src || im.getAttribute('data-src') || '';
+      if (image) break;
+    }
+
+    let price = '';
+    for (const ps of priceSelectors) {
+      for (const el of c.querySelectorAll(ps)) {
+        const t = text(el);
+        if (t) { price = t; break; }
+      }
+      if (price) break;
+    }
+
+    if (!title && !link) continue;
+    c.setAttribute(mark, '1');
+    out.push({title, link, price, image, html: price ? '' : c.outerHTML.slice(0, 2000)});
+  } catch (e) {
+    continue;
+  }
+}
+return out;
+"""
+PARSED_CARD_MARK = "data-parser-seen"
+
+
+def extract_products_js(driver, store: StoreAdapter = GLORIA_JEANS):
+    """
+    Достаёт из страницы только новые (ещё не прочитанные) карточки за один round trip.
+    Прочитанные карточки помечаются атрибутом PARSED_CARD_MARK прямо в DOM.
+    """
+    raw_items = driver.execute_script(
+        EXTRACT_PRODUCTS_JS,
+        store.card_selectors,
+        store.anchor_fallback_selector,
+        store.product_anchor_selector,
+        store.title_selector,
+        store.image_selectors,
+        store.price_selectors,
+        MAX_CARDS,
+        PARSED_CARD_MARK,
+        store.product_path,
+        store.catalog_path,
+    ) or []
+
+    results = []
+    for raw in raw_items:
+        link = store.absolute(raw.get("link") or "")
+        image_url = store.absolute(raw.get("image") or "")
+
+        price = raw.get("price") or ""
+        if not price:
+            m = PRICE_IN_HTML_RE.search(raw.get("html") or "")
+            if m:
+                price = m.group(1).strip()
+
+        results.append({
+            "title": raw.get("title") or "",
+            "price": price,
+            "link": link,
+            "image": image_url
+        })
+    return results
+
+
+def extract_new_products(driver, wait, store: StoreAdapter = GLORIA_JEANS):
+    """Извлечение в режиме EXTRACT_MODE; при сбое JS откатываемся на WebDriver-извлечение."""
+    if EXTRACT_MODE == "js":
+        try:
+            return extract_products_js(driver, store)
+        except Exception as e:
+            logger.warning(f"JS-извлечение не сработало, перехожу на WebDriver: {e}")
+    return extract_products(driver, wait, store)
+
+
+# ====== Пул браузеров ======
+# У каждого магазина свой пул: браузеры ждут запрос прогретыми на его странице поиска
+SEARCH_STORES = [GLORIA_JEANS.name]   # в каких магазинах искать; несколько — опрашиваются параллельно
+DRIVER_POOL_SIZE = 2            # жёсткий лимит одновременно живых браузеров на магазин
+DRIVER_MAX_USES = 30            # после стольких запросов браузер пересоздаётся
+DRIVER_CHECKOUT_TIMEOUT = 60.0  # сколько запрос ждёт свободный браузер, с
+DRIVER_HEALTH_INTERVAL = 30.0   # период фоновой проверки браузеров, с
+DRIVER_HEADLESS = True
+
+
+def search_stores() -> list:
+    return [STORES[name] for name in SEARCH_STORES]
 
+
+def create_driver(store: StoreAdapter = GLORIA_JEANS):
+    """Запускает браузер и сразу открывает страницу поиска, чтобы он ждал запрос прогретым."""
+    with metrics.span("browser_start"):
+        driver = uc.Chrome(headless=DRIVER_HEADLESS)
+    try:
+        with metrics.span("browser_first_page"):
+            driver.get(store.search_url)
+            wait_for_search_input(driver, PAGE_LOAD_TIMEOUT, store)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+
+def reset_driver(driver, store: StoreAdapter = GLORIA_JEANS):
+    """Чистит куки/хранилища после запроса и возвращает браузер на страницу поиска."""
+    driver.delete_all_cookies()
+    driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    driver.get(store.search_url)
+    driver.execute_script("window.scrollTo(0, 0);")
+
+
+_driver_pools: dict = {}   # имя магазина -> DriverPool
+_driver_pools_lock = threading.Lock()
+
+
+def get_driver_pool(store: StoreAdapter = GLORIA_JEANS) -> DriverPool:
+    pool = _driver_pools.get(store.name)
+    if pool is not None:
+        return pool
+    # Пулы создаются и из потоков парсера, и из фоновой загрузки браузеров
+    with _driver_pools_lock:
+        pool = _driver_pools.get(store.name)
+        if pool is None:
+            pool = DriverPool(
+                functools.partial(create_driver, store),
+                reset=functools.partial(reset_driver, store=store),
+                size=DRIVER_POOL_SIZE,
+                max_uses=DRIVER_MAX_USES,
+                health_interval=DRIVER_HEALTH_INTERVAL,
+                name=f"driver-pool-{store.name}",
+            )
+            pool.start()
+            _driver_pools[store.name] = pool
+    return pool
+
+
+# ====== Прокрутка выдачи ======
+PAGE_LOAD_TIMEOUT = 15.0      # ожидание поля поиска на свежей странице, с
+RESULTS_TIMEOUT = 8.0         # ожидание первых карточек после поиска, с
+DOM_QUIET_PERIOD = 0.15       # DOM считается успокоившимся, если столько нет изменений, с
+# Шаг прокрутки, число прокруток и ожидание подгрузки внизу — в адаптере магазина
+PARSER_MAX_RESULTS = 300      # хватит с запасом на много страниц по PAGE_SIZE
+PARSER_DEADLINE = 45.0        # максимум времени на один запрос, с
+
+# Считает добавленные в DOM узлы: так мы узнаём о подгрузке карточек без фиксированных пауз
+INSTALL_DOM_OBSERVER_JS = """
+if (!window.__parserObserver) {
+  window.__parserMutations = 0;
+  window.__parserObserver = new MutationObserver((records) => {
+    for (const r of records) window.__parserMutations += r.addedNodes.length;
+  });
+  window.__parserObserver.observe(document.body, {childList: true, subtree: true});
+}
+return window.__parserMutations;
+"""
+DOM_STATE_JS = """
+const el = document.scrollingElement || document.documentElement;
+return [window.__parserMutations || 0, document.body.scrollHeight,
+        el.scrollTop + window.innerHeight >= document.body.scrollHeight - 2];
+"""
+
+
+def wait_for_search_input(driver, timeout: float, store: StoreAdapter = GLORIA_JEANS):
     try:
-        driver.get("https://www.gloria-jeans.ru/search")
-        time.sleep(4.0)
+        return support_ui.WebDriverWait(driver, timeout, poll_frequency=0.2).until(
+            lambda d: find_search_input(d, store)
+        )
+    except TimeoutException:
+        raise RuntimeError("Не удалось найти поле поиска")
+
+
+def _dom_state(driver):
+    mutations, height, at_bottom = driver.execute_script(DOM_STATE_JS)
+    return int(mutations), int(height), bool(at_bottom)
+
 
-        input_el = find_search_input(driver)
-        if not input_el:
-            raise RuntimeError("Не удалось найти поле поиска")
+def _wait_for_dom_change(driver, mutations: int, height: int, timeout: float) -> bool:
+    """Ждёт, пока в DOM добавятся узлы или вырастет страница. False — если ничего не изменилось."""
+    if timeout <= 0:
+        return False
+    try:
+        support_ui.WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+            lambda d: _dom_state(d)[:2] != (mutations, height)
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def _wait_for_dom_quiet(driver, timeout: float):
+    """Даёт догрузиться пачке карточек: ждёт паузы в мутациях, но не дольше timeout."""
+    deadline = time.monotonic() + max(timeout, 0)
+    last = _dom_state(driver)[0]
+    quiet_since = time.monotonic()
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        current = _dom_state(driver)[0]
+        if current != last:
+            last, quiet_since = current, time.monotonic()
+        elif time.monotonic() - quiet_since >= DOM_QUIET_PERIOD:
+            return
+
+
+def iter_parser(search_query: str, max_results: int = PARSER_MAX_RESULTS,
+                deadline: float = PARSER_DEADLINE, stores: list | None = None):
+    """
+    Ищет товары по запросу и отдаёт их пачками по мере прокрутки.
+    Останавливается, когда набралось max_results товаров, выдача перестала расти
+    или истекли deadline секунд. Если генератор закрыть раньше, браузер вернётся в пул.
+    Несколько магазинов (по умолчанию SEARCH_STORES) опрашиваются параллельно
+    в общем лимите deadline; выдачи сливаются без повторов по ссылке.
+    """
+    metrics.inc("bot_searches_total")
+    stores = search_stores() if stores is None else stores
+    if len(stores) == 1:
+        yield from _iter_store(stores[0], search_query, max_results, deadline)
+        return
+
+    started = time.monotonic()
+    sources = {s.name: functools.partial(_iter_store, s, search_query, max_results, deadline, started)
+               for s in stores}
+    deadlines = {s.name: started + min(deadline, s.deadline or deadline) for s in stores}
+    report = {}
+    try:
+        yield from fan_out(sources, deadlines, max_results, report)
+    finally:
+        for name, r in report.items():
+            metrics.inc("bot_store_searches_total", store=name, status=r["status"])
+        logger.info("Поиск '%s' по магазинам: %s", search_query,
+                    ", ".join(f"{name} {r['status']} ({r['items']})" for name, r in report.items()))
+
+
+def _iter_store(store: StoreAdapter, search_query: str, max_results: int, deadline: float,
+                started: float | None = None):
+    """
+    Поиск в одном магазине на браузере из его пула. started — начало общего
+    поиска: лимит магазина тогда отсчитывается от него, включая ожидание браузера.
+    """
+    counts = {"cards": 0, "scrolls": 0}
+    if store.deadline is not None:
+        deadline = min(deadline, store.deadline)
+    checkout_started = time.perf_counter()
+    checkout_timeout = DRIVER_CHECKOUT_TIMEOUT
+    if started is not None:
+        checkout_timeout = min(checkout_timeout, max(started + deadline - time.monotonic(), 0.1))
+    try:
+        with get_driver_pool(store).driver(timeout=checkout_timeout) as driver:
+            metrics.observe("bot_stage_seconds", time.perf_counter() - checkout_started,
+                            stage="browser_checkout")
+            deadline_at = (started if started is not None else time.monotonic()) + deadline
+            yield from _iter_search(driver, search_query, max_results, deadline_at, counts, store)
+    finally:
+        # Пишется и при досрочном закрытии генератора — прокрутки к тому моменту уже были
+        metrics.observe("bot_search_cards", counts["cards"])
+        metrics.observe("bot_search_scrolls", counts["scrolls"])
+
+
+def run_parser(search_query: str, max_results: int = PARSER_MAX_RESULTS,
+               deadline: float = PARSER_DEADLINE):
+    """Весь результат поиска одним списком."""
+    products = []
+    for batch in iter_parser(search_query, max_results, deadline):
+        products.extend(batch)
+    return products
+
+
+def _iter_search(driver, search_query: str, max_results: int, deadline_at: float,
+                 counts: dict | None = None, store: StoreAdapter = GLORIA_JEANS):
+    """counts (если передан) получает число найденных карточек и прокруток."""
+    if counts is None:
+        counts = {"cards": 0, "scrolls": 0}
+    wait = support_ui.WebDriverWait(driver, 5)
+
+    def time_left() -> float:
+        return deadline_at - time.monotonic()
+
+    with metrics.span("search_page_wait"):
+        if not driver.current_url.startswith(store.search_url):
+            driver.get(store.search_url)
+        input_el = wait_for_search_input(driver, min(PAGE_LOAD_TIMEOUT, max(time_left(), 0.1)), store)
 
         input_el.click()
         input_el.clear()
         input_el.send_keys(search_query)
         input_el.send_keys(Keys.RETURN)
-        time.sleep(1.0)
 
         try:
-            WebDriverWait(driver, 8).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'a[href*="/product/"]'))
+            support_ui.WebDriverWait(driver, min(RESULTS_TIMEOUT, max(time_left(), 0.1))).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, store.results_selector))
             )
         except TimeoutException:
             # Просто нет товаров по запросу — вернём пустой список
-            logger.info(f"Нет товаров по запросу: {search_query}")
-            return []
+            logger.info(f"Нет товаров по запросу: {search_query} ({store.name})")
+            return
 
-        time.sleep(1.0)
+        driver.execute_script(INSTALL_DOM_OBSERVER_JS)
+        _wait_for_dom_quiet(driver, min(1.0, time_left()))
 
-        products = []
-        seen_links = set()
+    found = 0
+    seen_links = set()
 
-        # Первое извлечение
-        initial_items = extract_products(driver, wait)
-        for item in initial_items:
+    def collect() -> list:
+        batch = []
+        with metrics.span("search_extract"):
+            items = extract_new_products(driver, wait, store)
+        for item in items:
             link = item.get("link")
-            if link and link not in seen_links:
+            if link and link not in seen_links and found + len(batch) < max_results:
                 seen_links.add(link)
-                products.append(item)
+                batch.append(item)
+        counts["cards"] = found + len(batch)
+        return batch
+
+    # Первое извлечение — первая страница уходит пользователю, пока мы крутим дальше
+    batch = collect()
+    found += len(batch)
+    if batch:
+        yield batch
+
+    # -------- ПРОКРУТКА, ПОКА ВЫДАЧА РАСТЁТ --------
+    no_change_count = 0
+    scroll_count = 0
+
+    while (scroll_count < store.max_scrolls and no_change_count < store.no_change_limit
+           and found < max_results and time_left() > 0):
+        scroll_count += 1
+        counts["scrolls"] = scroll_count
+
+        mutations, height, _ = _dom_state(driver)
+        driver.execute_script(f"window.scrollBy(0, {store.scroll_step});")
+        at_bottom = _dom_state(driver)[2]
+
+        if at_bottom:
+            # Дошли до низа — ждём подгрузку следующей пачки, а не фиксированную паузу
+            with metrics.span("search_scroll_wait"):
+                changed = _wait_for_dom_change(
+                    driver, mutations, height, min(store.scroll_wait_timeout, time_left())
+                )
+                if changed:
+                    _wait_for_dom_quiet(driver, min(1.0, time_left()))
+        else:
+            changed = False
+
+        batch = collect()
+        found += len(batch)
+        if batch:
+            yield batch
+
+        if at_bottom and not changed and not batch:
+            no_change_count += 1
+        else:
+            no_change_count = 0
+
+    if time_left() <= 0:
+        logger.info(f"Запрос '{search_query}' в {store.name} остановлен по таймауту, найдено {found} товаров")
+
+
+# ====== Кэш результатов поиска ======
+# Общий для всех пользователей, переживает перезапуск бота
+SEARCH_CACHE_PATH = "search_cache.sqlite3"
+SEARCH_CACHE_TTL = 6 * 3600          # столько запись считается свежей, с
+SEARCH_CACHE_STALE_TTL = 24 * 3600   # столько ещё отдаём устаревшую запись, обновляя её в фоне, с
+SEARCH_CACHE_MAX_ENTRIES = 500
+
+_search_cache = None
+
+
+def get_search_cache() -> SearchCache:
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchCache(
+            SEARCH_CACHE_PATH,
+            ttl=SEARCH_CACHE_TTL,
+            stale_ttl=SEARCH_CACHE_STALE_TTL,
+            max_entries=SEARCH_CACHE_MAX_ENTRIES,
+        )
+    return _search_cache
 
-        # -------- ПЛАВНЫЙ СКРОЛЛИНГ ДО КОНЦА СТРАНИЦЫ --------
-        SCROLL_STEP = 900          # шаг прокрутки
-        SCROLL_DELAY = 1.0         # пауза после каждого шага
-        MAX_SCROLLS = 120          # защита от бесконечного цикла
-        NO_CHANGE_LIMIT = 5        # сколько раз подряд можно не видеть изменений
 
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        last_seen = len(seen_links)
-        no_change_count = 0
-        scroll_count = 0
+def _store_in_cache(stream: SearchStream):
+    """Сохраняет в кэш только полностью завершившийся поиск."""
+    if stream.cancelled or stream.error is not None or not stream.products:
+        return
+    products = list(stream.products)
+    asyncio.get_running_loop().run_in_executor(
+        None, get_search_cache().put, stream.query, products
+    )
 
-        while scroll_count < MAX_SCROLLS and no_change_count < NO_CHANGE_LIMIT:
-            scroll_count += 1
 
-            driver.execute_script(f"window.scrollBy(0, {SCROLL_STEP});")
-            time.sleep(SCROLL_DELAY)
+# ====== Индекс каталога ======
+# Каталог магазина обходится в фоне по всем сочетаниям цвет × тип (и CATALOG_EXTRA_SEEDS);
+# запросы отвечаются из локального индекса за миллисекунды, браузер — только если там пусто
+CATALOG_INDEX_PATH = "catalog_index.sqlite3"   # None — без индекса, всё ищется вживую
+CATALOG_CRAWL_ENABLED = os.environ.get("CATALOG_CRAWL", "1") == "1"
+CATALOG_EXTRA_SEEDS: list = []                 # дополнительные запросы для обхода
+CATALOG_REFRESH_INTERVAL = 12 * 3600           # как часто повторять один запрос обхода, с
+CATALOG_CRAWL_PAUSE = 5.0                      # пауза между запросами обхода, с
+CATALOG_MAX_AGE = 3 * 24 * 3600                # товар, столько не встречавшийся в выдаче, удаляется, с
+CATALOG_MIN_RESULTS = 5                        # если в индексе меньше — ищем в магазине
 
-            new_items = extract_products(driver, wait)
-            before = len(seen_links)
+_catalog_index = None
+_catalog_crawler = None
 
-            for item in new_items:
-                link = item.get("link")
-                if link and link not in seen_links:
-                    seen_links.add(link)
-                    products.append(item)
 
-            after = len(seen_links)
+def get_catalog_index() -> CatalogIndex:
+    global _catalog_index
+    if _catalog_index is None:
+        _catalog_index = CatalogIndex(CATALOG_INDEX_PATH, max_age=CATALOG_MAX_AGE)
+    return _catalog_index
 
-            new_height = driver.execute_script("return document.body.scrollHeight")
 
-            if new_height == last_height and after == last_seen:
-                no_change_count += 1
-            else:
-                no_change_count = 0
+def catalog_seeds() -> list:
+    """Запросы обхода: те же, что бот строит по распознанному фото, плюс CATALOG_EXTRA_SEEDS."""
+    seeds = [build_description_and_query(type_label, color_label)[1]
+             for type_label in TYPE_CLASSES for color_label in COLOR_CLASSES]
+    return [q for q in seeds if q] + list(CATALOG_EXTRA_SEEDS)
 
-            last_height = new_height
-            last_seen = after
 
-        return products
+def search_catalog(search_query: str) -> list | None:
+    """
+    Выдача из индекса каталога; «до 2000», «от 1000» и т.п. в запросе фильтруют по цене.
+    None — в индексе меньше CATALOG_MIN_RESULTS товаров, нужен живой поиск.
+    """
+    if not CATALOG_INDEX_PATH:
+        return None
+    text, min_price, max_price = parse_price_filter(search_query)
+    with metrics.span("catalog_search"):
+        products = get_catalog_index().search(
+            text, min_price=min_price, max_price=max_price,
+            # Кто ограничил цену сверху, тому сначала показываем подешевле
+            sort="price_asc" if max_price is not None else "relevance",
+            limit=PARSER_MAX_RESULTS,
+        )
+    return products if len(products) >= CATALOG_MIN_RESULTS else None
+
+
+def _add_to_catalog(stream: SearchStream):
+    """Всё, что нашёл живой поиск, пополняет индекс каталога."""
+    if not CATALOG_INDEX_PATH or stream.error is not None or not stream.products:
+        return
+    asyncio.get_running_loop().run_in_executor(None, get_catalog_index().upsert, list(stream.products))
+
+
+def _browsers_wanted() -> bool:
+    """Пользовательские поиски идут или ждут очереди — обход каталога уступает им браузер."""
+    for lane in (_search_lane, _prefetch_lane):
+        if lane is not None:
+            st = lane.stats()
+            if st["running"] or st["queued"]:
+                return True
+    return False
+
+
+def start_catalog_crawler() -> CatalogCrawler:
+    global _catalog_crawler
+    if _catalog_crawler is None:
+        _catalog_crawler = CatalogCrawler(
+            get_catalog_index(),
+            iter_parser,
+            catalog_seeds(),
+            interval=CATALOG_REFRESH_INTERVAL,
+            pause=CATALOG_CRAWL_PAUSE,
+            busy=_browsers_wanted,
+        )
+        _catalog_crawler.start()
+    return _catalog_crawler
+
+
+# ====== Хранилище выдач ======
+# Каждая выдача хранится один раз в упакованном виде, с уже нормализованными названием
+# и ценой; в user_data пользователя — только id выдачи и позиция
+RESULT_STORE_MAX_BYTES = 64 * 2 ** 20
+RESULT_STORE_MAX_AGE = 6 * 3600   # столько выдача живёт после последнего просмотра, с
+
+_result_store = None
+
+# Выдачи, которые парсер ещё наполняет: id выдачи -> SearchStream
+_live_streams: dict = {}
+
+
+def _normalize_product(product: dict) -> tuple:
+    return normalize_text(product.get("title", "")), normalize_price(product.get("price", ""))
+
+
+def _first_result_id() -> int:
+    if BOT_MODE != "worker":
+        return 1
+    # Выдачи попадают в общее хранилище сессий: id разных воркеров и разных запусков не должны совпадать
+    return (int.from_bytes(os.urandom(5), "big") << 20) + 1
+
+
+def get_result_store() -> ResultStore:
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore(
+            max_bytes=RESULT_STORE_MAX_BYTES,
+            max_age=RESULT_STORE_MAX_AGE,
+            normalize=_normalize_product,
+            first_id=_first_result_id(),
+        )
+    return _result_store
+
+
+def _finish_results(stream: SearchStream):
+    stream.products.done = True
+    _live_streams.pop(stream.products.id, None)
+    share_results(stream.products)
+
+
+# ====== Общие сессии ======
+# В режиме воркера (BOT_MODE=worker, см. sharding.py) user_data и выдачи лежат в общем
+# SQLite: чат может переехать в другой процесс, а процесс — перезапуститься
+SESSION_STORE_PATH = "sessions.sqlite3"
+SESSION_MAX_AGE = 30 * 24 * 3600   # столько хранится сессия после последнего апдейта, с
+
+_session_store = None
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore(SESSION_STORE_PATH, max_age=SESSION_MAX_AGE,
+                                      results_max_age=RESULT_STORE_MAX_AGE)
+    return _session_store
+
+
+def share_results(results: ResultSet):
+    """
+    Кладёт выдачу в общее хранилище, чтобы её страницы мог показать любой воркер.
+    Упаковка и запись — в пуле потоков; порядок записей не важен: хранилище не даст
+    затереть выдачу менее полной.
+    """
+    if _session_store is None or not len(results):
+        return
+    count, done = len(results), results.done
+    asyncio.get_running_loop().run_in_executor(
+        None, lambda: _session_store.save_results(results.id, results.query, results[:count], done)
+    )
+
+
+async def get_results(result_id) -> ResultSet | None:
+    """Выдача из памяти процесса, а если её там нет — из общего хранилища (чтение в пуле потоков)."""
+    store = get_result_store()
+    results = store.get(result_id)
+    if results is None and result_id is not None and _session_store is not None:
+        shared = await asyncio.get_running_loop().run_in_executor(
+            None, _session_store.load_results, result_id)
+        # Пока читали, выдачу мог поднять параллельный апдейт — берём уже созданную
+        results = store.get(result_id)
+        if results is None and shared is not None:
+            query, products, _done = shared
+            # Парсер, наполнявший выдачу, остался в другом процессе — дальше она не растёт
+            results = store.create(query, products=products, done=True, result_id=result_id)
+    return results
+
+
+def share_live_results():
+    """Перед остановкой воркера сохраняет всё, что успели найти незаконченные поиски."""
+    if _session_store is None:
+        return
+    for stream in list(_live_streams.values()):
+        results = stream.products
+        if len(results):
+            _session_store.save_results(results.id, results.query, results[:len(results)], results.done)
+
+
+# ====== Планировщик задач ======
+# Распознавание и парсинг идут через ограниченные полосы; ожидающие задачи
+# выбираются по кругу между чатами, переполненная очередь сразу получает отказ
+INFERENCE_LANE_CONCURRENCY = BATCH_MAX_SIZE   # столько фото одновременно, чтобы батчер мог собрать полный батч
+INFERENCE_LANE_THREADS = 4                    # потоки для декодирования и предобработки
+INFERENCE_LANE_MAX_QUEUE = 64
+INFERENCE_LANE_MAX_PER_USER = 5               # альбом из нескольких фото
+SEARCH_LANE_CONCURRENCY = DRIVER_POOL_SIZE    # больше браузеров всё равно нет
+SEARCH_LANE_MAX_QUEUE = 20
+SEARCH_LANE_MAX_PER_USER = 2                  # новый запрос встаёт в очередь раньше, чем снимается прошлый
+SEARCH_REFRESH_KEY = "cache-refresh"          # «пользователь» полосы для фоновых обновлений кэша поиска
+PREFETCH_CONCURRENCY = 1                      # браузеров под упреждающий поиск, не больше
+
+_inference_lane = None
+_search_lane = None
+_prefetch_lane = None
+
+
+def get_inference_lane() -> Lane:
+    global _inference_lane
+    if _inference_lane is None:
+        _inference_lane = Lane(
+            "inference",
+            concurrency=INFERENCE_LANE_CONCURRENCY,
+            max_queue=INFERENCE_LANE_MAX_QUEUE,
+            max_per_key=INFERENCE_LANE_MAX_PER_USER,
+            threads=INFERENCE_LANE_THREADS,
+        )
+    return _inference_lane
+
+
+def get_search_lane() -> Lane:
+    global _search_lane
+    if _search_lane is None:
+        _search_lane = Lane(
+            "search",
+            concurrency=SEARCH_LANE_CONCURRENCY,
+            max_queue=SEARCH_LANE_MAX_QUEUE,
+            max_per_key=SEARCH_LANE_MAX_PER_USER,
+        )
+    return _search_lane
+
+
+def get_prefetch_lane() -> Lane:
+    """Упреждающий поиск: своя полоса, в очереди не ждёт — запускается только на свободный браузер."""
+    global _prefetch_lane
+    if _prefetch_lane is None:
+        _prefetch_lane = Lane("prefetch", concurrency=PREFETCH_CONCURRENCY, max_queue=PREFETCH_CONCURRENCY)
+    return _prefetch_lane
+
+
+# ====== Потоковый поиск ======
+MORE_WAIT_TIMEOUT = 5.0   # сколько "Показать ещё" ждёт догрузки, если пользователь обогнал парсер
+
+
+# Одинаковые запросы, пришедшие одновременно от разных пользователей, читают одну выдачу
+_search_flights = SingleFlight()
 
-    finally:
-        driver.quit()
+
+def _index_products(stream: SearchStream):
+    """Всё, что нашёл парсер (даже если поиск прервали), пополняет визуальный индекс."""
+    if VISUAL_SEARCH_ENABLED and VISUAL_INDEX_WRITER and stream.products:
+        get_visual_indexer().submit(list(stream.products))
+
+
+def _start_stream(search_query: str, chat_id, lane: Lane | None = None) -> SearchStream:
+    results = get_result_store().create(search_query, key=normalize_query(search_query))
+    stream = SearchStream(search_query, products=results)
+    _live_streams[results.id] = stream
+    stream.add_done_callback(_finish_results)
+    stream.add_done_callback(_store_in_cache)
+    stream.add_done_callback(_add_to_catalog)
+    stream.add_done_callback(_index_products)
+    lane = lane or get_search_lane()
+    try:
+        job = lane.submit(chat_id, lambda: stream.start(iter_parser, search_query, executor=lane.executor))
+    except LaneFull:
+        stream.finish()
+        raise
+    if lane is _search_lane and _prefetch_lane is not None:
+        search, prefetch = lane.stats(), _prefetch_lane.stats()
+        if search["running"] + search["queued"] + prefetch["running"] > SEARCH_LANE_CONCURRENCY:
+            # Браузеров на всех не хватит — упреждающий поиск уступает обычному
+            get_prefetcher().preempt()
+    # Если поиск стал никому не нужен, пока ждал очереди, — снимаем его и сразу завершаем
+    stream.add_cancel_callback(lambda s: job.cancel() and s.finish())
+    return stream
+
+
+def refresh_search(search_query: str):
+    """
+    Обновляет устаревшую запись кэша поиска обычным живым поиском: через полосу поиска
+    (браузеры по очереди, обход каталога уступает) и single-flight с пользовательскими
+    поисками. Результат попадает в кэш, как у любого завершённого поиска.
+    """
+    try:
+        stream, created = _search_flights.run(
+            normalize_query(search_query), lambda: _start_stream(search_query, SEARCH_REFRESH_KEY)
+        )
+    except LaneFull:
+        logger.info(f"Очередь поиска переполнена, обновление кэша для '{search_query}' отложено")
+        get_search_cache().count_refresh("deferred")
+        return
+    if created:
+        get_search_cache().count_refresh("started")
+        # Пользователь, присоединившийся к обновлению и ушедший, не должен его отменить
+        stream.subscribe()
+        stream.add_done_callback(_refresh_done)
+
+
+def _refresh_done(stream: SearchStream):
+    stream.unsubscribe()
+    if stream.cancelled or stream.error is not None:
+        get_search_cache().count_refresh("failed")
+
+
+async def start_search(context: ContextTypes.DEFAULT_TYPE, search_query: str, chat_id) -> SearchStream:
+    """
+    Запускает парсер в фоне или присоединяется к уже идущему поиску с тем же запросом.
+    От предыдущего поиска пользователь отписывается: он остановится (или уйдёт из очереди),
+    если больше никому не нужен. Бросает LaneFull, если очередь поиска переполнена.
+    """
+    loop = asyncio.get_running_loop()
+    store = get_result_store()
+    key = normalize_query(search_query)
+    # Недавнюю выдачу по тому же запросу читаем из памяти, не копируя
+    results = store.find(key, max_age=SEARCH_CACHE_TTL)
+    if results is None:
+        # SQLite и разбор JSON — не в event loop
+        cached = await loop.run_in_executor(None, get_search_cache().get, search_query)
+        if cached is not None:
+            products, stale = cached
+            # Устаревшую выдачу не отдаём другим через find: к ним придёт уже обновлённая
+            results = store.create(search_query, key=None if stale else key, products=products, done=True)
+            if stale:
+                # Отдаём устаревшее сразу, свежую выдачу подтягиваем в фоне
+                refresh_search(search_query)
+
+    if results is None:
+        products = await loop.run_in_executor(None, search_catalog, search_query)
+        if products is not None:
+            results = store.create(search_query, key=key, products=products, done=True)
+
+    if results is not None:
+        stream = SearchStream(search_query, products=results)
+        stream.finish()
+    else:
+        stream, created = _search_flights.run(
+            normalize_query(search_query), lambda: _start_stream(search_query, chat_id)
+        )
+        if not created:
+            logger.info(f"Присоединяюсь к уже идущему поиску: {search_query}")
+
+    set_user_search(context, stream)
+    return stream
+
+
+def set_user_search(context: ContextTypes.DEFAULT_TYPE, stream: SearchStream):
+    """
+    Делает выдачу stream текущей для пользователя и отписывает его от прошлого поиска,
+    если тот ещё идёт. В user_data сохраняются только id выдачи и позиция.
+    """
+    previous = _live_streams.get(context.user_data.get("result_id"))
+    stream.subscribe()
+    if previous is not None:
+        previous.unsubscribe()
+    context.user_data["result_id"] = stream.products.id
+    context.user_data["cursor"] = 0
+    if stream.done:
+        share_results(stream.products)
+
+
+async def run_search(update: Update, context: ContextTypes.DEFAULT_TYPE, search_query: str,
+                     not_found_text: str):
+    """Отправляет первую страницу, как только парсер нашёл PAGE_SIZE товаров; остальное догружается в фоне."""
+    chat_id = update.effective_chat.id
+    stream = await start_search(context, search_query, chat_id)
+
+    position = get_search_lane().position(chat_id)
+    if position:
+        await reply_status(
+            update,
+            f"⏳ Все браузеры заняты, ваш запрос {position}-й в очереди. Начну поиск, как только подойдёт очередь."
+        )
+    elif not stream.done and not browser_subsystem.ready:
+        await reply_status(
+            update, "⏳ Бот только что перезапустился и ещё запускает браузер, первый поиск займёт чуть дольше."
+        )
+
+    await stream.wait_for(PAGE_SIZE)
+
+    if context.user_data.get("result_id") != stream.products.id:
+        # Апдейты обрабатываются параллельно: пользователь уже начал новый поиск, этот ему не нужен
+        return
+
+    if not stream.products:
+        if stream.error is not None:
+            raise stream.error
+        await update.effective_message.reply_text(not_found_text)
+        return
+
+    await send_products_page(update, context, start_idx=0)
+
+
+# ====== Упреждающий поиск ======
+# Пока пользователь решает, «Да» или «Нет», поиск по распознанному запросу уже идёт
+PREFETCH_ENABLED = True
+PREFETCH_ALTERNATIVES = 1   # сколько запасных вариантов распознавания искать заранее
+PREFETCH_TTL = 60.0         # сколько упреждающий поиск ждёт нажатия кнопки, с
+
+_prefetcher = None
+
+
+def _start_prefetch(chat_id, search_query: str) -> SearchStream | None:
+    """Запускает упреждающий поиск, только если выдачи ещё нет и есть свободный браузер."""
+    key = normalize_query(search_query)
+    # Кэш поиска и индекс каталога уже проверены в prefetch_prediction
+    if not key or get_result_store().find(key, max_age=SEARCH_CACHE_TTL) is not None:
+        return None
+    search, prefetch = get_search_lane().stats(), get_prefetch_lane().stats()
+    busy = search["running"] + search["queued"] + prefetch["running"]
+    if busy >= SEARCH_LANE_CONCURRENCY or prefetch["running"] >= PREFETCH_CONCURRENCY:
+        return None
+    stream, _ = _search_flights.run(key, lambda: _start_stream(search_query, chat_id, lane=get_prefetch_lane()))
+    return stream
+
+
+def get_prefetcher() -> Prefetcher:
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = Prefetcher(_start_prefetch, ttl=PREFETCH_TTL)
+    return _prefetcher
+
+
+def _needs_live_search(queries: list) -> list:
+    """
+    Запросы, выдачи по которым нет ни в кэше поиска, ни в индексе каталога.
+    Читает SQLite — вызывается в пуле потоков.
+    """
+    cache = get_search_cache()
+    return [q for q in queries if not cache.contains(q) and search_catalog(q) is None]
+
+
+async def prefetch_prediction(chat_id, prediction: dict):
+    """Ищет заранее распознанный запрос и первые PREFETCH_ALTERNATIVES запасных вариантов."""
+    if not PREFETCH_ENABLED:
+        return
+    queries = [prediction["search_query"]]
+    queries += [alt["search_query"] for alt in prediction["alternatives"][:PREFETCH_ALTERNATIVES]]
+    queries = await asyncio.get_running_loop().run_in_executor(
+        None, _needs_live_search, [q for q in queries if q])
+    get_prefetcher().speculate(chat_id, queries)
 
 
 # ====== Вспомогательная функция для отправки товарами страницами ======
@@ -456,20 +1478,71 @@ PAGE_SIZE = 15
 
 
 async def send_products_page(update: Update, context: ContextTypes.DEFAULT_TYPE, start_idx: int = 0):
-    products = context.user_data.get("products", [])
+    result_id = context.user_data.get("result_id")
+    products = await get_results(result_id)
+    if products is None:
+        text = ("Результаты поиска устарели, повторите поиск." if result_id is not None
+                else "Список товаров пуст, попробуйте поиск заново.")
+        await update.effective_message.reply_text(text)
+        return
     if not products:
         await update.effective_message.reply_text("Список товаров пуст, попробуйте поиск заново.")
         return
 
+    stream = _live_streams.get(result_id)
+    if stream is not None and start_idx + PAGE_SIZE > len(products):
+        await stream.wait_for(start_idx + PAGE_SIZE, timeout=MORE_WAIT_TIMEOUT)
+
+    if start_idx >= len(products):
+        if products.done:
+            await update.effective_message.reply_text("Больше товаров не нашлось.")
+        else:
+            keyboard = [[InlineKeyboardButton("Показать ещё", callback_data=f"more:{start_idx}")]]
+            await update.effective_message.reply_text(
+                "⏳ Товары ещё загружаются, нажмите «Показать ещё» через пару секунд.",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+            )
+        return
+
+    with metrics.span("page_render"):
+        text, end_idx = _render_products_page(products, start_idx, products.done)
+    context.user_data["cursor"] = end_idx
+    if not products.done:
+        # Поиск ещё идёт: показанное уже должно быть доступно другим воркерам
+        share_results(products)
+
+    reply_markup = None
+    if end_idx < len(products) or not products.done:
+        keyboard = [
+            [InlineKeyboardButton("Показать ещё", callback_data=f"more:{end_idx}")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+    with metrics.span("send_message"):
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            parse_mode='Markdown',
+            disable_web_page_preview=True,
+            reply_markup=reply_markup
+        )
+
+
+def _render_products_page(products, start_idx: int, done: bool) -> tuple:
+    """
+    Текст страницы товаров с start_idx и индекс начала следующей страницы.
+    Название и цена уже нормализованы при добавлении в хранилище выдач.
+    """
     end_idx = min(start_idx + PAGE_SIZE, len(products))
     chunk = products[start_idx:end_idx]
 
-    message_lines = [f"✅ Товары {start_idx + 1}–{end_idx} из {len(products)}:\n\n"]
+    total = f"{len(products)}" if done else f"{len(products)}+ (поиск продолжается)"
+    message_lines = [f"✅ Товары {start_idx + 1}–{end_idx} из {total}:\n\n"]
 
     for i, product in enumerate(chunk, start=start_idx + 1):
-        title = normalize_text(product.get("title", ""))
-        price = normalize_price(product.get("price", ""))
-        link = product.get("link", "")
+        title = product["title"]
+        price = product["price"]
+        link = product["link"]
 
         if len(title) > 80:
             title = title[:77] + "..."
@@ -482,24 +1555,94 @@ async def send_products_page(update: Update, context: ContextTypes.DEFAULT_TYPE,
         product_line += "\n"
         message_lines.append(product_line)
 
-    text = "".join(message_lines)
+    return "".join(message_lines), end_idx
+
+
+# ====== Отправка сообщений ======
+# Все запросы к Bot API идут через очередь: лимиты Telegram на чат и на бота
+# соблюдаются заранее, а не через ошибки 429
+SEND_QUEUE_ENABLED = True
+SEND_GLOBAL_RATE = 30.0      # сообщений в секунду на всего бота
+SEND_CHAT_INTERVAL = 1.0     # средняя пауза между сообщениями в личный чат, с
+SEND_GROUP_INTERVAL = 3.0    # в группу, с
+SEND_CHAT_BURST = 3          # столько сообщений в чат уходят подряд без паузы
+
+_send_queue = None
 
-    reply_markup = None
-    if end_idx < len(products):
-        keyboard = [
-            [InlineKeyboardButton("Показать ещё", callback_data=f"more:{end_idx}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=text,
-        parse_mode='Markdown',
-        disable_web_page_preview=True,
-        reply_markup=reply_markup
+def get_send_queue() -> SendQueue:
+    global _send_queue
+    if _send_queue is None:
+        _send_queue = SendQueue(
+            # Лимит Telegram общий на бота — воркеры делят его поровну (см. set_shard_workers)
+            global_rate=SEND_GLOBAL_RATE / SHARD_WORKERS,
+            chat_interval=SEND_CHAT_INTERVAL,
+            group_interval=SEND_GROUP_INTERVAL,
+            chat_burst=SEND_CHAT_BURST,
+        )
+    return _send_queue
+
+
+def set_shard_workers(n: int):
+    """Фронт сообщил, сколько сейчас воркеров: пересчитываем свою долю общего лимита отправки."""
+    if SEND_QUEUE_ENABLED:
+        get_send_queue().global_rate = SEND_GLOBAL_RATE / max(1, n)
+        logger.info(f"Воркеров: {n}, лимит отправки этого процесса: {SEND_GLOBAL_RATE / max(1, n):.1f} в секунду")
+
+
+async def reply_status(update: Update, text: str):
+    """
+    Служебное сообщение ("ищу...", "вы N-й в очереди"). Если оно ещё не ушло,
+    а в чат уже отправляется что-то новее, очередь его не отправит.
+    """
+    if not SEND_QUEUE_ENABLED:
+        return await update.effective_message.reply_text(text)
+    return await update.get_bot().send_message(
+        chat_id=update.effective_chat.id, text=text, rate_limit_args=STATUS
     )
 
 
+# ====== Быстрый старт ======
+# Бот начинает принимать сообщения сразу, модель и браузеры догружаются в фоне
+STARTUP_PRELOAD = True
+READY_WAIT_TIMEOUT = 30.0   # сколько хендлер ждёт догружающуюся подсистему, с
+
+
+def _preload_model():
+    with startup_report.step("model_load"):
+        get_model()
+    with startup_report.step("model_warmup"):
+        dtype = np.uint8 if INFERENCE_WORKERS else np.float32
+        dummy = np.zeros((1, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=dtype)
+        # Свободные процессы инференса выдаются по кругу — прогреется каждый
+        for _ in range(max(1, INFERENCE_WORKERS)):
+            predict_labels_batch(dummy)
+    get_batcher()
+    get_inference_cache()
+
+
+def _preload_browsers():
+    # Обращение к атрибутам выполняет отложенные импорты
+    uc.Chrome, EC.presence_of_element_located, support_ui.WebDriverWait
+    pools = [get_driver_pool(store) for store in search_stores()]
+    with startup_report.step("first_browser"):
+        deadline = time.monotonic() + DRIVER_CHECKOUT_TIMEOUT
+        while any(pool.stats()["idle"] == 0 for pool in pools) and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+
+model_subsystem = Subsystem("model", _preload_model)
+browser_subsystem = Subsystem("browsers", _preload_browsers)
+
+
+async def wait_until_ready(update: Update, subsystem: Subsystem, waiting_text: str) -> bool:
+    """Если подсистема ещё грузится — предупреждает пользователя и ждёт READY_WAIT_TIMEOUT."""
+    if subsystem.ready:
+        return True
+    await reply_status(update, waiting_text)
+    return await subsystem.wait(READY_WAIT_TIMEOUT)
+
+
 # ====== Telegram Bot Handlers ======
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -514,26 +1657,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, введите поисковый запрос")
         return
 
-    await update.message.reply_text(f"🔍 Ищу товары по запросу: {search_query}...")
+    await reply_status(update, f"🔍 Ищу товары по запросу: {search_query}...")
+    metrics.inc("bot_requests_total", kind="text")
+    # Пользователь не стал ждать кнопок и пишет сам — заранее начатые поиски не пригодятся
+    get_prefetcher().release(update.effective_chat.id)
 
     try:
-        products = await asyncio.get_event_loop().run_in_executor(
-            None, run_parser, search_query
-        )
-
-        valid_products = []
-        for product in products:
-            title = product.get("title", "").strip()
-            link = product.get("link", "").strip()
-            if title or link:
-                valid_products.append(product)
+        with metrics.span("search_first_page"):
+            await run_search(update, context, search_query, "❌ Товары не найдены")
 
-        if not valid_products:
-            await update.message.reply_text("❌ Товары не найдены")
-            return
-
-        context.user_data["products"] = valid_products
-        await send_products_page(update, context, start_idx=0)
+    except (DriverPoolTimeout, LaneFull):
+        await update.message.reply_text("⏳ Сейчас слишком много запросов, попробуйте через минуту")
 
     except Exception as e:
         logger.error(f"Ошибка парсера: {e}")
@@ -546,30 +1680,45 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.photo:
         return
 
-    photo = update.message.photo[-1]  # самая большая по размеру
-    file = await photo.get_file()
-    bio = BytesIO()
-    await file.download_to_memory(out=bio)
-    image_bytes = bio.getvalue()
+    photo = choose_photo_size(update.message.photo)
+    metrics.inc("bot_requests_total", kind="photo")
 
     try:
-        loop = asyncio.get_event_loop()
-        type_label, color_label, print_label = await loop.run_in_executor(
-            None, predict_labels_from_bytes, image_bytes
-        )
+        if not await wait_until_ready(
+                update, model_subsystem,
+                "⏳ Бот только что перезапустился и ещё загружает модель, фото распознаю через несколько секунд."):
+            await update.message.reply_text("Модель всё ещё загружается, пришлите фото через минуту.")
+            return
+
+        job = get_inference_lane().submit(update.effective_chat.id, lambda: classify_photo(photo))
+        if job.position:
+            await reply_status(update, f"⏳ Фото в очереди на распознавание: {job.position}-е")
+
+        with metrics.span("photo_total"):
+            labels = await job
+        type_label, color_label, print_label = labels[:3]
 
         description, search_query = build_description_and_query(
             type_label, color_label, print_label
         )
-
-        # Сохраним в user_data, чтобы использовать при "Да"
-        context.user_data["last_prediction"] = {
+        alternatives = []
+        for alt_type, alt_color, _prob in (labels[3] if len(labels) > 3 else []):
+            alt_description, alt_query = build_description_and_query(alt_type, alt_color)
+            if alt_query and alt_query != search_query \
+                    and all(alt["search_query"] != alt_query for alt in alternatives):
+                alternatives.append({"description": alt_description, "search_query": alt_query})
+
+        # Сохраним в user_data, чтобы использовать при "Да" и "Нет"
+        prediction = context.user_data["last_prediction"] = {
             "type": type_label,
             "color": color_label,
             "print": print_label,
             "description": description,
             "search_query": search_query,
+            "alternatives": alternatives,
+            "photo_file_id": photo.file_id,
         }
+        await prefetch_prediction(update.effective_chat.id, prediction)
 
         keyboard = [
             [
@@ -577,13 +1726,19 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 InlineKeyboardButton("Нет, это не то", callback_data="confirm:no"),
             ]
         ]
+        if VISUAL_SEARCH_ENABLED and len(get_visual_index()):
+            keyboard.append([InlineKeyboardButton("🖼 Похожие по фото", callback_data="similar:")])
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(
-            f"Я думаю, на фото: {description}.\n"
-            f"Искать такие товары в магазине?",
-            reply_markup=reply_markup,
-        )
+        with metrics.span("send_message"):
+            await update.message.reply_text(
+                f"Я думаю, на фото: {description}.\n"
+                f"Искать такие товары в магазине?",
+                reply_markup=reply_markup,
+            )
+
+    except LaneFull:
+        await update.message.reply_text("⏳ Сейчас слишком много фото на распознавании, попробуйте через минуту")
 
     except Exception as e:
         logger.exception("Ошибка при распознавании изображения: %s", e)
@@ -593,6 +1748,51 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def show_similar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки 'Похожие по фото' — поиск по визуальному индексу."""
+    query = update.callback_query
+    await query.answer()
+
+    pred = context.user_data.get("last_prediction")
+    if not pred or not pred.get("photo_file_id"):
+        await query.message.reply_text(
+            "Не нашёл последнее фото. Пожалуйста, отправьте его ещё раз."
+        )
+        return
+
+    try:
+        if not await wait_until_ready(update, model_subsystem, "⏳ Модель ещё загружается, подождите немного."):
+            await query.message.reply_text("Модель всё ещё загружается, попробуйте через минуту.")
+            return
+
+        file = await context.bot.get_file(pred["photo_file_id"])
+        bio = BytesIO()
+        await file.download_to_memory(out=bio)
+
+        lane = get_inference_lane()
+        image_bytes = bio.getvalue()
+        products = await lane.run(
+            update.effective_chat.id,
+            lambda: asyncio.get_running_loop().run_in_executor(lane.executor, find_similar_products, image_bytes),
+        )
+        if not products:
+            await query.message.reply_text("❌ Похожие товары не найдены")
+            return
+
+        results = get_result_store().create(pred.get("description", "фото"), products=products, done=True)
+        stream = SearchStream(results.query, products=results)
+        stream.finish()
+        set_user_search(context, stream)
+        await send_products_page(update, context, start_idx=0)
+
+    except LaneFull:
+        await query.message.reply_text("⏳ Сейчас слишком много запросов, попробуйте через минуту")
+
+    except Exception as e:
+        logger.exception("Ошибка визуального поиска: %s", e)
+        await query.message.reply_text("❌ Произошла ошибка при поиске похожих товаров")
+
+
 async def show_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки 'Показать ещё'."""
     query = update.callback_query
@@ -610,6 +1810,32 @@ async def show_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_products_page(update, context, start_idx=start_idx)
 
 
+async def search_prediction(update: Update, context: ContextTypes.DEFAULT_TYPE, description: str,
+                            search_query: str):
+    """Поиск по выбранному варианту распознавания; остальные заранее начатые поиски снимаются."""
+    prefetcher = get_prefetcher()
+    chat_id = update.effective_chat.id
+    if prefetcher.claim(chat_id, search_query):
+        logger.info(f"Поиск '{search_query}' начат заранее, пока пользователь выбирал")
+    prefetcher.release(chat_id)
+
+    await reply_status(
+        update,
+        f"🔍 Ищу товары, похожие на: {description}\n"
+        f"(по запросу: {search_query})"
+    )
+
+    try:
+        await run_search(update, context, search_query, "❌ Похожие товары не найдены")
+
+    except (DriverPoolTimeout, LaneFull):
+        await update.effective_message.reply_text("⏳ Сейчас слишком много запросов, попробуйте через минуту")
+
+    except Exception as e:
+        logger.error(f"Ошибка парсера (confirm): {e}")
+        await update.effective_message.reply_text("❌ Произошла ошибка при поиске товаров")
+
+
 async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик подтверждения распознанного фото."""
     query = update.callback_query
@@ -617,9 +1843,9 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     data = query.data or ""
     choice = data.split(":", 1)[1] if ":" in data else ""
+    pred = context.user_data.get("last_prediction")
 
     if choice == "yes":
-        pred = context.user_data.get("last_prediction")
         if not pred:
             await query.message.reply_text(
                 "Не нашёл последнее распознанное фото. "
@@ -627,52 +1853,286 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        search_query = pred["search_query"]
-        description = pred["description"]
+        await search_prediction(update, context, pred["description"], pred["search_query"])
 
-        await query.message.reply_text(
-            f"🔍 Ищу товары, похожие на: {description}\n"
-            f"(по запросу: {search_query})"
-        )
-
-        try:
-            products = await asyncio.get_event_loop().run_in_executor(
-                None, run_parser, search_query
+    else:
+        alternatives = pred.get("alternatives") if pred else None
+        if pred:
+            get_prefetcher().discard(update.effective_chat.id, pred["search_query"])
+        if alternatives:
+            # Предлагаем следующие по вероятности варианты — их поиск, возможно, уже идёт
+            keyboard = [[InlineKeyboardButton(alt["description"], callback_data=f"alt:{i}")]
+                        for i, alt in enumerate(alternatives)]
+            await query.message.reply_text(
+                "Может быть, на фото одно из этого? Если нет — напишите, что вы хотите найти, "
+                "в виде текста (например: серые джинсы).",
+                reply_markup=InlineKeyboardMarkup(keyboard),
             )
+            return
 
-            valid_products = []
-            for product in products:
-                title = product.get("title", "").strip()
-                link = product.get("link", "").strip()
-                if title or link:
-                    valid_products.append(product)
-
-            if not valid_products:
-                await query.message.reply_text("❌ Похожие товары не найдены")
-                return
-
-            context.user_data["products"] = valid_products
-            await send_products_page(update, context, start_idx=0)
-
-        except Exception as e:
-            logger.error(f"Ошибка парсера (confirm): {e}")
-            await query.message.reply_text("❌ Произошла ошибка при поиске товаров")
-
-    else:
         # Пользователь не согласился — просим текстовый запрос
+        get_prefetcher().release(update.effective_chat.id)
         await query.message.reply_text(
             "Хорошо, тогда напишите, пожалуйста, что вы хотите найти "
             "в виде текста (например: серые джинсы)."
         )
 
 
+async def handle_alternative(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик выбора запасного варианта распознавания после «Нет»."""
+    query = update.callback_query
+    await query.answer()
+
+    pred = context.user_data.get("last_prediction")
+    try:
+        alternative = pred["alternatives"][int((query.data or "").split(":", 1)[1])]
+    except (TypeError, KeyError, IndexError, ValueError):
+        await query.message.reply_text(
+            "Не нашёл последнее распознанное фото. "
+            "Пожалуйста, отправьте текстовый запрос."
+        )
+        return
+
+    await search_prediction(update, context, alternative["description"], alternative["search_query"])
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
 
+# ====== Метрики ======
+# Время стадий, очереди, браузеры и кэши; при выключенных метриках вызовы почти ничего не стоят
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_ADDR = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))   # 0 — не поднимать /metrics
+
+
+def _labelled(values: dict, label: str) -> dict:
+    return {((label, k),): v for k, v in values.items()}
+
+
+def setup_metrics():
+    metrics.configure(enabled=True)
+    metrics.describe("bot_stage_seconds", "histogram", "Время стадий обработки запроса, с")
+    metrics.describe("bot_requests_total", "counter", "Запросы пользователей по типу")
+    metrics.describe("bot_searches_total", "counter", "Запуски парсера")
+    metrics.describe("bot_search_cards", "histogram", "Карточек товаров за один поиск",
+                     buckets=(0, 15, 30, 60, 120, 200, 300, 500, 1000))
+    metrics.describe("bot_search_scrolls", "histogram", "Прокруток страницы за один поиск",
+                     buckets=(0, 1, 2, 5, 10, 20, 40, 80, 120))
+    metrics.describe("bot_store_searches_total", "counter",
+                     "Поиски по магазинам при параллельном опросе: ok, timeout, error, cancelled")
+    metrics.describe("bot_inference_batch_size", "histogram", "Картинок в одном прогоне модели",
+                     buckets=(1, 2, 4, 8, 16, 32))
+
+    metrics.register_callback(
+        "bot_inference_queue_depth", "gauge", "Картинок в очереди батчера",
+        lambda: _batcher.queue_depth() if _batcher is not None else 0,
+    )
+
+    def browsers():
+        values = {}
+        for name, pool in list(_driver_pools.items()):
+            st = pool.stats()
+            for state, v in (("live", st["live"]), ("idle", st["idle"]), ("busy", st["live"] - st["idle"])):
+                values[(("state", state), ("store", name))] = v
+        return values
+
+    def browser_events():
+        values = {}
+        for name, pool in list(_driver_pools.items()):
+            st = pool.stats()
+            for event in ("created", "recycled", "crashed"):
+                values[(("event", event), ("store", name))] = st[event]
+        return values
+
+    def search_cache():
+        if _search_cache is None:
+            return {}
+        st = _search_cache.stats()
+        return _labelled({"hit": st["hits"], "stale": st["stale_hits"], "miss": st["misses"]}, "result")
+
+    def search_cache_refreshes():
+        if _search_cache is None:
+            return {}
+        st = _search_cache.stats()
+        return _labelled({"started": st["refreshes"], "failed": st["refresh_errors"],
+                          "deferred": st["refresh_deferred"]}, "result")
+
+    def inference_cache():
+        if _inference_cache is None:
+            return {}
+        st = _inference_cache.stats()
+        return _labelled({"file_id": st["file_id_hits"], "phash": st["phash_hits"], "miss": st["misses"]},
+                         "result")
+
+    metrics.register_callback("bot_browsers", "gauge", "Браузеры в пуле", browsers)
+    metrics.register_callback("bot_browser_events_total", "counter", "Создание и пересоздание браузеров",
+                              browser_events)
+    metrics.register_callback("bot_search_cache_lookups_total", "counter", "Обращения к кэшу поиска",
+                              search_cache)
+    metrics.register_callback("bot_search_cache_refreshes_total", "counter",
+                              "Обновления устаревших записей кэша поиска", search_cache_refreshes)
+    metrics.register_callback("bot_inference_cache_lookups_total", "counter",
+                              "Обращения к кэшу распознавания", inference_cache)
+    def lanes(field):
+        def read():
+            return {(("lane", lane.name),): lane.stats()[field]
+                    for lane in (_inference_lane, _search_lane, _prefetch_lane) if lane is not None}
+        return read
+
+    metrics.register_callback("bot_lane_running", "gauge", "Выполняющиеся задачи планировщика", lanes("running"))
+    metrics.register_callback("bot_lane_queued", "gauge", "Задачи, ждущие в очереди планировщика", lanes("queued"))
+    metrics.register_callback("bot_lane_rejected_total", "counter", "Задачи, отклонённые из-за переполнения",
+                              lanes("rejected"))
+    metrics.register_callback("bot_lane_cancelled_total", "counter", "Задачи, снятые с очереди",
+                              lanes("cancelled"))
+    def inference_workers():
+        if not isinstance(_model, InferenceWorkerPool):
+            return {}
+        st = _model.stats()
+        return _labelled({"alive": st["alive"], "idle": st["idle"]}, "state")
+
+    metrics.register_callback("bot_inference_workers", "gauge", "Процессы инференса", inference_workers)
+    metrics.register_callback(
+        "bot_inference_worker_restarts_total", "counter", "Перезапуски упавших процессов инференса",
+        lambda: _model.restarts if isinstance(_model, InferenceWorkerPool) else 0,
+    )
+    metrics.register_callback(
+        "bot_subsystem_ready", "gauge", "Догружена ли подсистема после старта",
+        lambda: {(("subsystem", s.name),): int(s.ready) for s in (model_subsystem, browser_subsystem)},
+    )
+    def result_store():
+        if _result_store is None:
+            return {}
+        st = _result_store.stats()
+        return _labelled({k: st[k] for k in ("sets", "items", "bytes")}, "kind")
+
+    def prefetch():
+        if _prefetcher is None:
+            return {}
+        st = _prefetcher.stats()
+        return _labelled({"started": st["started"], "skipped": st["skipped"], "hit": st["hits"],
+                          "wasted": st["wasted"], "preempted": st["preempted"]}, "result")
+
+    def prefetch_ratio():
+        if _prefetcher is None:
+            return {}
+        st = _prefetcher.stats()
+        return _labelled({"hit": st["hit_ratio"], "waste": st["waste_ratio"]}, "kind")
+
+    def catalog(fields, label):
+        def read():
+            if _catalog_index is None:
+                return {}
+            st = _catalog_index.stats()
+            return _labelled({name: st[key] for name, key in fields.items()}, label)
+        return read
+
+    def catalog_crawl():
+        if _catalog_crawler is None:
+            return {}
+        st = _catalog_crawler.stats()
+        return _labelled({k: st[k] for k in ("crawled", "interrupted", "failed")}, "result")
+
+    def session_store():
+        if _session_store is None:
+            return {}
+        st = _session_store.stats()
+        return _labelled({"load": st["loads"], "save": st["saves"], "results_load": st["results_loaded"],
+                          "results_save": st["results_saved"]}, "op")
+
+    def send_queue(field):
+        return lambda: _send_queue.stats()[field] if _send_queue is not None else 0
+
+    metrics.register_callback("bot_send_queue_depth", "gauge", "Сообщения, ждущие в очереди отправки",
+                              send_queue("queued"))
+    metrics.register_callback("bot_send_queue_dropped_total", "counter",
+                              "Служебные сообщения, вытесненные более новыми", send_queue("dropped"))
+    metrics.register_callback("bot_send_queue_retried_total", "counter", "Повторы после RetryAfter от Telegram",
+                              send_queue("retried"))
+    metrics.register_callback("bot_prefetch_total", "counter",
+                              "Упреждающие поиски: запущенные, пропущенные, пригодившиеся, напрасные",
+                              prefetch)
+    metrics.register_callback("bot_prefetch_ratio", "gauge", "Доля пригодившихся и напрасных упреждающих поисков",
+                              prefetch_ratio)
+    metrics.register_callback("bot_catalog_products", "gauge", "Товаров в индексе каталога",
+                              lambda: _catalog_index.stats()["products"] if _catalog_index is not None else 0)
+    metrics.register_callback("bot_catalog_lookups_total", "counter", "Поиски по индексу каталога",
+                              catalog({"hit": "hits", "miss": "misses"}, "result"))
+    metrics.register_callback("bot_catalog_updates_total", "counter",
+                              "Товары, добавленные, изменённые, подтверждённые и удалённые обходом",
+                              catalog({"added": "added", "changed": "changed", "unchanged": "unchanged",
+                                       "removed": "removed"}, "kind"))
+    metrics.register_callback("bot_catalog_crawl_total", "counter", "Запросы обхода каталога", catalog_crawl)
+    metrics.register_callback("bot_session_store_total", "counter",
+                              "Чтения и записи общего хранилища сессий (режим воркера)", session_store)
+    metrics.register_callback("bot_result_store", "gauge", "Хранилище выдач: выдачи, товары, байты", result_store)
+    metrics.register_callback("bot_search_inflight", "gauge", "Идущие сейчас поиски",
+                              lambda: _search_flights.stats()["inflight"])
+    metrics.register_callback("bot_search_coalesced_total", "counter",
+                              "Запросы, присоединившиеся к уже идущему поиску",
+                              lambda: _search_flights.stats()["coalesced"])
+
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, METRICS_ADDR)
+
+
 # ====== Main Bot Setup ======
-def main():
-    application = Application.builder().token("BOT_TOKEN").build()
+BOT_MODE = os.environ.get("BOT_MODE", "polling")        # polling | webhook | worker
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL")   # свой Bot API (например, локальный фейковый); None — Telegram
+CONCURRENT_UPDATES = 32   # сколько апдейтов обрабатываются одновременно; 1 — строго по очереди
+
+# Вебхук: Telegram сам присылает апдейты на WEBHOOK_URL, бот слушает WEBHOOK_LISTEN:WEBHOOK_PORT
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = "telegram"
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")         # публичный адрес; None — http://WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")   # проверяется в заголовке каждого запроса от Telegram
+WEBHOOK_CERT = None   # сертификат и ключ — слушать HTTPS самим; None — TLS снимает прокси перед ботом
+WEBHOOK_KEY = None
+
+# Воркер: апдейты раздаёт фронт sharding.py, сессии — в общем хранилище (SESSION_STORE_PATH)
+SHARD_FRONT = os.environ.get("SHARD_FRONT", "127.0.0.1:8470")
+SHARD_WORKER_ID = os.environ.get("SHARD_WORKER_ID", "w0")
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "1"))   # сколько всего воркеров
+
+
+def _log_startup_summary(_subsystem):
+    if all(s.ready for s in (model_subsystem, browser_subsystem)):
+        logger.info(startup_report.summary())
+
+
+async def _on_startup(application: Application):
+    startup_report.mark("telegram_init")
+    logger.info("Бот принимает сообщения через %.2f с после запуска", startup_report.elapsed())
+
+
+async def _on_shutdown(application: Application):
+    if _inference_cache is not None:
+        _inference_cache.flush()
+
+
+def bot_builder():
+    """Токен и адрес Bot API — общие для бота и фронта sharding.py."""
+    builder = Application.builder().token("BOT_TOKEN")
+    if BOT_API_BASE_URL:
+        base = BOT_API_BASE_URL.rstrip("/")
+        builder = builder.base_url(f"{base}/bot").base_file_url(f"{base}/file/bot")
+    return builder
+
+
+def build_application() -> Application:
+    builder = (bot_builder()
+               .concurrent_updates(CONCURRENT_UPDATES)
+               .post_init(_on_startup)
+               .post_shutdown(_on_shutdown))
+    if SEND_QUEUE_ENABLED:
+        builder = builder.rate_limiter(get_send_queue())
+    if BOT_MODE == "worker":
+        # Апдейты приходят от фронта, user_data перечитывается из общего хранилища перед каждым
+        builder = builder.updater(None).persistence(SessionPersistence(get_session_store()))
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
 
@@ -683,10 +2143,44 @@ def main():
     # Разные callback'и по паттерну
     application.add_handler(CallbackQueryHandler(show_more, pattern=r"^more:"))
     application.add_handler(CallbackQueryHandler(handle_confirm, pattern=r"^confirm:"))
+    application.add_handler(CallbackQueryHandler(handle_alternative, pattern=r"^alt:"))
+    application.add_handler(CallbackQueryHandler(show_similar, pattern=r"^similar:"))
 
     application.add_error_handler(error_handler)
+    return application
+
 
-    application.run_polling()
+def main():
+    if METRICS_ENABLED:
+        setup_metrics()
+
+    if STARTUP_PRELOAD:
+        for subsystem in (model_subsystem, browser_subsystem):
+            subsystem.add_done_callback(_log_startup_summary)
+            subsystem.start()
+
+    if CATALOG_INDEX_PATH and CATALOG_CRAWL_ENABLED:
+        start_catalog_crawler()
+
+    application = build_application()
+    startup_report.mark("application")
+
+    if BOT_MODE == "worker":
+        get_session_store().prune()
+        asyncio.run(serve_worker(application, SHARD_FRONT, SHARD_WORKER_ID,
+                                 on_drain=share_live_results, on_workers=set_shard_workers))
+    elif BOT_MODE == "webhook":
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL or f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
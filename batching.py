@@ -0,0 +1,191 @@
+"""
+Динамический микро-батчинг инференса.
+
+Картинки от разных пользователей складываются в общую очередь, отдельный поток
+собирает их в батч (до max_batch_size штук или до истечения max_wait_ms с момента
+прихода первой) и прогоняет через модель одним вызовом. Каждый вызывающий
+получает свой результат через Future.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    __slots__ = ("x", "future", "enqueued_at")
+
+    def __init__(self, x: np.ndarray):
+        self.x = x
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    predict_fn принимает батч формы (N, H, W, C) и возвращает последовательность
+    из N результатов — по одному на картинку, в том же порядке.
+    collate(items) собирает батч из поставленных в очередь картинок формы (1, H, W, C);
+    по умолчанию — np.concatenate. Вызывается из потоков батчера.
+    threads — сколько батчей может считаться одновременно (например, по числу
+    процессов инференса); при threads > 1 collate и predict_fn должны быть потокобезопасны.
+    """
+
+    def __init__(self, predict_fn, max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 stats_interval: float = 60.0, name: str = "micro-batcher", collate=None,
+                 threads: int = 1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size должен быть >= 1")
+        self.predict_fn = predict_fn
+        self.collate = collate or (lambda items: np.concatenate(items, axis=0))
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats_interval = stats_interval
+        self.name = name
+        self.threads = max(1, threads)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+        # Статистика для подбора параметров под нагрузкой
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=2048)
+        self._last_report = time.monotonic()
+
+    # ------------------ жизненный цикл ------------------
+    def start(self):
+        with self._lock:
+            if any(t.is_alive() for t in self._threads):
+                return
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+                for i in range(self.threads)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        # Всё, что не успели обработать, отменяем
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            req.future.cancel()
+
+    # ------------------ API ------------------
+    def submit(self, x: np.ndarray) -> Future:
+        """Ставит одну картинку (H, W, C) или (1, H, W, C) в очередь."""
+        if x.ndim == 3:
+            x = x[np.newaxis]
+        if x.shape[0] != 1:
+            raise ValueError("В submit передаётся ровно одна картинка")
+        self.start()
+        req = _Request(x)
+        self._queue.put(req)
+        return req.future
+
+    async def predict(self, x: np.ndarray):
+        """Асинхронная обёртка для хендлеров бота."""
+        return await asyncio.wrap_future(self.submit(x))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            sizes = dict(sorted(self._batch_sizes.items()))
+            batches, items = self._batches, self._items
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000.0
+
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (items / batches) if batches else 0.0,
+            "batch_sizes": sizes,
+            "queue_depth": self.queue_depth(),
+            "queue_wait_ms_p50": pct(0.50),
+            "queue_wait_ms_p95": pct(0.95),
+            "queue_wait_ms_max": (waits[-1] * 1000.0) if waits else 0.0,
+        }
+
+    # ------------------ рабочий поток ------------------
+    def _collect(self, first: _Request) -> list:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    req = self._queue.get(timeout=remaining)
+                else:
+                    # Время вышло, но забираем то, что уже лежит в очереди
+                    req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(req)
+        return batch
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = self._collect(first)
+            # Отменённые вызывающими запросы в батч не берём
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                x = self.collate([r.x for r in batch])
+                results = self.predict_fn(x)
+                if len(results) != len(batch):
+                    raise ValueError(
+                        f"predict_fn вернула {len(results)} результатов на батч из {len(batch)}"
+                    )
+            except Exception as e:
+                logger.exception("Ошибка батчевого инференса: %s", e)
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            for r, res in zip(batch, results):
+                r.future.set_result(res)
+
+            self._record(batch, started)
+
+    def _record(self, batch: list, started: float):
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._waits.extend(started - r.enqueued_at for r in batch)
+
+        now = time.monotonic()
+        if self.stats_interval and now - self._last_report >= self.stats_interval:
+            self._last_report = now
+            logger.info("Статистика батчера %s: %s", self.name, self.stats())
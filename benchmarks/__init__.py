@@ -0,0 +1 @@
+"""Офлайн-бенчмарки горячих путей бота."""
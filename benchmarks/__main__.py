@@ -0,0 +1,196 @@
+"""
+Микро-бенчмарки горячих путей: предобработка и классификация фото,
+извлечение товаров из сетки поиска, нормализация цен/названий и рендер
+страницы товаров. Всё офлайн.
+
+    python -m benchmarks --out benchmarks/baseline.json     # записать базовую линию
+    python -m benchmarks --baseline benchmarks/baseline.json --fail-on-regression
+    python -m benchmarks --browser        # + JS-извлечение в локальном headless Chrome
+    python -m benchmarks.stores           # адаптеры магазинов на страницах с локального сервера
+    python -m benchmarks.fake_bot_api     # очередь отправки против фейкового Bot API
+    python -m benchmarks.loadtest         # нагрузочный тест бота целиком: сколько пользователей держит
+"""
+import argparse
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks import harness
+from benchmarks.fixtures import (
+    SEARCH_GRID_SNAPSHOT,
+    build_random_model,
+    load_search_grid_snapshot,
+    sample_photos,
+)
+
+
+# ------------------ стадии ------------------
+def stage_preprocess(app, photos, iterations):
+    it = iter(range(10 ** 9))
+    return harness.measure(lambda: app.preprocess_image_bytes(photos[next(it) % len(photos)]), iterations)
+
+
+def stage_predict_single(app, photos, iterations):
+    it = iter(range(10 ** 9))
+    return harness.measure(lambda: app.predict_labels_from_bytes(photos[next(it) % len(photos)]), iterations)
+
+
+def stage_predict_batch(app, photos, iterations):
+    batch = np.concatenate([app.preprocess_image_bytes(p) for p in photos[:app.BATCH_MAX_SIZE]])
+    return harness.measure(lambda: app.predict_labels_batch(batch), iterations, items_per_call=len(batch))
+
+
+def stage_extract_webdriver(app, html, iterations):
+    from benchmarks.dom import FakeDriver
+
+    driver = FakeDriver(html)
+    cards = len(app.extract_products(driver, None))
+    return harness.measure(lambda: app.extract_products(driver, None), iterations, items_per_call=cards)
+
+
+def stage_extract_js(app, iterations):
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    driver = webdriver.Chrome(options=options)
+    try:
+        driver.get("file://" + os.path.abspath(SEARCH_GRID_SNAPSHOT))
+        unmark = f"document.querySelectorAll('[{app.PARSED_CARD_MARK}]')" \
+                 f".forEach(e => e.removeAttribute('{app.PARSED_CARD_MARK}'))"
+        reset = lambda: driver.execute_script(unmark)
+        reset()
+        cards = len(app.extract_products_js(driver))
+        return harness.measure(lambda: app.extract_products_js(driver), iterations,
+                               before=reset, items_per_call=cards)
+    finally:
+        driver.quit()
+
+
+def stage_normalize(app, products, iterations):
+    prices = [p["price"] for p in products]
+    titles = [p["title"] for p in products]
+
+    def run():
+        for price in prices:
+            app.normalize_price(price)
+        for title in titles:
+            app.normalize_text(title)
+
+    return harness.measure(run, iterations, items_per_call=len(prices) + len(titles))
+
+
+def stage_send_page(app, products, iterations):
+    async def send_message(**kwargs):
+        return None
+
+    async def reply_text(*args, **kwargs):
+        return None
+
+    results = app.get_result_store().create("бенчмарк", products=products, done=True)
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=1),
+        effective_message=SimpleNamespace(reply_text=reply_text),
+    )
+    context = SimpleNamespace(user_data={"result_id": results.id}, bot=SimpleNamespace(send_message=send_message))
+    loop = asyncio.new_event_loop()
+    try:
+        return harness.measure(
+            lambda: loop.run_until_complete(app.send_products_page(update, context, start_idx=0)),
+            iterations,
+        )
+    finally:
+        loop.close()
+
+
+# ------------------ запуск ------------------
+def run(args) -> dict:
+    import app
+    from inference import KerasEngine
+
+    photos = sample_photos(args.images, count=16)
+    html = load_search_grid_snapshot()
+    results = {"environment": harness.environment(), "stages": {}}
+    stages = results["stages"]
+
+    def attempt(name, fn, *fn_args):
+        if args.only and name not in args.only:
+            return
+        print(f"  {name}...", file=sys.stderr)
+        try:
+            stages[name] = fn(*fn_args)
+        except ImportError as e:
+            stages[name] = {"skipped": f"нет зависимости: {e.name}"}
+        except Exception as e:
+            stages[name] = {"skipped": f"{type(e).__name__}: {e}"}
+
+    attempt("preprocess_image_bytes", stage_preprocess, app, photos, args.iterations)
+
+    try:
+        app._model = KerasEngine.from_model(build_random_model(app.IMG_SIZE, len(app.TYPE_CLASSES),
+                                                               len(app.COLOR_CLASSES)))
+        attempt("predict_labels_from_bytes", stage_predict_single, app, photos, args.iterations)
+        attempt("predict_labels_batch", stage_predict_batch, app, photos, max(args.iterations // 4, 5))
+    except ImportError as e:
+        for name in ("predict_labels_from_bytes", "predict_labels_batch"):
+            stages[name] = {"skipped": f"нет зависимости: {e.name}"}
+
+    attempt("extract_products", stage_extract_webdriver, app, html, args.iterations)
+    if args.browser:
+        attempt("extract_products_js", stage_extract_js, app, args.iterations)
+
+    products = []
+    try:
+        from benchmarks.dom import FakeDriver
+        products = app.extract_products(FakeDriver(html), None)
+    except ImportError:
+        pass
+    if products:
+        attempt("normalize_price_text", stage_normalize, app, products, args.iterations)
+        attempt("send_products_page", stage_send_page, app, products, args.iterations)
+    return results
+
+
+def print_report(results: dict):
+    print(f"{'стадия':<28}{'оп/с':>12}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'пик, МБ':>10}")
+    for name, r in results["stages"].items():
+        if "skipped" in r:
+            print(f"{name:<28}  пропущено: {r['skipped']}")
+            continue
+        print(f"{name:<28}{r['throughput_per_s']:>12.1f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}"
+              f"{r['p99_ms']:>10.3f}{r['peak_mb']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки бота")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--images", default=None, help="папка с фото одежды (иначе синтетические)")
+    parser.add_argument("--browser", action="store_true", help="мерить JS-извлечение в headless Chrome")
+    parser.add_argument("--only", nargs="+", default=None, help="запустить только эти стадии")
+    parser.add_argument("--out", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", default=None, help="JSON с базовой линией для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимый рост латентности")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_report(results)
+    if args.out:
+        harness.save(args.out, results)
+
+    if args.baseline:
+        rows = harness.compare(results, harness.load(args.baseline), args.threshold)
+        regressions = [r for r in rows if r[5]]
+        print(f"\nСравнение с {args.baseline}:")
+        for stage, metric, old, new, change, bad in rows:
+            mark = "  <-- регрессия" if bad else ""
+            print(f"  {stage:<28}{metric:<18}{old:>10.3f} -> {new:>10.3f} ({change:+.1%}){mark}")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
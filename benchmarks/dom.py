@@ -0,0 +1,65 @@
+"""
+Замена WebDriver для офлайн-бенчмарков extract_products.
+
+Поддерживает то подмножество API Selenium, которым пользуется парсер:
+find_element(s) по CSS и XPath, get_attribute, text, is_displayed.
+JavaScript не выполняет — для JS-извлечения нужен настоящий браузер.
+Требует lxml и cssselect.
+"""
+from urllib.parse import urljoin
+
+import lxml.html
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+# Атрибуты, которые Selenium отдаёт как свойства — уже абсолютными URL
+_URL_ATTRS = {"href", "src"}
+
+
+class FakeElement:
+    def __init__(self, node, base_url: str):
+        self._node = node
+        self._base_url = base_url
+
+    def _query(self, by, value):
+        if by == By.CSS_SELECTOR:
+            return self._node.cssselect(value)
+        if by == By.XPATH:
+            return self._node.xpath(value)
+        raise ValueError(f"Неподдерживаемый локатор: {by}")
+
+    def find_elements(self, by=By.CSS_SELECTOR, value=None):
+        return [FakeElement(n, self._base_url) for n in self._query(by, value)]
+
+    def find_element(self, by=By.CSS_SELECTOR, value=None):
+        found = self._query(by, value)
+        if not found:
+            raise NoSuchElementException(value)
+        return FakeElement(found[0], self._base_url)
+
+    def get_attribute(self, name: str):
+        if name == "outerHTML":
+            return lxml.html.tostring(self._node, encoding="unicode")
+        if name == "innerHTML":
+            return "".join(lxml.html.tostring(c, encoding="unicode") for c in self._node)
+        value = self._node.get(name)
+        if value is not None and name in _URL_ATTRS:
+            return urljoin(self._base_url, value)
+        return value
+
+    @property
+    def text(self) -> str:
+        return " ".join(self._node.text_content().split())
+
+    def is_displayed(self) -> bool:
+        return True
+
+
+class FakeDriver(FakeElement):
+    """Документ целиком; base_url нужен, чтобы href/src были абсолютными, как в браузере."""
+
+    def __init__(self, html: str, base_url: str = "https://www.gloria-jeans.ru/search"):
+        super().__init__(lxml.html.document_fromstring(html), base_url)
+
+    def execute_script(self, *args, **kwargs):
+        raise NotImplementedError("FakeDriver не выполняет JavaScript")
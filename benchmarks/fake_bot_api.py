@@ -0,0 +1,355 @@
+"""
+Локальный фейковый Bot API для офлайн-проверок бота.
+
+Отвечает на те методы, которыми пользуется бот (getMe, getUpdates, setWebhook,
+sendMessage, editMessageText, answerCallbackQuery, getFile и скачивание файла),
+запоминает всё отправленное и умеет, как настоящий Telegram, отвечать 429 с
+retry_after при превышении лимитов в чате и на бота. Апдейты кладутся через
+push_update: отдаются в getUpdates или отправляются POST-ом на вебхук.
+wait_for_message ждёт ответа бота в чате — так нагрузочный тест меряет задержку.
+
+Бот направляется сюда через BOT_API_BASE_URL=http://127.0.0.1:<порт>.
+
+    python -m benchmarks.fake_bot_api     # всплеск сообщений через SendQueue и без неё
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+def _chat(chat_id: int) -> dict:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "group", "title": f"group {chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"user {chat_id}"}
+
+
+def _user(chat_id: int) -> dict:
+    return {"id": abs(chat_id), "is_bot": False, "first_name": f"user {chat_id}"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._handle(self.rfile.read(length) if length else b"")
+
+    def _handle(self, body: bytes):
+        api = self.server.api
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if len(parts) >= 3 and parts[0] == "file":
+            data = api.files.get("/".join(parts[2:]))
+            if data is None:
+                self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            self._raw(200, data, "application/octet-stream")
+            return
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        params = api.parse_params(body, self.headers.get("Content-Type", ""), self.path)
+        status, payload = api.call(parts[1], params)
+        self._reply(status, payload)
+
+    def _reply(self, status: int, payload: dict):
+        self._raw(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _raw(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256   # всплеск соединений от бота не должен упираться в backlog
+
+    def handle_error(self, request, client_address):
+        # Бот оборвал long-poll getUpdates при остановке — это не ошибка
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeBotAPI:
+    """
+    latency — задержка каждого ответа, с.
+    chat_interval / chat_burst / global_rate — лимиты, при превышении которых
+    sendMessage и т.п. получают 429 (None — не проверять).
+    """
+
+    def __init__(self, latency: float = 0.0, chat_interval: float | None = 1.0, chat_burst: int = 3,
+                 global_rate: float | None = 30.0, retry_after: int = 1):
+        self.latency = latency
+        self.chat_interval = chat_interval
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.retry_after = retry_after
+
+        self.sent: list = []                  # (time, method, params)
+        self.flood_errors = 0
+        self.files: dict = {}                 # file_path -> bytes
+        self.webhook_url = None
+        self.webhook_secret = None
+
+        self._lock = threading.Lock()
+        self._updates_cond = threading.Condition(self._lock)
+        self._sent_cond = threading.Condition(self._lock)
+        self._chat_messages = defaultdict(list)   # chat_id -> параметры sendMessage по порядку
+        self._updates: deque = deque()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._chat_sends = defaultdict(deque)   # chat_id -> время последних отправок
+        self._global_sends: deque = deque()
+
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.api = self
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBotAPI":
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._updates_cond:
+            self._updates_cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # ------------------ апдейты от "пользователей" ------------------
+    def push_update(self, update: dict) -> int:
+        """Кладёт апдейт (без update_id) для бота; возвращает присвоенный update_id."""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            threading.Thread(target=self._deliver, args=(update,), daemon=True).start()
+        else:
+            with self._updates_cond:
+                self._updates.append(update)
+                self._updates_cond.notify_all()
+        return update["update_id"]
+
+    def _deliver(self, update: dict):
+        req = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+        if self.webhook_secret:
+            req.add_header("X-Telegram-Bot-Api-Secret-Token", self.webhook_secret)
+        urllib.request.urlopen(req, timeout=30).read()
+
+    def text_update(self, chat_id: int, text: str) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": _chat(chat_id),
+                   "from": _user(chat_id), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    def photo_update(self, chat_id: int, image: bytes, width: int = 1280, height: int = 960) -> dict:
+        file_id = f"photo{next(self._message_ids)}"
+        self.files[f"photos/{file_id}.jpg"] = image
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": width, "height": height,
+                  "file_size": len(image)}]
+        return {"message": {"message_id": next(self._message_ids), "date": int(time.time()),
+                            "chat": _chat(chat_id), "from": _user(chat_id), "photo": photo}}
+
+    def callback_update(self, chat_id: int, data: str) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": _chat(chat_id),
+                   "from": BOT_USER, "text": "…"}
+        return {"callback_query": {"id": str(next(self._message_ids)), "from": _user(chat_id),
+                                   "chat_instance": str(chat_id), "message": message, "data": data}}
+
+    # ------------------ запросы бота ------------------
+    @staticmethod
+    def parse_params(body: bytes, content_type: str, path: str) -> dict:
+        if "application/json" in content_type:
+            return json.loads(body or b"{}")
+        raw = parse_qs(body.decode("utf-8"), keep_blank_values=True) if body else {}
+        if "?" in path:
+            raw.update(parse_qs(path.split("?", 1)[1], keep_blank_values=True))
+        params = {}
+        for key, values in raw.items():
+            value = values[-1]
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def call(self, method: str, params: dict) -> tuple:
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return 200, {"ok": True, "result": True}
+        return handler(params)
+
+    def _api_getMe(self, params):
+        return 200, {"ok": True, "result": BOT_USER}
+
+    def _api_setWebhook(self, params):
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token")
+        return 200, {"ok": True, "result": True}
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = self.webhook_secret = None
+        return 200, {"ok": True, "result": True}
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._updates_cond:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_cond.wait(deadline - time.monotonic())
+            result = list(self._updates)[:int(params.get("limit") or 100)]
+        return 200, {"ok": True, "result": result}
+
+    def _api_getFile(self, params):
+        file_id = params["file_id"]
+        path = f"photos/{file_id}.jpg"
+        return 200, {"ok": True, "result": {"file_id": file_id, "file_unique_id": file_id,
+                                            "file_size": len(self.files.get(path, b"")), "file_path": path}}
+
+    def _api_sendMessage(self, params):
+        flood = self._check_limits(int(params["chat_id"]))
+        if flood is not None:
+            return flood
+        chat_id = int(params["chat_id"])
+        with self._sent_cond:
+            self.sent.append((time.monotonic(), "sendMessage", params))
+            self._chat_messages[chat_id].append(params)
+            self._sent_cond.notify_all()
+        return 200, {"ok": True, "result": {"message_id": next(self._message_ids), "date": int(time.time()),
+                                            "chat": _chat(chat_id), "from": BOT_USER,
+                                            "text": params.get("text", "")}}
+
+    def _api_editMessageText(self, params):
+        return self._api_sendMessage(params)
+
+    def _check_limits(self, chat_id: int):
+        now = time.monotonic()
+        with self._lock:
+            chat = self._chat_sends[chat_id]
+            if self.chat_interval is not None:
+                while chat and chat[0] <= now - self.chat_interval * self.chat_burst:
+                    chat.popleft()
+            if self.global_rate is not None:
+                while self._global_sends and self._global_sends[0] <= now - 1.0:
+                    self._global_sends.popleft()
+            # Небольшой допуск на сетевое дрожание, как у настоящего Telegram
+            chat_full = self.chat_interval is not None and len(chat) > self.chat_burst
+            global_full = self.global_rate is not None and len(self._global_sends) > self.global_rate + 1
+            if chat_full or global_full:
+                self.flood_errors += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            chat.append(now)
+            self._global_sends.append(now)
+        return None
+
+    def message_count(self, chat_id: int) -> int:
+        with self._lock:
+            return len(self._chat_messages.get(chat_id, ()))
+
+    def wait_for_message(self, chat_id: int, since: int, predicate=None, timeout: float = 30.0):
+        """
+        Первое сообщение бота в chat_id с номером >= since, для которого predicate(params)
+        истинно. Возвращает (номер, params) или None по таймауту.
+        """
+        deadline = time.monotonic() + timeout
+        with self._sent_cond:
+            while True:
+                messages = self._chat_messages.get(chat_id, ())
+                for i in range(since, len(messages)):
+                    if predicate is None or predicate(messages[i]):
+                        return i, messages[i]
+                since = max(since, len(messages))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._sent_cond.wait(remaining)
+
+    def messages(self, chat_id: int | None = None) -> list:
+        with self._lock:
+            return [p for _, method, p in self.sent
+                    if method == "sendMessage" and (chat_id is None or int(p["chat_id"]) == chat_id)]
+
+
+# ------------------ проверка очереди отправки ------------------
+async def _burst(base_url: str, rate_limiter, chats: int, per_chat: int) -> dict:
+    from telegram.error import RetryAfter
+    from telegram.ext import ExtBot
+
+    from send_queue import STATUS
+
+    bot = ExtBot("123:fake", base_url=f"{base_url}/bot", rate_limiter=rate_limiter)
+    await bot.initialize()
+    errors = 0
+
+    async def send(chat_id: int, i: int):
+        nonlocal errors
+        # Чётные — служебные ("ищу...", "в очереди"), как от параллельных хендлеров одного чата
+        kwargs = {"rate_limit_args": STATUS} if rate_limiter is not None and i % 2 == 0 else {}
+        try:
+            await bot.send_message(chat_id=chat_id, text=f"{'статус' if kwargs else 'ответ'} {i}", **kwargs)
+        except RetryAfter:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(1000 + c, i) for c in range(chats) for i in range(per_chat)))
+    seconds = time.perf_counter() - started
+    await bot.shutdown()
+    return {"seconds": seconds, "errors": errors,
+            "stats": rate_limiter.stats() if rate_limiter is not None else None}
+
+
+def main():
+    from send_queue import SendQueue
+
+    parser = argparse.ArgumentParser(description="Всплеск сообщений через фейковый Bot API")
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--per-chat", type=int, default=6)
+    args = parser.parse_args()
+
+    for name, limiter in (("без очереди", None), ("SendQueue", SendQueue())):
+        with FakeBotAPI() as api:
+            r = asyncio.run(_burst(api.base_url, limiter, args.chats, args.per_chat))
+            print(f"{name:<14}отправлено {len(api.messages()):>4}, 429 от API {api.flood_errors:>4}, "
+                  f"ошибок у бота {r['errors']:>4}, {r['seconds']:.2f} с"
+                  + (f", вытеснено служебных {r['stats']['dropped']}" if r["stats"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Офлайн-данные для бенчмарков: HTML сетки поиска gloria-jeans, фото одежды
+и случайно инициализированная модель с тем же устройством трёх голов.
+"""
+import glob
+import os
+import random
+from io import BytesIO
+
+from PIL import Image
+
+from benchmarks.ingest import synthetic_photo
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SEARCH_GRID_SNAPSHOT = os.path.join(DATA_DIR, "search_grid.html")
+
+_TITLES = [
+    "Джинсы slim fit", "Джинсы mom", "Футболка оверсайз", "Худи с капюшоном",
+    "Куртка джинсовая", "Брюки карго", "Шорты джинсовые", "Рубашка в клетку",
+    "Свитер вязаный", "Кроссовки на платформе", "Босоножки кожаные",
+]
+_COLORS = ["чёрные", "синие", "белые", "серые", "бежевые", "зелёные"]
+
+# Разметка карточки повторяет то, на что рассчитаны селекторы в app.py
+_CARD = """  <div class="listing-grid__col">
+    <gj-product-mini-card class="product-mini-card">
+      <div class="product-mini-card__image-wrapper">
+        <a href="/product/{pid}/"><picture><img class="product-mini-card__image" src="{image}" alt=""></picture></a>
+      </div>
+      <div class="product-mini-card__name"><a href="/product/{pid}/"><span>{title}</span></a></div>
+      <gj-button-price><button class="button"><span class="button__label">{price}</span></button></gj-button-price>
+    </gj-product-mini-card>
+  </div>
+"""
+
+_PAGE = """<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>Поиск — Gloria Jeans</title></head>
+<body>
+<header class="header-controls_control"><div class="search-input"><input type="search" placeholder="Поиск"></div></header>
+<main class="listing-grid">
+{cards}</main>
+{script}
+</body>
+</html>
+"""
+
+
+def render_card(pid: int, rng: random.Random, image_base: str = "https://img.gloria-jeans.ru") -> str:
+    price = rng.randrange(499, 8999, 100)
+    price_text = f"{price:,}".replace(",", " ") + " ₽"
+    title = f"{rng.choice(_TITLES)} {rng.choice(_COLORS)}"
+    return _CARD.format(pid=pid, title=title, price=price_text,
+                        image=f"{image_base}/medias/{pid}.jpg")
+
+
+def render_search_grid(count: int, seed: int = 0, script: str = "",
+                       image_base: str = "https://img.gloria-jeans.ru", first_id: int = 100000) -> str:
+    """Страница выдачи с count карточками, id товаров — с first_id подряд."""
+    rng = random.Random(seed)
+    cards = "".join(render_card(first_id + i, rng, image_base) for i in range(count))
+    return _PAGE.format(cards=cards, script=script)
+
+
+def load_search_grid_snapshot() -> str:
+    with open(SEARCH_GRID_SNAPSHOT, encoding="utf-8") as f:
+        return f.read()
+
+
+def sample_photos(images_dir: str | None = None, count: int = 16) -> list:
+    """JPEG-байты фото одежды: из папки или синтетические 1280×960."""
+    if images_dir:
+        paths = sorted(glob.glob(os.path.join(images_dir, "*")))[:count]
+        images = [Image.open(p).convert("RGB") for p in paths]
+    else:
+        images = [synthetic_photo(i) for i in range(count)]
+    result = []
+    for img in images:
+        buf = BytesIO()
+        img.save(buf, "JPEG", quality=87)
+        result.append(buf.getvalue())
+    return result
+
+
+def build_random_model(img_size=(224, 224), n_types: int = 10, n_colors: int = 11, seed: int = 0):
+    """
+    Маленькая случайная модель с теми же выходами, что clothing_multitask_mobilenetv2:
+    type_output (softmax), color_output (softmax), print_output (sigmoid).
+    """
+    try:
+        from tensorflow import keras
+    except ImportError:
+        import keras
+
+    keras.utils.set_random_seed(seed)
+    layers = keras.layers
+    inputs = keras.Input(shape=(img_size[1], img_size[0], 3))
+    x = layers.Conv2D(16, 3, strides=4, activation="relu")(inputs)
+    x = layers.Conv2D(32, 3, strides=4, activation="relu")(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.3)(x)
+    outputs = [
+        layers.Dense(n_types, activation="softmax", name="type_output")(x),
+        layers.Dense(n_colors, activation="softmax", name="color_output")(x),
+        layers.Dense(1, activation="sigmoid", name="print_output")(x),
+    ]
+    return keras.Model(inputs=inputs, outputs=outputs, name="clothing_multitask_random")
+
+
+def main():
+    """Пересобрать сохранённый снимок сетки: python -m benchmarks.fixtures"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(SEARCH_GRID_SNAPSHOT, "w", encoding="utf-8") as f:
+        f.write(render_search_grid(60))
+    print(f"Снимок сохранён: {SEARCH_GRID_SNAPSHOT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Замер стадий, сохранение результатов в JSON и сравнение с базовой линией."""
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+def measure(fn, iterations: int, warmup: int = 3, before=None, items_per_call: int = 1) -> dict:
+    """
+    Вызывает fn() iterations раз. before() (если задан) выполняется перед каждым
+    вызовом и в замер не входит. Пиковая память меряется отдельным прогоном
+    под tracemalloc, чтобы трассировка не искажала время.
+    """
+    for _ in range(warmup):
+        if before:
+            before()
+        fn()
+
+    times = []
+    for _ in range(iterations):
+        if before:
+            before()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+
+    if before:
+        before()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times_ms = np.array(times) * 1000.0
+    total = float(np.sum(times))
+    return {
+        "iterations": iterations,
+        "items_per_call": items_per_call,
+        "throughput_per_s": (iterations * items_per_call / total) if total else 0.0,
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def save(path: str, results: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.10) -> list:
+    """
+    Сравнивает стадии с базовой линией. Регрессия — p50 или p99 выросли больше
+    чем на threshold. Возвращает строки отчёта (стадия, метрика, было, стало, изменение, регрессия).
+    """
+    rows = []
+    for stage, cur in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or "skipped" in cur or "skipped" in base:
+            continue
+        for metric in ("p50_ms", "p99_ms", "throughput_per_s"):
+            old, new = base[metric], cur[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            # Для пропускной способности хуже — когда падает
+            worse = -change if metric == "throughput_per_s" else change
+            rows.append((stage, metric, old, new, change, metric != "throughput_per_s" and worse > threshold))
+    return rows
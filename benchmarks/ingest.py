@@ -0,0 +1,154 @@
+"""
+Сравнение старого и нового пути приёма фото.
+
+Старый путь: качаем самый большой размер, полный декод, convert/resize,
+float32-массив и expand_dims. Новый: самый маленький подходящий размер,
+JPEG draft-декод, uint8 и запись в заранее выделенный float32-буфер.
+
+Телеграмовские размеры фото имитируются пересжатием исходных картинок
+в 90/320/800/1280 px. Каждый путь меряется в отдельном процессе, чтобы
+пиковая память не смешивалась: ru_maxrss процесса и пик tracemalloc
+на одно фото (numpy-буферы; внутренние буферы PIL tracemalloc не видит).
+
+    python -m benchmarks.ingest
+    python -m benchmarks.ingest --images path/to/photos --repeat 50
+"""
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import resource
+import time
+import tracemalloc
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Размеры, которые Telegram хранит для фото (по длинной стороне)
+TELEGRAM_SIDES = (90, 320, 800, 1280)
+
+FakePhotoSize = namedtuple("FakePhotoSize", "width height file_size data")
+
+
+def synthetic_photo(seed: int, size=(1280, 960)) -> Image.Image:
+    """Плавный фон и пара "вещей" — примерно как фото одежды, а не белый шум."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = rng.uniform(60, 200, 3)
+    img = np.empty((h, w, 3), dtype=np.float32)
+    for c in range(3):
+        img[..., c] = base[c] + 40 * np.sin(xx / rng.uniform(80, 300)) * np.cos(yy / rng.uniform(80, 300))
+    for _ in range(2):
+        cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.2, 0.8) * h
+        rx, ry = rng.uniform(0.1, 0.3) * w, rng.uniform(0.1, 0.3) * h
+        mask = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 < 1
+        img[mask] = rng.uniform(0, 255, 3)
+    img += rng.normal(0, 6, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def telegram_renditions(img: Image.Image) -> list:
+    sizes = []
+    for side in TELEGRAM_SIDES:
+        scale = min(1.0, side / max(img.size))
+        resized = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+        buf = BytesIO()
+        resized.convert("RGB").save(buf, "JPEG", quality=87)
+        data = buf.getvalue()
+        sizes.append(FakePhotoSize(resized.width, resized.height, len(data), data))
+    return sizes
+
+
+def load_photos(images_dir: str | None, count: int) -> list:
+    if images_dir:
+        paths = sorted(glob.glob(os.path.join(images_dir, "*")))[:count]
+        return [telegram_renditions(Image.open(p).convert("RGB")) for p in paths]
+    return [telegram_renditions(synthetic_photo(i)) for i in range(count)]
+
+
+# ------------------ пути приёма ------------------
+def old_path(photo_sizes, img_size):
+    photo = photo_sizes[-1]
+    img = Image.open(BytesIO(photo.data)).convert("RGB")
+    img = img.resize(img_size)
+    arr = np.array(img, dtype='float32') / 255.0
+    return photo.file_size, np.expand_dims(arr, axis=0)
+
+
+def new_path(photo_sizes, img_size, out):
+    from app import choose_photo_size, load_image, preprocess_image
+
+    photo = choose_photo_size(photo_sizes)
+    img = load_image(photo.data)
+    return photo.file_size, preprocess_image(img, out=out)
+
+
+def _run(name: str, photos: list, repeat: int, queue):
+    from app import IMG_SIZE
+
+    out = np.empty((1, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    downloaded = 0
+    times = []
+    peak_traced = 0
+    tracemalloc.start()
+    for _ in range(repeat):
+        for sizes in photos:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            if name == "old":
+                nbytes, _ = old_path(sizes, IMG_SIZE)
+            else:
+                nbytes, _ = new_path(sizes, IMG_SIZE, out)
+            times.append((time.perf_counter() - started) * 1000.0)
+            peak_traced = max(peak_traced, tracemalloc.get_traced_memory()[1] - base)
+            downloaded += nbytes
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "path": name,
+        "images": len(times),
+        "download_bytes_per_image": downloaded / len(times),
+        "decode_ms_p50": float(np.percentile(times, 50)),
+        "decode_ms_p95": float(np.percentile(times, 95)),
+        "peak_traced_mb_per_image": peak_traced / 2 ** 20,
+        # ru_maxrss в Linux — в килобайтах
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024.0,
+    })
+
+
+def measure(name: str, photos: list, repeat: int) -> dict:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(name, photos, repeat, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк приёма фото: старый и новый путь")
+    parser.add_argument("--images", default=None, help="папка с фото (иначе синтетические)")
+    parser.add_argument("--count", type=int, default=20, help="сколько разных фото")
+    parser.add_argument("--repeat", type=int, default=10, help="повторов на фото")
+    args = parser.parse_args()
+
+    photos = load_photos(args.images, args.count)
+    results = [measure("old", photos, args.repeat), measure("new", photos, args.repeat)]
+
+    print(f"{'путь':<6}{'КБ/фото':>10}{'p50, мс':>10}{'p95, мс':>10}{'пик, МБ':>10}{'RSS +МБ':>10}")
+    for r in results:
+        print(
+            f"{r['path']:<6}{r['download_bytes_per_image'] / 1024:>10.1f}"
+            f"{r['decode_ms_p50']:>10.2f}{r['decode_ms_p95']:>10.2f}"
+            f"{r['peak_traced_mb_per_image']:>10.2f}{r['peak_rss_growth_mb']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
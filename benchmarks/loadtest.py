@@ -0,0 +1,436 @@
+"""
+Нагрузочный тест бота целиком: настоящие хендлеры app.py, фейковый Bot API
+и локальная копия сетки поиска gloria-jeans.
+
+Виртуальные пользователи (каждый — свой чат) шлют вперемешку /start, текстовые
+запросы, фото с последующим «Да»/«Нет» и «Показать ещё» и ждут ответа бота.
+Задержка действия — от отправки апдейта до первого не служебного сообщения бота
+в ответ. Уровни нагрузки идут по очереди (--users 1,4,16,32); на каждом
+меряются пропускная способность, перцентили задержки по хендлерам, пиковый RSS
+процесса бота и его дочерних процессов (Chrome), число процессов и браузеров.
+
+    python -m benchmarks.loadtest --users 1,4,16 --duration 60
+    python -m benchmarks.loadtest --parser http --model random --out load.json
+    python -m benchmarks.loadtest --baseline load.json          # сравнить с прошлым прогоном
+
+--parser browser (по умолчанию) — поиск в настоящем Chrome через пул браузеров;
+--parser http — страница выдачи скачивается без браузера и разбирается тем же
+extract_products: видно, сколько держит сам бот, без учёта Chrome.
+--model random (по умолчанию) — случайная модель с теми же головами (нужен keras);
+путь к файлу — настоящая модель; пустая строка — MODEL_PATH из app.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from urllib.parse import quote
+
+import numpy as np
+
+from benchmarks import harness
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.fixtures import build_random_model, render_search_grid, sample_photos
+from benchmarks.stores import FixtureServer, write_store_fixture
+
+# Служебные сообщения бота: после них ответ на действие ещё впереди
+_STATUS_PREFIXES = ("🔍", "⏳ Все браузеры заняты", "⏳ Бот только что", "⏳ Фото в очереди")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+DEFAULT_QUERIES = ["джинсы", "чёрные джинсы", "синие джинсы", "худи", "серые худи", "куртка",
+                   "белые футболки", "брюки карго", "шорты", "кроссовки"]
+DEFAULT_MIX = "start=1,text=4,photo=2,more=3"
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("start", "text", "photo", "more"):
+            raise ValueError(f"Неизвестное действие в --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _is_final(params: dict) -> bool:
+    return not (params.get("text") or "").startswith(_STATUS_PREFIXES)
+
+
+def _outcome(params: dict | None) -> str:
+    if params is None:
+        return "timeout"
+    text = params.get("text") or ""
+    if "слишком много" in text:
+        return "rejected"
+    if text.startswith("❌") or text.startswith("Не удалось"):
+        return "error"
+    return "ok"
+
+
+def _buttons(params: dict) -> list:
+    markup = params.get("reply_markup") or {}
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    return [b.get("callback_data") for row in markup.get("inline_keyboard", []) for b in row]
+
+
+# ------------------ процессы и память ------------------
+def _children(pid: int) -> list:
+    """Все потомки процесса по /proc (Chrome, chromedriver, процессы инференса)."""
+    parents = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Имя процесса в скобках может содержать пробелы
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents[ppid].append(int(entry))
+    result, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), ()):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class ResourceSampler:
+    """Раз в interval секунд записывает RSS бота и потомков, число процессов и браузеров."""
+
+    def __init__(self, app, interval: float = 0.5):
+        self.app = app
+        self.interval = interval
+        self.peak = {"rss_mb": 0.0, "children_rss_mb": 0.0, "processes": 0, "browsers": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="loadtest-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def sample(self):
+        pid = os.getpid()
+        children = _children(pid) if os.path.isdir("/proc") else []
+        browsers = sum(pool.stats()["live"] for pool in list(self.app._driver_pools.values()))
+        current = {
+            "rss_mb": _rss(pid) / 2 ** 20,
+            "children_rss_mb": sum(_rss(c) for c in children) / 2 ** 20,
+            "processes": len(children),
+            "browsers": browsers,
+        }
+        for key, value in current.items():
+            self.peak[key] = max(self.peak[key], value)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+        self.sample()
+
+
+# ------------------ виртуальный пользователь ------------------
+class VirtualUser:
+    def __init__(self, api: FakeBotAPI, chat_id: int, mix: dict, rng: random.Random, queries: list,
+                 photos: list, confirm_yes: float, unique_queries: bool, timeout: float, record):
+        self.api = api
+        self.chat_id = chat_id
+        self.actions = list(mix)
+        self.weights = [mix[a] for a in self.actions]
+        self.rng = rng
+        self.queries = queries
+        self.photos = photos
+        self.confirm_yes = confirm_yes
+        self.unique_queries = unique_queries
+        self.timeout = timeout
+        self.record = record          # record(kind, seconds, outcome)
+        self.more_data = None         # callback_data кнопки «Показать ещё» на последней странице
+        self._sequence = 0
+
+    def step(self):
+        action = self.rng.choices(self.actions, self.weights)[0]
+        if action == "more" and self.more_data is None:
+            action = "text"
+        getattr(self, f"_do_{action}")()
+
+    def _send(self, kind: str, update: dict) -> dict | None:
+        since = self.api.message_count(self.chat_id)
+        started = time.perf_counter()
+        self.api.push_update(update)
+        reply = self.api.wait_for_message(self.chat_id, since, _is_final, self.timeout)
+        params = reply[1] if reply is not None else None
+        self.record(kind, time.perf_counter() - started, _outcome(params))
+        return params
+
+    def _remember_more(self, params: dict | None):
+        if params is not None:
+            more = [b for b in _buttons(params) if b and b.startswith("more:")]
+            self.more_data = more[0] if more else None
+
+    def _do_start(self):
+        self._send("start", self.api.text_update(self.chat_id, "/start"))
+
+    def _do_text(self):
+        query = self.rng.choice(self.queries)
+        if self.unique_queries:
+            # Свой запрос на каждое действие — мимо всех кэшей, до браузера
+            self._sequence += 1
+            query = f"{query} {self.chat_id}-{self._sequence}"
+        self._remember_more(self._send("text", self.api.text_update(self.chat_id, query)))
+
+    def _do_photo(self):
+        image = self.rng.choice(self.photos)
+        params = self._send("photo", self.api.photo_update(self.chat_id, image))
+        if params is None or "confirm:yes" not in _buttons(params):
+            return
+        choice = "confirm:yes" if self.rng.random() < self.confirm_yes else "confirm:no"
+        reply = self._send("confirm", self.api.callback_update(self.chat_id, choice))
+        if choice == "confirm:yes":
+            self._remember_more(reply)
+
+    def _do_more(self):
+        self._remember_more(self._send("more", self.api.callback_update(self.chat_id, self.more_data)))
+
+
+def run_level(api: FakeBotAPI, app, users: int, duration: float, args, photos: list, first_chat: int) -> dict:
+    latencies = defaultdict(list)
+    outcomes = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+
+    def record(kind, seconds, outcome):
+        with lock:
+            outcomes[kind][outcome] += 1
+            if outcome != "timeout":
+                latencies[kind].append(seconds)
+
+    stop_at = time.monotonic() + duration
+    flood_before = api.flood_errors
+
+    def user_loop(i: int):
+        rng = random.Random(args.seed * 100003 + first_chat + i)
+        user = VirtualUser(api, first_chat + i, args.mix, rng, args.queries, photos, args.confirm_yes,
+                           args.unique_queries, args.timeout, record)
+        # Пользователи приходят не строем
+        time.sleep(rng.uniform(0, min(args.think, 1.0)))
+        while time.monotonic() < stop_at:
+            user.step()
+            time.sleep(rng.expovariate(1.0 / args.think) if args.think > 0 else 0)
+
+    threads = [threading.Thread(target=user_loop, args=(i,), name=f"user-{i}", daemon=True)
+               for i in range(users)]
+    started = time.perf_counter()
+    with ResourceSampler(app) as sampler:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    seconds = time.perf_counter() - started
+
+    handlers = {}
+    for kind in sorted(outcomes):
+        times = np.array(latencies[kind]) * 1000.0
+        handlers[kind] = {
+            "count": sum(outcomes[kind].values()),
+            "outcomes": dict(outcomes[kind]),
+            "p50_ms": float(np.percentile(times, 50)) if len(times) else None,
+            "p90_ms": float(np.percentile(times, 90)) if len(times) else None,
+            "p99_ms": float(np.percentile(times, 99)) if len(times) else None,
+            "max_ms": float(times.max()) if len(times) else None,
+        }
+    total = sum(h["count"] for h in handlers.values())
+    ok = sum(h["outcomes"].get("ok", 0) for h in handlers.values())
+    lanes = {lane.name: lane.stats() for lane in (app._search_lane, app._inference_lane) if lane is not None}
+    return {
+        "users": users,
+        "seconds": seconds,
+        "actions": total,
+        "throughput": total / seconds,
+        "ok_throughput": ok / seconds,
+        "handlers": handlers,
+        "peak": dict(sampler.peak),
+        "flood_errors": api.flood_errors - flood_before,
+        "lane_rejected": {name: st["rejected"] for name, st in lanes.items()},
+    }
+
+
+# ------------------ поиск без браузера ------------------
+def http_iter_parser(app, adapter, batch_size: int = 30):
+    """iter_parser без Chrome: выдача скачивается по HTTP и разбирается app.extract_products."""
+    from benchmarks.dom import FakeDriver
+
+    def iter_parser(search_query, max_results=app.PARSER_MAX_RESULTS, deadline=app.PARSER_DEADLINE, stores=None):
+        url = f"{adapter.search_url}?q={quote(search_query)}"
+        with urllib.request.urlopen(url, timeout=deadline) as resp:
+            html = resp.read().decode("utf-8")
+        products = app.extract_products(FakeDriver(html, base_url=url), None, adapter)[:max_results]
+        for i in range(0, len(products), batch_size):
+            yield products[i:i + batch_size]
+
+    return iter_parser
+
+
+# ------------------ отчёт ------------------
+def _fmt_ms(v) -> str:
+    return f"{v:8.0f}" if v is not None else f"{'—':>8}"
+
+
+def print_level(r: dict):
+    peak = r["peak"]
+    print(f"\n== {r['users']} польз.: {r['actions']} действий за {r['seconds']:.1f} с, "
+          f"{r['throughput']:.2f} действ./с (успешных {r['ok_throughput']:.2f}), "
+          f"RSS бота {peak['rss_mb']:.0f} МБ, потомков {peak['children_rss_mb']:.0f} МБ, "
+          f"процессов {peak['processes']}, браузеров {peak['browsers']}, 429 от API {r['flood_errors']}")
+    print(f"  {'хендлер':<10}{'кол-во':>8}{'p50 мс':>8}{'p90 мс':>8}{'p99 мс':>8}{'max мс':>8}  исходы")
+    for kind, h in r["handlers"].items():
+        outcomes = ", ".join(f"{k} {v}" for k, v in sorted(h["outcomes"].items()))
+        print(f"  {kind:<10}{h['count']:>8}{_fmt_ms(h['p50_ms'])}{_fmt_ms(h['p90_ms'])}"
+              f"{_fmt_ms(h['p99_ms'])}{_fmt_ms(h['max_ms'])}  {outcomes}")
+
+
+def print_comparison(results: list, baseline: dict):
+    old = {level["users"]: level for level in baseline.get("levels", [])}
+    print("\nСравнение с базовой линией (было → стало):")
+    for r in results:
+        b = old.get(r["users"])
+        if b is None:
+            continue
+        print(f"  {r['users']:>4} польз.: {b['throughput']:.2f} → {r['throughput']:.2f} действ./с, "
+              f"RSS {b['peak']['rss_mb']:.0f} → {r['peak']['rss_mb']:.0f} МБ")
+        for kind, h in r["handlers"].items():
+            bh = b["handlers"].get(kind)
+            if bh and bh["p90_ms"] is not None and h["p90_ms"] is not None:
+                print(f"         {kind:<10} p90 {bh['p90_ms']:.0f} → {h['p90_ms']:.0f} мс")
+
+
+# ------------------ запуск ------------------
+def configure(app, args, api: FakeBotAPI, server: FixtureServer, workdir: str):
+    from stores import GLORIA_JEANS, register
+
+    app.BOT_API_BASE_URL = api.base_url
+    app.SEARCH_CACHE_PATH = os.path.join(workdir, "search_cache.sqlite3")
+    app.INFERENCE_CACHE_PATH = None
+    app.CATALOG_INDEX_PATH = None
+    app.VISUAL_SEARCH_ENABLED = False
+    app.PREFETCH_ENABLED = not args.no_prefetch
+    app.DRIVER_HEADLESS = True
+    if args.no_send_limits:
+        app.SEND_QUEUE_ENABLED = False
+
+    # Адаптер с тем же именем, но смотрящий на локальную копию сайта
+    adapter = GLORIA_JEANS.retarget(server.url(GLORIA_JEANS.name))
+    register(adapter)
+    if args.parser == "http":
+        app.iter_parser = http_iter_parser(app, adapter)
+    else:
+        # Пул создаётся до фоновой загрузки, чтобы браузеры шли на локальный сайт
+        app.get_driver_pool(adapter)
+        app.browser_subsystem.start()
+
+    if args.model == "random":
+        from inference import KerasEngine
+
+        app._model = KerasEngine.from_model(
+            build_random_model(app.IMG_SIZE, len(app.TYPE_CLASSES), len(app.COLOR_CLASSES)))
+    elif args.model:
+        app.MODEL_PATH = args.model
+    app.model_subsystem.start()
+
+
+async def run(app, args, api: FakeBotAPI, photos: list) -> list:
+    application = app.build_application()
+    results = []
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)
+        for subsystem in (app.model_subsystem, app.browser_subsystem):
+            if not await subsystem.wait(args.startup_timeout):
+                raise RuntimeError(f"Подсистема {subsystem.name} не загрузилась за {args.startup_timeout} с")
+            if subsystem.error is not None:
+                raise RuntimeError(f"Подсистема {subsystem.name} не загрузилась: {subsystem.error}")
+
+        loop = asyncio.get_running_loop()
+        for n, users in enumerate(args.users):
+            r = await loop.run_in_executor(None, run_level, api, app, users, args.duration, args, photos,
+                                           10_000 * (n + 1))
+            print_level(r)
+            results.append(r)
+        await application.updater.stop()
+        await application.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с фейковым Bot API и магазином")
+    parser.add_argument("--users", default="1,4,16", help="уровни одновременных пользователей через запятую")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность уровня, с")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса действий: start, text, photo, more")
+    parser.add_argument("--queries", default=",".join(DEFAULT_QUERIES), help="текстовые запросы через запятую")
+    parser.add_argument("--unique-queries", action="store_true", help="каждый запрос уникален: без кэшей")
+    parser.add_argument("--confirm-yes", type=float, default=0.8, help="доля «Да» после распознавания фото")
+    parser.add_argument("--think", type=float, default=1.0, help="средняя пауза пользователя между действиями, с")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответа на действие, с")
+    parser.add_argument("--results", type=int, default=60, help="карточек в выдаче магазина")
+    parser.add_argument("--store-latency", type=float, default=0.3, help="задержка ответа магазина, с")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа Bot API, с")
+    parser.add_argument("--no-send-limits", action="store_true", help="без лимитов Telegram и очереди отправки")
+    parser.add_argument("--no-prefetch", action="store_true", help="выключить упреждающий поиск по фото")
+    parser.add_argument("--parser", choices=["browser", "http"], default="browser")
+    parser.add_argument("--model", default="random", help="random или путь к модели (по умолчанию MODEL_PATH)")
+    parser.add_argument("--photos", type=int, default=32, help="разных фото у пользователей")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    args.users = [int(u) for u in args.users.split(",") if u.strip()]
+    args.mix = parse_mix(args.mix)
+    args.queries = [q.strip() for q in args.queries.split(",") if q.strip()]
+
+    import app
+    from stores import GLORIA_JEANS
+
+    photos = sample_photos(count=args.photos)
+    limits = {} if not args.no_send_limits else {"chat_interval": None, "global_rate": None}
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeBotAPI(latency=args.api_latency, **limits) as api:
+        write_store_fixture(workdir, GLORIA_JEANS.name, render_search_grid(args.results, seed=args.seed))
+        with FixtureServer(workdir, delays={GLORIA_JEANS.name: args.store_latency}) as server:
+            configure(app, args, api, server, workdir)
+            try:
+                results = asyncio.run(run(app, args, api, photos))
+            finally:
+                for pool in list(app._driver_pools.values()):
+                    pool.close()
+
+    report = {"environment": harness.environment(), "config": {
+        k: v for k, v in vars(args).items() if k not in ("out", "baseline")}, "levels": results}
+    if args.out:
+        harness.save(args.out, report)
+        print(f"\nРезультаты сохранены: {args.out}")
+    if args.baseline:
+        print_comparison(results, harness.load(args.baseline))
+    sys.exit(0 if results else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Проверка адаптеров магазинов на сохранённых страницах, отдаваемых локальным HTTP-сервером.
+
+Раскладка папки с фикстурами: <папка>/<магазин>/search.html — страница с полем
+поиска (форма с action="search"), <магазин>/results.html — выдача; остальные
+файлы магазина отдаются как есть. Поиск идёт через app.iter_parser в настоящем
+браузере — так же, как в боте, только адаптеры смотрят на локальный сервер.
+
+    python -m benchmarks.stores                      # синтетические магазины: слияние, дубли, медленный магазин
+    python -m benchmarks.stores --fixtures DIR       # сохранённые страницы зарегистрированных адаптеров
+"""
+import argparse
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.fixtures import render_search_grid
+
+_SEARCH_PAGE = """<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>Поиск</title></head>
+<body>
+<header class="header-controls_control">
+  <form class="search-input" action="search" method="get"><input type="search" name="q" placeholder="Поиск"></form>
+</header>
+</body>
+</html>
+"""
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if not parts:
+            self.send_error(404)
+            return
+        store_dir = parts[0]
+        delay = self.server.delays.get(store_dir, 0)
+        if delay:
+            time.sleep(delay)
+
+        if parts[1:] == ["search"]:
+            name = "results.html" if parse_qs(url.query).get("q") else "search.html"
+        else:
+            name = "/".join(parts[1:])
+        root = os.path.realpath(os.path.join(self.server.root, store_dir))
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """
+    Отдаёт <root>/<магазин>/... на 127.0.0.1 со свободным портом.
+    delays: магазин -> задержка ответа, с (медленный магазин).
+    """
+
+    def __init__(self, root: str, delays: dict | None = None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+        self.server.daemon_threads = True
+        self.server.root = root
+        self.server.delays = dict(delays or {})
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fixture-http", daemon=True)
+
+    def url(self, store_dir: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{store_dir}/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+
+def write_store_fixture(root: str, store_dir: str, results_html: str):
+    os.makedirs(os.path.join(root, store_dir), exist_ok=True)
+    with open(os.path.join(root, store_dir, "search.html"), "w", encoding="utf-8") as f:
+        f.write(_SEARCH_PAGE)
+    with open(os.path.join(root, store_dir, "results.html"), "w", encoding="utf-8") as f:
+        f.write(results_html)
+
+
+def search(app, adapters: list, query: str, deadline: float) -> tuple:
+    """Товары из всех адаптеров и время поиска, с."""
+    started = time.perf_counter()
+    products = []
+    for batch in app.iter_parser(query, deadline=deadline, stores=adapters):
+        products.extend(batch)
+    return products, time.perf_counter() - started
+
+
+# ------------------ проверки ------------------
+def check_synthetic(app, deadline: float) -> bool:
+    """
+    Три магазина с разметкой Gloria Jeans: два пересекаются на половину выдачи,
+    третий отвечает дольше своего срока. Ждём слияние без дублей и то, что
+    медленный магазин не задерживает поиск дольше своего срока.
+    """
+    from stores import GLORIA_JEANS
+
+    slow_delay, slow_deadline = deadline, deadline / 4
+    with tempfile.TemporaryDirectory() as root:
+        write_store_fixture(root, "main", render_search_grid(60, seed=1, first_id=100000))
+        write_store_fixture(root, "mirror", render_search_grid(60, seed=2, first_id=100030))
+        write_store_fixture(root, "slow", render_search_grid(60, seed=3, first_id=200000))
+
+        with FixtureServer(root, delays={"slow": slow_delay}) as server:
+            adapters = []
+            for name in ("main", "mirror", "slow"):
+                adapter = GLORIA_JEANS.retarget(server.url(name))
+                adapter.name = f"fixture-{name}"
+                adapters.append(adapter)
+            adapters[2].deadline = slow_deadline
+
+            products, seconds = search(app, adapters, "джинсы", deadline)
+
+    links = [p["link"] for p in products]
+    ok = len(links) == len(set(links)) == 90 and seconds < slow_delay
+    print(f"  найдено {len(links)} товаров (ждём 90 без повторов), уникальных {len(set(links))}, "
+          f"{seconds:.2f} с (медленный магазин: срок {slow_deadline:.1f} с, отвечает за {slow_delay:.1f} с)")
+    return ok
+
+
+def check_saved(app, fixtures_dir: str, deadline: float) -> bool:
+    """Каждая папка с именем зарегистрированного адаптера — сохранённые страницы этого магазина."""
+    from stores import STORES
+
+    names = sorted(d for d in os.listdir(fixtures_dir) if d in STORES)
+    if not names:
+        print(f"  в {fixtures_dir} нет папок с именами адаптеров: {', '.join(STORES)}")
+        return False
+    ok = True
+    with FixtureServer(fixtures_dir) as server:
+        for name in names:
+            products, seconds = search(app, [STORES[name].retarget(server.url(name))], "джинсы", deadline)
+            complete = sum(1 for p in products if p["title"] and p["price"] and p["link"])
+            print(f"  {name:<20}{len(products):>5} товаров, с названием, ценой и ссылкой {complete}, {seconds:.2f} с")
+            ok = ok and complete > 0
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка адаптеров магазинов на локальных страницах")
+    parser.add_argument("--fixtures", default=None, help="папка с сохранёнными страницами магазинов")
+    parser.add_argument("--deadline", type=float, default=20.0, help="общий лимит поиска, с")
+    parser.add_argument("--show-browser", action="store_true")
+    args = parser.parse_args()
+
+    import app
+
+    app.DRIVER_HEADLESS = not args.show_browser
+    try:
+        if args.fixtures:
+            ok = check_saved(app, args.fixtures, args.deadline)
+        else:
+            ok = check_synthetic(app, args.deadline)
+    finally:
+        for pool in list(app._driver_pools.values()):
+            pool.close()
+    print("OK" if ok else "ОШИБКА")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
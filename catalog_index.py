@@ -0,0 +1,446 @@
+"""
+Локальный индекс каталога магазина для мгновенного текстового поиска.
+
+CatalogIndex — SQLite-файл с товарами и инвертированным индексом по названиям:
+название нормализуется, разбивается на слова, слова приводятся к основе
+(стеммер Портера для русского), и для каждой основы хранится список товаров.
+Цена хранится числом, поэтому выдачу можно фильтровать и сортировать по цене.
+
+CatalogCrawler в фоновом потоке обходит каталог по списку запросов-затравок
+(тип × цвет и т.п.) тем же парсером, что и бот. Обход инкрементальный: затравка
+повторяется не чаще раза в interval секунд, у известных товаров при повторной
+встрече обновляется только время, а название, цена и индекс переписываются,
+только если что-то изменилось. Товары, которых давно не видно в выдаче,
+удаляются. Пока пользователи ждут браузер, обход уступает его им.
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from search_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------ стеммер ------------------
+_VOWELS = set("аеиоуыэюя")
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")            # после а/я
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = ("ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+              "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")           # после а/я
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB_2 = ("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют", "ены",
+           "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю")
+_NOUN = ("иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий",
+         "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я")
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _regions(word: str) -> tuple:
+    """(RV, R2) — позиции, с которых начинаются области стеммера."""
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(word: str, start: int, endings, after_a: bool = False):
+    """Слово без самого длинного окончания из endings внутри области start; None — не нашлось."""
+    for ending in endings:
+        cut = len(word) - len(ending)
+        if cut >= start and word.endswith(ending):
+            if after_a and (cut - 1 < start or word[cut - 1] not in "ая"):
+                continue
+            return word[:cut]
+    return None
+
+
+def stem(word: str) -> str:
+    """Основа русского слова (Snowball Porter): 'черные', 'чёрный' -> 'черн', 'джинсов' -> 'джинс'."""
+    word = word.lower().replace("ё", "е")
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    stripped = _strip(word, rv, _PERFECTIVE_GERUND_1, after_a=True) or _strip(word, rv, _PERFECTIVE_GERUND_2)
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        adjective = _strip(word, rv, _ADJECTIVE)
+        if adjective is not None:
+            word = (_strip(adjective, rv, _PARTICIPLE_1, after_a=True)
+                    or _strip(adjective, rv, _PARTICIPLE_2) or adjective)
+        else:
+            word = (_strip(word, rv, _VERB_1, after_a=True) or _strip(word, rv, _VERB_2)
+                    or _strip(word, rv, _NOUN) or word)
+
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, r2, _DERIVATIONAL) or word
+    superlative = _strip(word, rv, _SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+_STOP_WORDS = {"и", "в", "во", "с", "со", "на", "для", "из", "по", "от", "до", "без", "или", "а"}
+
+
+def terms(text: str) -> list:
+    """Основы значимых слов текста без повторов, в порядке появления."""
+    seen = []
+    for word in normalize_query(text).split():
+        if word in _STOP_WORDS:
+            continue
+        t = stem(word)
+        if t and t not in seen:
+            seen.append(t)
+    return seen
+
+
+# ------------------ цены ------------------
+def parse_price(price: str) -> float | None:
+    """'1 999 ₽' -> 1999.0; первая сумма в строке, None — цены нет."""
+    m = re.search(r"(?:\d{1,3}(?:\s\d{3})+|\d+)(?:[.,]\d{1,2})?", price or "")
+    if not m:
+        return None
+    digits = re.sub(r"\s", "", m.group(0)).replace(",", ".")
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+_AMOUNT = r"\d{1,3}(?:\s\d{3})+|\d+"   # '1 999' или '1999'
+_PRICE_FILTER_RE = re.compile(
+    rf"(?:(?P<op>до|дешевле|от|дороже)\s+(?P<value>{_AMOUNT})|(?<!\d)(?P<low>{_AMOUNT})\s*-\s*(?P<high>{_AMOUNT}))"
+    r"\s*(?:руб(?:лей|ля|\.)?|р\.?|₽)?(?=\s|$)",
+    re.IGNORECASE,
+)
+
+
+def _amount(text: str) -> float:
+    return float(re.sub(r"\s", "", text))
+
+
+def parse_price_filter(query: str) -> tuple:
+    """
+    'черные джинсы до 2000' -> ('черные джинсы', None, 2000.0).
+    Понимает «до N», «дешевле N», «от N», «дороже N» и «N-M»; суммы можно писать
+    с пробелами между разрядами: 'джинсы 1 000-3 000 руб'.
+    """
+    min_price = max_price = None
+
+    def take(m):
+        nonlocal min_price, max_price
+        if m.group("op"):
+            value = _amount(m.group("value"))
+            if m.group("op").lower() in ("до", "дешевле"):
+                max_price = value
+            else:
+                min_price = value
+        else:
+            min_price, max_price = _amount(m.group("low")), _amount(m.group("high"))
+        return " "
+
+    text = re.sub(r"\s+", " ", _PRICE_FILTER_RE.sub(take, query or "")).strip()
+    return text, min_price, max_price
+
+
+# ------------------ индекс ------------------
+_SORTS = {
+    "relevance": "p.last_seen DESC, p.id",
+    "price_asc": "p.price IS NULL, p.price, p.id",
+    "price_desc": "p.price IS NULL, p.price DESC, p.id",
+}
+
+
+def _digest(product: dict) -> str:
+    key = "\x1f".join(str(product.get(f) or "") for f in ("title", "price", "image"))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class CatalogIndex:
+    """
+    path — файл SQLite. max_age — товар, которого не видели в выдаче дольше
+    стольких секунд, в поиске не участвует и удаляется при prune().
+    """
+
+    def __init__(self, path: str, max_age: float = 3 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " id INTEGER PRIMARY KEY,"
+            " link TEXT NOT NULL UNIQUE,"
+            " title TEXT NOT NULL,"
+            " price_text TEXT NOT NULL,"
+            " price REAL,"
+            " image TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " first_seen REAL NOT NULL,"
+            " last_seen REAL NOT NULL,"
+            " updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS products_last_seen ON products(last_seen);"
+            "CREATE TABLE IF NOT EXISTS terms ("
+            " term TEXT NOT NULL,"
+            " product_id INTEGER NOT NULL,"
+            " PRIMARY KEY (term, product_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS terms_product ON terms(product_id);"
+            "CREATE TABLE IF NOT EXISTS seeds ("
+            " query TEXT PRIMARY KEY,"
+            " crawled_at REAL NOT NULL,"
+            " products INTEGER NOT NULL);"
+        )
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    # ------------------ запись ------------------
+    def upsert(self, products: list) -> tuple:
+        """Добавляет новые товары и обновляет изменившиеся. Возвращает (новых, изменённых, без изменений)."""
+        now = time.time()
+        added = changed = unchanged = 0
+        with self._lock:
+            for product in products:
+                link = (product.get("link") or "").strip()
+                title = (product.get("title") or "").strip()
+                if not link or not title:
+                    continue
+                digest = _digest(product)
+                row = self._conn.execute("SELECT id, digest, title FROM products WHERE link = ?",
+                                         (link,)).fetchone()
+                if row is not None and row[1] == digest:
+                    self._conn.execute("UPDATE products SET last_seen = ? WHERE id = ?", (now, row[0]))
+                    unchanged += 1
+                    continue
+
+                price_text = product.get("price") or ""
+                values = (title, price_text, parse_price(price_text), product.get("image") or "", digest)
+                if row is None:
+                    product_id = self._conn.execute(
+                        "INSERT INTO products (title, price_text, price, image, digest, link,"
+                        " first_seen, last_seen, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        values + (link, now, now, now),
+                    ).lastrowid
+                    added += 1
+                else:
+                    product_id = row[0]
+                    self._conn.execute(
+                        "UPDATE products SET title = ?, price_text = ?, price = ?, image = ?, digest = ?,"
+                        " last_seen = ?, updated_at = ? WHERE id = ?",
+                        values + (now, now, product_id),
+                    )
+                    changed += 1
+                    if row[2] == title:
+                        # Поменялась только цена или картинка — индекс слов прежний
+                        continue
+                    self._conn.execute("DELETE FROM terms WHERE product_id = ?", (product_id,))
+                self._conn.executemany("INSERT OR IGNORE INTO terms (term, product_id) VALUES (?, ?)",
+                                       [(t, product_id) for t in terms(title)])
+            self._conn.commit()
+            self.added += added
+            self.changed += changed
+            self.unchanged += unchanged
+        return added, changed, unchanged
+
+    def prune(self) -> int:
+        """Удаляет товары, которых не видели дольше max_age. Возвращает, сколько удалено."""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            self._conn.execute("DELETE FROM terms WHERE product_id IN"
+                               " (SELECT id FROM products WHERE last_seen < ?)", (cutoff,))
+            removed = self._conn.execute("DELETE FROM products WHERE last_seen < ?", (cutoff,)).rowcount
+            self._conn.commit()
+            self.removed += removed
+        return removed
+
+    # ------------------ затравки обхода ------------------
+    def mark_seed(self, query: str, products: int):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO seeds (query, crawled_at, products) VALUES (?, ?, ?)",
+                               (normalize_query(query), time.time(), products))
+            self._conn.commit()
+
+    def due_seeds(self, seeds: list, interval: float) -> list:
+        """Затравки, которые ни разу не обходили или обходили дольше interval назад; давние — первыми."""
+        with self._lock:
+            crawled = dict(self._conn.execute("SELECT query, crawled_at FROM seeds").fetchall())
+        cutoff = time.time() - interval
+        due = [s for s in seeds if crawled.get(normalize_query(s), 0.0) < cutoff]
+        return sorted(due, key=lambda s: crawled.get(normalize_query(s), 0.0))
+
+    # ------------------ поиск ------------------
+    def search(self, query: str, min_price: float | None = None, max_price: float | None = None,
+               sort: str = "relevance", limit: int = 300) -> list:
+        """
+        Товары, в названии которых есть все слова запроса (с точностью до окончаний),
+        в виде словарей парсера: title, price, link, image.
+        sort: relevance (недавно виденные первыми), price_asc или price_desc.
+        """
+        query_terms = terms(query)
+        if not query_terms:
+            return []
+        sql = ["SELECT p.title, p.price_text, p.link, p.image FROM terms t JOIN products p ON p.id = t.product_id"
+               f" WHERE t.term IN ({', '.join('?' * len(query_terms))}) AND p.last_seen >= ?"]
+        args = list(query_terms) + [time.time() - self.max_age]
+        if min_price is not None:
+            sql.append(" AND p.price >= ?")
+            args.append(min_price)
+        if max_price is not None:
+            sql.append(" AND p.price <= ?")
+            args.append(max_price)
+        sql.append(f" GROUP BY p.id HAVING COUNT(*) = ? ORDER BY {_SORTS[sort]} LIMIT ?")
+        args += [len(query_terms), limit]
+
+        with self._lock:
+            rows = self._conn.execute("".join(sql), args).fetchall()
+            if rows:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return [{"title": title, "price": price, "link": link, "image": image}
+                for title, price, link, image in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            products = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            seeds = self._conn.execute("SELECT COUNT(*) FROM seeds").fetchone()[0]
+        return {
+            "products": products,
+            "seeds": seeds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "added": self.added,
+            "changed": self.changed,
+            "unchanged": self.unchanged,
+            "removed": self.removed,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ------------------ обход каталога ------------------
+class CatalogCrawler:
+    """
+    Фоновый обход каталога.
+    fetch(query) — итератор пачек товаров (app.iter_parser),
+    seeds — запросы, которыми обходится каталог,
+    interval — как часто повторять одну затравку, с,
+    pause — пауза между затравками, с,
+    busy() — True, если браузер сейчас нужнее пользователям: обход ждёт,
+    а начатая затравка прерывается и будет повторена позже.
+    """
+
+    def __init__(self, index: CatalogIndex, fetch, seeds: list, interval: float = 12 * 3600,
+                 pause: float = 5.0, busy=None):
+        self.index = index
+        self.fetch = fetch
+        self.seeds = list(dict.fromkeys(seeds))
+        self.interval = interval
+        self.pause = pause
+        self.busy = busy or (lambda: False)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="catalog-crawler", daemon=True)
+
+        self.crawled = 0
+        self.interrupted = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def crawl(self, seed: str) -> bool:
+        """Один проход по затравке. False — прервали ради пользователей или поиск упал."""
+        products, complete = [], True
+        try:
+            batches = self.fetch(seed)
+            try:
+                for batch in batches:
+                    products.extend(batch)
+                    if self.busy() or self._stop.is_set():
+                        complete = False
+                        break
+            finally:
+                batches.close()
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Обход каталога: поиск '{seed}' упал: {e}")
+            # Повторим через interval, а не сразу: сайт мог поменяться
+            self.index.mark_seed(seed, 0)
+            return False
+
+        added, changed, unchanged = self.index.upsert(products)
+        if not complete:
+            self.interrupted += 1
+            return False
+        self.index.mark_seed(seed, len(products))
+        self.crawled += 1
+        logger.info(f"Обход каталога: '{seed}' — {len(products)} товаров, новых {added}, изменилось {changed}")
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            due = self.index.due_seeds(self.seeds, self.interval)
+            for seed in due:
+                while self.busy() and not self._stop.wait(self.pause):
+                    pass
+                if self._stop.is_set():
+                    return
+                self.crawl(seed)
+                self._stop.wait(self.pause)
+            if due:
+                removed = self.index.prune()
+                if removed:
+                    logger.info(f"Обход каталога: удалено {removed} товаров, пропавших из выдачи")
+            else:
+                self._stop.wait(min(self.interval, 60.0))
+
+    def stats(self) -> dict:
+        return {
+            "crawled": self.crawled,
+            "interrupted": self.interrupted,
+            "failed": self.failed,
+            "due": len(self.index.due_seeds(self.seeds, self.interval)),
+        }
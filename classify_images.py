@@ -0,0 +1,302 @@
+"""
+Пакетная разметка картинок моделью бота: тип, цвет, принт и их вероятности.
+
+Примеры:
+    python classify_images.py /data/catalog --out labels.jsonl
+    python classify_images.py "/data/images/*.jpg" --out labels.parquet --batch-size 128
+    python classify_images.py photos.csv --csv-column path --out labels.jsonl --pool process
+
+Картинки декодируются и уменьшаются параллельно (потоки или процессы), пока
+модель считает предыдущий батч; в модель уходят большие батчи по --batch-size.
+Результат пишется после каждого батча, поэтому прерванный запуск можно просто
+повторить с тем же --out: уже размеченные пути пропускаются. Картинки, которые
+не удалось прочитать, тоже записываются (с полем error); с --retry-errors они
+размечаются заново, и актуальной считается последняя строка по пути. Для Parquet
+--out — папка, в которую пишутся части part-NNNNN.parquet с общей схемой.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from app import (
+    COLOR_CLASSES,
+    IMG_SIZE,
+    PRINT_CLASSES,
+    TYPE_CLASSES,
+    decode_predictions,
+    get_model,
+    image_to_uint8,
+    load_image,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+_INV_255 = np.float32(1.0 / 255.0)
+
+
+# ================== ИСТОЧНИКИ ==================
+def list_images(source: str, csv_column: str | None = None) -> list:
+    """Пути к картинкам: папка (рекурсивно), glob-шаблон или CSV со столбцом путей."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _dirs, files in os.walk(source):
+            paths.extend(os.path.join(root, f) for f in files
+                         if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+        return sorted(paths)
+
+    if source.lower().endswith(".csv") and os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            column = csv_column or reader.fieldnames[0]
+            if column not in reader.fieldnames:
+                raise ValueError(f"В {source} нет столбца {column}: {', '.join(reader.fieldnames)}")
+            # Относительные пути считаем от папки CSV
+            return [os.path.join(base, row[column]) for row in reader if row.get(column)]
+
+    return sorted(glob.glob(source, recursive=True))
+
+
+# ================== ДЕКОДИРОВАНИЕ ==================
+def decode(path: str):
+    """(path, uint8 (H, W, 3) или None, ошибка или None). Выполняется в пуле."""
+    try:
+        with open(path, "rb") as f:
+            img = load_image(f.read())
+        return path, image_to_uint8(img)[0], None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def decoded(paths: list, executor, prefetch: int):
+    """Результаты decode по порядку; в работе одновременно не больше prefetch картинок."""
+    pending = deque()
+    it = iter(paths)
+    for path in it:
+        pending.append(executor.submit(decode, path))
+        if len(pending) >= prefetch:
+            break
+    while pending:
+        yield pending.popleft().result()
+        nxt = next(it, None)
+        if nxt is not None:
+            pending.append(executor.submit(decode, nxt))
+
+
+# ================== ЗАПИСЬ ==================
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def done_paths(self, with_errors: bool = True) -> set:
+        """Пути, которые уже есть в результате; with_errors=False — только размеченные без ошибки."""
+        if not os.path.exists(self.path):
+            return set()
+        done = set()
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # Прерванная запись могла оставить неполную последнюю строку — отрезаем её
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+        failed = set()
+        for line in data[:end].splitlines():
+            try:
+                row = json.loads(line)
+                path = row["path"]
+            except (ValueError, KeyError):
+                continue
+            if row.get("error") is None:
+                done.add(path)
+                failed.discard(path)
+            else:
+                failed.add(path)
+        return done | failed if with_errors else done
+
+    def write(self, rows: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def parquet_schema():
+    """Одна схема для всех частей: иначе в части из одних ошибок не было бы столбцов меток."""
+    import pyarrow as pa
+
+    probs = pa.list_(pa.float64())
+    return pa.schema([
+        ("path", pa.string()),
+        ("type", pa.string()),
+        ("type_prob", pa.float64()),
+        ("color", pa.string()),
+        ("color_prob", pa.float64()),
+        ("print", pa.string()),
+        ("print_prob", pa.float64()),
+        ("type_probs", probs),
+        ("color_probs", probs),
+        ("print_probs", probs),
+        ("error", pa.string()),
+    ])
+
+
+class ParquetWriter:
+    def __init__(self, path: str):
+        import pyarrow  # noqa: F401 — понятная ошибка сразу, а не после первого батча
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._parts = len(glob.glob(os.path.join(path, "part-*.parquet")))
+        self._schema = parquet_schema()
+
+    def done_paths(self, with_errors: bool = True) -> set:
+        """Пути, которые уже есть в результате; with_errors=False — только размеченные без ошибки."""
+        import pyarrow.parquet as pq
+
+        done, failed = set(), set()
+        # Части по порядку записи: повторная разметка пути лежит в более поздней
+        for part in sorted(glob.glob(os.path.join(self.path, "part-*.parquet"))):
+            try:
+                table = pq.read_table(part, columns=["path", "error"])
+            except Exception:
+                # Часть, запись которой прервали, перепишется заново
+                os.remove(part)
+                continue
+            for path, error in zip(table.column("path").to_pylist(), table.column("error").to_pylist()):
+                if error is None:
+                    done.add(path)
+                    failed.discard(path)
+                else:
+                    failed.add(path)
+        return done | failed if with_errors else done
+
+    def write(self, rows: list):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+        tmp = part + ".tmp"
+        pq.write_table(pa.Table.from_pylist(rows, schema=self._schema), tmp)
+        os.replace(tmp, part)
+        self._parts += 1
+
+
+def make_writer(out: str):
+    if out.endswith(".jsonl") or out.endswith(".json"):
+        return JsonlWriter(out)
+    return ParquetWriter(out)
+
+
+# ================== РАЗМЕТКА ==================
+def label_rows(paths: list, preds) -> list:
+    type_probs, color_probs, print_probs = (np.asarray(p) for p in preds)
+    rows = []
+    for i, path in enumerate(paths):
+        type_label, color_label, print_label = decode_predictions(preds, i)
+        rows.append({
+            "path": path,
+            "type": type_label,
+            "type_prob": float(type_probs[i][TYPE_CLASSES.index(type_label)]),
+            "color": color_label,
+            "color_prob": float(color_probs[i][COLOR_CLASSES.index(color_label)]),
+            "print": print_label,
+            "print_prob": float(print_probs[i][min(PRINT_CLASSES.index(print_label), print_probs.shape[1] - 1)]),
+            "type_probs": [float(p) for p in type_probs[i]],
+            "color_probs": [float(p) for p in color_probs[i]],
+            "print_probs": [float(p) for p in print_probs[i]],
+            "error": None,
+        })
+    return rows
+
+
+def run(args) -> dict:
+    paths = list_images(args.source, args.csv_column)
+    writer = make_writer(args.out)
+    done = writer.done_paths(with_errors=not args.retry_errors)
+    todo = [p for p in paths if p not in done]
+    print(f"Картинок: {len(paths)}, уже размечено: {len(paths) - len(todo)}, осталось: {len(todo)}",
+          file=sys.stderr)
+    if not todo:
+        return {"images": 0, "errors": 0, "seconds": 0.0}
+
+    model = get_model()
+    batch_size = args.batch_size
+    u8 = np.empty((batch_size, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.uint8)
+    x = np.empty(u8.shape, dtype=np.float32)
+
+    pool_cls = ProcessPoolExecutor if args.pool == "process" else ThreadPoolExecutor
+    workers = args.decoders or os.cpu_count() or 4
+    processed = errors = 0
+    model_seconds = 0.0
+    started = last_report = time.perf_counter()
+
+    with pool_cls(max_workers=workers) as executor:
+        batch_paths, failed = [], []
+
+        def flush():
+            nonlocal processed, model_seconds
+            rows = []
+            if batch_paths:
+                n = len(batch_paths)
+                t = time.perf_counter()
+                np.multiply(u8[:n], _INV_255, out=x[:n])
+                preds = model.predict(x[:n])
+                model_seconds += time.perf_counter() - t
+                rows = label_rows(batch_paths, preds)
+            rows.extend(failed)
+            writer.write(rows)
+            processed += len(rows)
+            batch_paths.clear()
+            failed.clear()
+
+        for path, image, error in decoded(todo, executor, prefetch=batch_size * 2):
+            if image is None:
+                errors += 1
+                failed.append({"path": path, "error": error})
+            else:
+                u8[len(batch_paths)] = image
+                batch_paths.append(path)
+            if len(batch_paths) == batch_size:
+                flush()
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                last_report = now
+                print(f"  {processed}/{len(todo)}, {processed / (now - started):.1f} карт./с", file=sys.stderr)
+        if batch_paths or failed:
+            flush()
+
+    seconds = time.perf_counter() - started
+    return {"images": processed, "errors": errors, "seconds": seconds, "model_seconds": model_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная разметка картинок моделью бота")
+    parser.add_argument("source", help="папка, glob-шаблон или CSV с путями к картинкам")
+    parser.add_argument("--out", required=True, help="файл .jsonl или папка для Parquet")
+    parser.add_argument("--csv-column", default=None, help="столбец CSV с путями (по умолчанию первый)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread",
+                        help="чем декодировать картинки: потоками (PIL отпускает GIL) или процессами")
+    parser.add_argument("--decoders", type=int, default=None, help="размер пула декодирования")
+    parser.add_argument("--report-every", type=float, default=10.0, help="период вывода прогресса, с")
+    parser.add_argument("--retry-errors", action="store_true",
+                        help="заново разметить картинки, которые в прошлый раз не удалось прочитать")
+    args = parser.parse_args()
+
+    r = run(args)
+    if r["images"]:
+        print(f"Размечено {r['images']} картинок ({r['errors']} с ошибкой) за {r['seconds']:.1f} с: "
+              f"{r['images'] / r['seconds']:.1f} карт./с, из них модель {r['model_seconds']:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Пул заранее запущенных браузеров для парсера.
+
+Драйверы создаются фабрикой заранее и ждут на странице поиска магазина.
+Запрос берёт драйвер из пула (с таймаутом), после использования драйвер
+сбрасывается и возвращается обратно. Драйвер пересоздаётся после max_uses
+запросов, после падения и если не прошёл фоновую проверку здоровья.
+Число живых браузеров никогда не превышает size.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class DriverPoolTimeout(Exception):
+    """Не дождались свободного драйвера."""
+
+
+class _PooledDriver:
+    __slots__ = ("driver", "uses", "created_at")
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created_at = time.monotonic()
+
+
+class DriverPool:
+    """
+    factory() -> driver: запускает браузер и открывает на нём страницу поиска.
+    reset(driver): чистит состояние между запросами и возвращает драйвер на страницу поиска.
+    ping(driver): быстрая проверка, что браузер жив (должна бросить исключение, если нет).
+    """
+
+    def __init__(self, factory, reset=None, ping=None, size: int = 2, max_uses: int = 30,
+                 health_interval: float = 30.0, name: str = "driver-pool"):
+        if size < 1:
+            raise ValueError("size должен быть >= 1")
+        self.factory = factory
+        self.reset = reset
+        self.ping = ping or (lambda d: d.execute_script("return 1"))
+        self.size = size
+        self.max_uses = max_uses
+        self.health_interval = health_interval
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._idle: list[_PooledDriver] = []
+        self._live = 0          # живые + запускающиеся драйверы, не больше size
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self._created = 0
+        self._recycled = 0
+        self._crashed = 0
+
+    # ------------------ жизненный цикл ------------------
+    def start(self):
+        """Запускает фоновый поток, который прогревает и проверяет драйверы."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._maintain, name=self.name, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        self._wakeup.set()
+        for entry in idle:
+            self._quit(entry)
+
+    # ------------------ выдача драйверов ------------------
+    @contextmanager
+    def driver(self, timeout: float | None = None):
+        """
+        with pool.driver(timeout=30) as driver: ...
+        Если в теле возникло исключение, драйвер считается сломанным и пересоздаётся.
+        """
+        entry = self._checkout(timeout)
+        try:
+            yield entry.driver
+        except GeneratorExit:
+            # Потребитель закрыл генератор раньше времени — браузер исправен
+            self._checkin(entry)
+            raise
+        except BaseException:
+            self._crashed += 1
+            self._discard(entry)
+            raise
+        else:
+            self._checkin(entry)
+
+    def _checkout(self, timeout: float | None) -> _PooledDriver:
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Пул драйверов закрыт")
+                if self._idle:
+                    return self._idle.pop()
+                if self._live < self.size:
+                    # Свободных нет, но лимит позволяет запустить ещё один браузер
+                    self._live += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise DriverPoolTimeout(f"Нет свободного браузера за {timeout} с")
+                self._cond.wait(remaining)
+
+        try:
+            return self._spawn()
+        except BaseException:
+            with self._cond:
+                self._live -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, entry: _PooledDriver):
+        entry.uses += 1
+        if entry.uses >= self.max_uses:
+            self._recycled += 1
+            self._discard(entry)
+            return
+        try:
+            if self.reset is not None:
+                self.reset(entry.driver)
+        except Exception as e:
+            logger.warning("Не удалось сбросить браузер, пересоздаю: %s", e)
+            self._crashed += 1
+            self._discard(entry)
+            return
+        with self._cond:
+            if self._closed:
+                self._live -= 1
+            else:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        self._quit(entry)
+
+    # ------------------ создание / удаление ------------------
+    def _spawn(self) -> _PooledDriver:
+        driver = self.factory()
+        self._created += 1
+        return _PooledDriver(driver)
+
+    def _quit(self, entry: _PooledDriver):
+        try:
+            entry.driver.quit()
+        except Exception:
+            pass
+
+    def _discard(self, entry: _PooledDriver):
+        self._quit(entry)
+        with self._cond:
+            self._live -= 1
+            self._cond.notify()
+        # Фоновый поток запустит замену
+        self._wakeup.set()
+
+    # ------------------ фоновое обслуживание ------------------
+    def _maintain(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+            self._health_check()
+            self._refill()
+            self._wakeup.wait(self.health_interval)
+            self._wakeup.clear()
+
+    def _refill(self):
+        """Держит пул полным, чтобы запросу не приходилось ждать запуска браузера."""
+        while True:
+            with self._cond:
+                if self._closed or self._live >= self.size:
+                    return
+                self._live += 1
+            try:
+                entry = self._spawn()
+            except Exception as e:
+                logger.error("Не удалось запустить браузер для пула: %s", e)
+                with self._cond:
+                    self._live -= 1
+                    self._cond.notify()
+                return
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def _health_check(self):
+        with self._cond:
+            to_check, self._idle = self._idle, []
+        healthy = []
+        for entry in to_check:
+            try:
+                self.ping(entry.driver)
+                healthy.append(entry)
+            except Exception as e:
+                logger.warning("Браузер из пула не отвечает, пересоздаю: %s", e)
+                self._crashed += 1
+                self._quit(entry)
+                with self._cond:
+                    self._live -= 1
+        with self._cond:
+            self._idle.extend(healthy)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "live": self._live,
+                "idle": len(self._idle),
+                "created": self._created,
+                "recycled": self._recycled,
+                "crashed": self._crashed,
+            }
@@ -0,0 +1,220 @@
+"""
+Конвертация clothing_multitask_mobilenetv2.keras в облегчённые форматы и проверка паритета.
+
+Примеры:
+    python export_model.py convert --data-root /content --formats tflite_fp16 tflite_int8 onnx
+    python export_model.py check --data-root /content --backends tflite_fp16 tflite_int8 onnx
+
+Калибровочный набор для int8 и проверочный набор берутся из датасета ноутбука
+(styles.csv + images/{id}.jpg) и проходят ту же предобработку, что и в боте.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app import (
+    MODEL_PATH,
+    TYPE_CLASSES,
+    COLOR_CLASSES,
+    PRINT_CLASSES,
+    preprocess_image_bytes,
+)
+from inference import BACKENDS, HEAD_NAMES, artifact_path, build_embedding_model, load_engine
+
+HEAD_SIZES = (len(TYPE_CLASSES), len(COLOR_CLASSES), len(PRINT_CLASSES))
+
+# articleType, которые ноутбук отображает в наши классы (TYPE_MAP)
+DATASET_ARTICLE_TYPES = {
+    "Tshirts", "Shirts", "Sweatshirts", "Sweaters", "Jackets", "Jeans",
+    "Track Pants", "Trousers", "Shorts", "Casual Shoes", "Sports Shoes",
+    "Flip Flops", "Sandals",
+}
+
+
+def dataset_image_paths(data_root: str, limit: int, seed: int = 42) -> list:
+    """Случайная выборка путей к картинкам датасета ноутбука."""
+    csv_path = os.path.join(data_root, "styles.csv")
+    images_dir = os.path.join(data_root, "images")
+
+    paths = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("articleType") not in DATASET_ARTICLE_TYPES:
+                continue
+            path = os.path.join(images_dir, f"{row.get('id')}.jpg")
+            if os.path.exists(path):
+                paths.append(path)
+
+    random.Random(seed).shuffle(paths)
+    return paths[:limit]
+
+
+def load_batch(paths: list) -> np.ndarray:
+    arrays = []
+    for p in paths:
+        with open(p, "rb") as f:
+            arrays.append(preprocess_image_bytes(f.read()))
+    return np.concatenate(arrays, axis=0)
+
+
+# ================== КОНВЕРТАЦИЯ ==================
+def convert_tflite(model, out_path: str, quantization: str, calib: np.ndarray | None = None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calib is None or not len(calib):
+            raise ValueError("Для int8 нужен калибровочный набор")
+
+        def representative_dataset():
+            for i in range(calib.shape[0]):
+                yield [calib[i:i + 1]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    else:
+        raise ValueError(f"Неизвестный режим квантования: {quantization}")
+
+    with open(out_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(model, out_path: str, opset: int = 13):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=out_path)
+
+
+def cmd_convert(args):
+    try:
+        from tensorflow import keras
+    except ImportError:
+        import keras
+
+    model = keras.models.load_model(args.model)
+
+    calib = None
+    if "tflite_int8" in args.formats:
+        paths = dataset_image_paths(args.data_root, args.calib_size)
+        print(f"Калибровочный набор: {len(paths)} картинок из {args.data_root}")
+        calib = load_batch(paths)
+
+    # Рядом с каждой моделью — модель эмбеддингов для визуального поиска (engine.embed)
+    embedding_model = build_embedding_model(model)
+    for fmt in args.formats:
+        for source, out_path in ((model, artifact_path(args.model, fmt)),
+                                 (embedding_model, artifact_path(args.model, fmt, embedding=True))):
+            started = time.perf_counter()
+            if fmt == "tflite_fp16":
+                convert_tflite(source, out_path, "fp16")
+            elif fmt == "tflite_int8":
+                convert_tflite(source, out_path, "int8", calib)
+            elif fmt == "onnx":
+                convert_onnx(source, out_path)
+            else:
+                raise SystemExit(f"Неизвестный формат: {fmt}")
+            size_mb = os.path.getsize(out_path) / 2 ** 20
+            print(f"{fmt}: {out_path} ({size_mb:.1f} МБ, {time.perf_counter() - started:.1f} с)")
+
+
+# ================== ПРОВЕРКА ПАРИТЕТА ==================
+def measure_latency(engine, x: np.ndarray, warmup: int = 5) -> dict:
+    """Латентность одиночного запроса (батч из одной картинки) на CPU, мс."""
+    for i in range(min(warmup, x.shape[0])):
+        engine.predict(x[i:i + 1])
+    times = []
+    for i in range(x.shape[0]):
+        started = time.perf_counter()
+        engine.predict(x[i:i + 1])
+        times.append((time.perf_counter() - started) * 1000.0)
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p99_ms": float(np.percentile(times, 99)),
+    }
+
+
+def predict_all(engine, x: np.ndarray, batch_size: int = 32) -> list:
+    heads = [[], [], []]
+    for i in range(0, x.shape[0], batch_size):
+        for h, out in zip(heads, engine.predict(x[i:i + batch_size])):
+            h.append(out)
+    return [np.concatenate(h, axis=0) for h in heads]
+
+
+def cmd_check(args):
+    paths = dataset_image_paths(args.data_root, args.samples)
+    print(f"Проверочный набор: {len(paths)} картинок из {args.data_root}")
+    x = load_batch(paths)
+
+    reference = load_engine("keras", args.model, HEAD_SIZES, num_threads=args.threads)
+    ref_preds = predict_all(reference, x)
+    ref_latency = measure_latency(reference, x)
+
+    report = {"samples": int(x.shape[0]), "keras": ref_latency, "backends": {}}
+    for backend in args.backends:
+        engine = load_engine(backend, args.model, HEAD_SIZES, num_threads=args.threads)
+        preds = predict_all(engine, x)
+        agreement = {
+            head: float(np.mean(np.argmax(p, axis=-1) == np.argmax(r, axis=-1)))
+            for head, p, r in zip(HEAD_NAMES, preds, ref_preds)
+        }
+        latency = measure_latency(engine, x)
+        report["backends"][backend] = {
+            "agreement": agreement,
+            **latency,
+            "p50_speedup": ref_latency["p50_ms"] / latency["p50_ms"],
+            "p99_speedup": ref_latency["p99_ms"] / latency["p99_ms"],
+        }
+
+    print(f"keras: p50={ref_latency['p50_ms']:.1f} мс, p99={ref_latency['p99_ms']:.1f} мс")
+    for backend, r in report["backends"].items():
+        agree = ", ".join(f"{h}={v:.3f}" for h, v in r["agreement"].items())
+        print(
+            f"{backend}: {agree}; p50={r['p50_ms']:.1f} мс (x{r['p50_speedup']:.2f}), "
+            f"p99={r['p99_ms']:.1f} мс (x{r['p99_speedup']:.2f})"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели и проверка паритета движков")
+    parser.add_argument("--model", default=MODEL_PATH, help="путь к .keras модели")
+    parser.add_argument("--data-root", default="/content", help="корень датасета из ноутбука")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="собрать tflite/onnx артефакты")
+    conv.add_argument("--formats", nargs="+", default=[b for b in BACKENDS if b != "keras"],
+                      choices=[b for b in BACKENDS if b != "keras"])
+    conv.add_argument("--calib-size", type=int, default=200, help="картинок для int8 калибровки")
+    conv.set_defaults(func=cmd_convert)
+
+    check = sub.add_parser("check", help="сравнить движки с keras-моделью")
+    check.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b != "keras"],
+                       choices=[b for b in BACKENDS if b != "keras"])
+    check.add_argument("--samples", type=int, default=300)
+    check.add_argument("--threads", type=int, default=None, help="потоков CPU на движок")
+    check.add_argument("--json", default=None, help="сохранить отчёт в JSON")
+    check.set_defaults(func=cmd_check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
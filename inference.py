@@ -0,0 +1,295 @@
+"""
+Движки инференса для многозадачной модели (тип / цвет / принт).
+
+Все движки возвращают то же, что и keras `model.predict`: список из трёх массивов
+[type_probs, color_probs, print_probs] с батчем по первой оси, поэтому
+декодирование меток в app.py от выбранного движка не зависит.
+
+embed(x) возвращает эмбеддинги для визуального поиска — вектор признаков backbone,
+общий вход трёх голов. Keras-движок строит его из той же модели, tflite/onnx
+загружают отдельный артефакт (export_model.py собирает его рядом с основным)
+при первом обращении.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEAD_NAMES = ("type_output", "color_output", "print_output")
+
+# Суффиксы артефактов, которые строит export_model.py рядом с .keras файлом
+ARTIFACT_SUFFIXES = {
+    "tflite_fp16": ".fp16.tflite",
+    "tflite_int8": ".int8.tflite",
+    "onnx": ".onnx",
+}
+
+
+def artifact_path(keras_path: str, backend: str, embedding: bool = False) -> str:
+    """Путь к сконвертированной модели для движка backend (embedding — модели эмбеддингов)."""
+    if backend == "keras":
+        return keras_path
+    root, _ = os.path.splitext(keras_path)
+    return root + (".embedding" if embedding else "") + ARTIFACT_SUFFIXES[backend]
+
+
+def build_embedding_model(model):
+    """Keras-модель "картинка -> пулинговые признаки backbone" из многозадачной модели."""
+    try:
+        from tensorflow import keras
+    except ImportError:
+        import keras
+
+    # Все три головы смотрят на один и тот же вектор признаков
+    features = model.get_layer(HEAD_NAMES[0]).input
+    return keras.Model(inputs=model.inputs, outputs=features, name="clothing_embedding")
+
+
+def _order_heads(named_outputs, head_sizes):
+    """
+    Раскладывает выходы в порядке (type, color, print).
+    Сначала по именам голов, если конвертер их сохранил, иначе по размеру выхода.
+    named_outputs — список пар (имя, массив).
+    """
+    by_name = {}
+    for name, arr in named_outputs:
+        for head in HEAD_NAMES:
+            if head in name:
+                by_name[head] = arr
+    if len(by_name) == len(HEAD_NAMES):
+        return [by_name[h] for h in HEAD_NAMES]
+
+    type_size, color_size = head_sizes[0], head_sizes[1]
+    ordered = [None, None, None]
+    for _, arr in named_outputs:
+        size = arr.shape[-1]
+        if size == type_size and ordered[0] is None:
+            ordered[0] = arr
+        elif size == color_size and ordered[1] is None:
+            ordered[1] = arr
+        else:
+            ordered[2] = arr
+    if any(a is None for a in ordered):
+        raise ValueError("Не удалось сопоставить выходы модели с головами тип/цвет/принт")
+    return ordered
+
+
+def _require(path: str, backend: str):
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Нет модели для движка {backend}: {path}. Соберите её через export_model.py convert"
+        )
+
+
+class InferenceEngine:
+    """
+    Базовый интерфейс: predict(x) -> [type_probs, color_probs, print_probs],
+    embed(x) -> эмбеддинги (N, dim).
+    """
+
+    name = "base"
+
+    def predict(self, x: np.ndarray) -> list:
+        raise NotImplementedError
+
+    def embed(self, x: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+def _set_tf_threads(tf, num_threads: int):
+    """
+    Ограничивает потоки TF до загрузки модели. Межоперационный пул, если его не задали
+    раньше (inference_workers), сводим к одному потоку: у одной модели почти нет
+    независимых веток, а без ограничения он берёт ещё по потоку на ядро.
+    """
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        if not tf.config.threading.get_inter_op_parallelism_threads():
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError as e:
+        # TF уже инициализирован в этом процессе — настройки потоков не меняются
+        logger.warning("Не удалось ограничить потоки TensorFlow (%s): %s", num_threads, e)
+
+
+class KerasEngine(InferenceEngine):
+    name = "keras"
+
+    def __init__(self, model_path: str, num_threads: int | None = None):
+        try:
+            import tensorflow as tf
+            from tensorflow import keras
+        except ImportError:
+            tf = None
+            import keras
+        if num_threads and tf is not None:
+            _set_tf_threads(tf, num_threads)
+        self.model = keras.models.load_model(model_path)
+        self._embedding_model = None
+        self._embedding_lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model) -> "KerasEngine":
+        """Движок поверх уже загруженной/построенной keras-модели."""
+        engine = cls.__new__(cls)
+        engine.model = model
+        engine._embedding_model = None
+        engine._embedding_lock = threading.Lock()
+        return engine
+
+    def predict(self, x: np.ndarray) -> list:
+        preds = self.model.predict(x, verbose=0)
+        return [np.asarray(p) for p in preds]
+
+    def embed(self, x: np.ndarray) -> np.ndarray:
+        if self._embedding_model is None:
+            with self._embedding_lock:
+                if self._embedding_model is None:
+                    self._embedding_model = build_embedding_model(self.model)
+        return np.asarray(self._embedding_model.predict(x, verbose=0))
+
+
+class TFLiteEngine(InferenceEngine):
+    """
+    TFLite-модель (float16 или int8 после post-training квантования).
+    Интерпретатор не потокобезопасен: predict вызывается из одного потока батчера,
+    а embed — из разных, поэтому у эмбеддингов свой интерпретатор под блокировкой.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path: str, head_sizes, num_threads: int | None = None,
+                 embedding_path: str | None = None):
+        self.head_sizes = head_sizes
+        self.num_threads = num_threads
+        self.embedding_path = embedding_path
+        self.interpreter = self._load(model_path)
+        self._input = self.interpreter.get_input_details()[0]
+        self._batch = int(self._input["shape"][0])
+        self._embedding = None
+        self._embedding_lock = threading.Lock()
+
+    def _load(self, path: str):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        interpreter = Interpreter(model_path=path, num_threads=self.num_threads)
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def _resize(self, batch: int):
+        if batch == self._batch:
+            return
+        shape = list(self._input["shape"])
+        shape[0] = batch
+        self.interpreter.resize_tensor_input(self._input["index"], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._batch = batch
+
+    def predict(self, x: np.ndarray) -> list:
+        self._resize(x.shape[0])
+        return _order_heads(_invoke(self.interpreter, self._input, x), self.head_sizes)
+
+    def embed(self, x: np.ndarray) -> np.ndarray:
+        with self._embedding_lock:
+            if self._embedding is None:
+                _require(self.embedding_path, self.name)
+                self._embedding = self._load(self.embedding_path)
+            interpreter = self._embedding
+            details = interpreter.get_input_details()[0]
+            if int(details["shape"][0]) != x.shape[0]:
+                shape = list(details["shape"])
+                shape[0] = x.shape[0]
+                interpreter.resize_tensor_input(details["index"], shape)
+                interpreter.allocate_tensors()
+                details = interpreter.get_input_details()[0]
+            return _invoke(interpreter, details, x)[0][1]
+
+
+def _invoke(interpreter, input_details: dict, x: np.ndarray) -> list:
+    """Прогоняет батч через tflite-интерпретатор; [(имя выхода, float-массив)]."""
+    scale, zero_point = input_details["quantization"]
+    if input_details["dtype"] != np.float32 and scale:
+        # Квантованный вход: float -> int8/uint8
+        info = np.iinfo(input_details["dtype"])
+        x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+    interpreter.set_tensor(input_details["index"], x.astype(input_details["dtype"]))
+    interpreter.invoke()
+
+    outputs = []
+    for det in interpreter.get_output_details():
+        out = interpreter.get_tensor(det["index"])
+        scale, zero_point = det["quantization"]
+        if det["dtype"] != np.float32 and scale:
+            out = (out.astype(np.float32) - zero_point) * scale
+        outputs.append((det["name"], out))
+    return outputs
+
+
+class OnnxEngine(InferenceEngine):
+    name = "onnx"
+
+    def __init__(self, model_path: str, head_sizes, num_threads: int | None = None,
+                 embedding_path: str | None = None):
+        self.head_sizes = head_sizes
+        self.num_threads = num_threads
+        self.embedding_path = embedding_path
+        self.session = self._load(model_path)
+        self._input_name = self.session.get_inputs()[0].name
+        self._output_names = [o.name for o in self.session.get_outputs()]
+        self._embedding = None
+        self._embedding_lock = threading.Lock()
+
+    def _load(self, path: str):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if self.num_threads:
+            opts.intra_op_num_threads = self.num_threads
+        return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+    def predict(self, x: np.ndarray) -> list:
+        outs = self.session.run(self._output_names, {self._input_name: x.astype(np.float32)})
+        return _order_heads(list(zip(self._output_names, outs)), self.head_sizes)
+
+    def embed(self, x: np.ndarray) -> np.ndarray:
+        if self._embedding is None:
+            with self._embedding_lock:
+                if self._embedding is None:
+                    _require(self.embedding_path, self.name)
+                    self._embedding = self._load(self.embedding_path)
+        # Сессия onnxruntime потокобезопасна
+        session = self._embedding
+        return session.run(None, {session.get_inputs()[0].name: x.astype(np.float32)})[0]
+
+
+BACKENDS = ("keras", "tflite_fp16", "tflite_int8", "onnx")
+
+
+def load_engine(backend: str, keras_path: str, head_sizes, num_threads: int | None = None) -> InferenceEngine:
+    """
+    Создаёт движок по имени из конфига.
+    Для tflite/onnx путь к артефакту выводится из пути к .keras файлу.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный движок инференса: {backend}. Доступны: {', '.join(BACKENDS)}")
+
+    path = artifact_path(keras_path, backend)
+    _require(path, backend)
+
+    logger.info("Загружаю движок инференса %s из %s", backend, path)
+    embedding_path = artifact_path(keras_path, backend, embedding=True)
+    if backend == "keras":
+        engine = KerasEngine(path, num_threads=num_threads)
+    elif backend.startswith("tflite"):
+        engine = TFLiteEngine(path, head_sizes, num_threads=num_threads, embedding_path=embedding_path)
+    else:
+        engine = OnnxEngine(path, head_sizes, num_threads=num_threads, embedding_path=embedding_path)
+    engine.name = backend
+    return engine
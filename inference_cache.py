@@ -0,0 +1,223 @@
+"""
+Кэш результатов распознавания фото.
+
+Два ключа:
+- file_unique_id из Telegram — проверяется до скачивания файла;
+- перцептивный хэш (pHash) декодированной картинки — ловит пересжатые
+  и пересланные копии того же фото (близость по расстоянию Хэмминга).
+
+Размер ограничен, вытесняются давно не использованные записи (LRU).
+При указании path записи дублируются в SQLite и переживают перезапуск; порядок LRU
+хранится там же в столбце seq (номер последнего обращения). Изменения пишутся на диск
+пачками — раз в commit_interval секунд или по накоплении commit_every записей,
+а также при flush(); при падении теряются только последние обращения.
+
+Поиск по pHash перебирает все хэши, поэтому вызывать методы лучше не из event loop.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def perceptual_hash(img: Image.Image) -> int:
+    """64-битный pHash: DCT уменьшенной серой картинки, низкие частоты против медианы."""
+    gray = img.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class InferenceCache:
+    def __init__(self, max_entries: int = 5000, max_distance: int = 4, path: str | None = None,
+                 commit_every: int = 64, commit_interval: float = 5.0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+
+        self._lock = threading.Lock()
+        self._by_hash: OrderedDict = OrderedDict()   # phash -> result, в порядке LRU
+        self._by_file: dict = {}                     # file_unique_id -> phash
+        self._files: dict = {}                       # phash -> set(file_unique_id)
+        self._seq = 0                                # номер последнего обращения
+        self._dirty: dict = {}                       # phash -> seq, ещё не записанные на диск
+        self._committed_at = time.monotonic()
+
+        self.file_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS inference_cache ("
+                " phash INTEGER PRIMARY KEY,"
+                " file_ids TEXT NOT NULL,"
+                " result TEXT NOT NULL,"
+                " seq INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(inference_cache)")]
+            if "seq" not in columns:
+                # Файл от прежней версии: порядок обращений не сохранялся
+                self._conn.execute("ALTER TABLE inference_cache ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS inference_cache_seq ON inference_cache(seq)")
+            self._conn.commit()
+            self._load()
+
+    # ------------------ поиск ------------------
+    def get_by_file_id(self, file_unique_id: str):
+        with self._lock:
+            phash = self._by_file.get(file_unique_id)
+            if phash is None or phash not in self._by_hash:
+                return None
+            self._by_hash.move_to_end(phash)
+            self.file_hits += 1
+            self._touch(phash)
+            return self._by_hash[phash]
+
+    def get_by_hash(self, phash: int, file_unique_id: str | None = None):
+        """Точное совпадение или ближайший хэш в пределах max_distance бит."""
+        with self._lock:
+            found = phash if phash in self._by_hash else None
+            if found is None and self.max_distance > 0:
+                best = self.max_distance + 1
+                for candidate in self._by_hash:
+                    d = hamming(phash, candidate)
+                    if d < best:
+                        found, best = candidate, d
+            if found is None:
+                self.misses += 1
+                return None
+
+            self._by_hash.move_to_end(found)
+            self.hash_hits += 1
+            if file_unique_id:
+                # В следующий раз это же фото найдём без скачивания
+                self._link(file_unique_id, found)
+            self._touch(found)
+            return self._by_hash[found]
+
+    # ------------------ запись ------------------
+    def put(self, phash: int, result, file_unique_id: str | None = None):
+        with self._lock:
+            self._by_hash[phash] = tuple(result)
+            self._by_hash.move_to_end(phash)
+            if file_unique_id:
+                self._link(file_unique_id, phash)
+            self._touch(phash)
+            while len(self._by_hash) > self.max_entries:
+                old, _ = self._by_hash.popitem(last=False)
+                self._drop(old)
+
+    def _link(self, file_unique_id: str, phash: int):
+        previous = self._by_file.get(file_unique_id)
+        if previous is not None and previous != phash:
+            self._files[previous].discard(file_unique_id)
+        self._by_file[file_unique_id] = phash
+        self._files.setdefault(phash, set()).add(file_unique_id)
+
+    def _drop(self, phash: int):
+        for fid in self._files.pop(phash, ()):
+            del self._by_file[fid]
+        if self._conn is not None:
+            self._dirty[phash] = None
+
+    # ------------------ диск ------------------
+    def _touch(self, phash: int):
+        """Запоминает обращение к записи, чтобы после перезапуска порядок LRU сохранился."""
+        if self._conn is None:
+            return
+        self._seq += 1
+        self._dirty[phash] = self._seq
+        if len(self._dirty) >= self.commit_every or time.monotonic() - self._committed_at >= self.commit_interval:
+            self._commit()
+
+    def _commit(self):
+        upserts, deletes = [], []
+        for phash, seq in self._dirty.items():
+            if seq is None or phash not in self._by_hash:
+                deletes.append((_to_signed(phash),))
+            else:
+                upserts.append((_to_signed(phash), json.dumps(sorted(self._files.get(phash, ()))),
+                                json.dumps(list(self._by_hash[phash])), seq))
+        with self._conn:
+            self._conn.executemany("DELETE FROM inference_cache WHERE phash = ?", deletes)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO inference_cache (phash, file_ids, result, seq) VALUES (?, ?, ?, ?)",
+                upserts,
+            )
+        self._dirty.clear()
+        self._committed_at = time.monotonic()
+
+    def flush(self):
+        """Записывает на диск накопленные изменения."""
+        with self._lock:
+            if self._conn is not None and self._dirty:
+                self._commit()
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT phash, file_ids, result, seq FROM inference_cache ORDER BY seq DESC, rowid DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for signed, file_ids, result, seq in reversed(rows):
+            phash = signed & 0xFFFFFFFFFFFFFFFF
+            self._by_hash[phash] = tuple(json.loads(result))
+            for fid in json.loads(file_ids):
+                self._link(fid, phash)
+            self._seq = max(self._seq, seq)
+        if len(rows) == self.max_entries:
+            # Лишнее (например, после уменьшения max_entries) удаляем и с диска
+            self._conn.execute(
+                "DELETE FROM inference_cache WHERE phash NOT IN"
+                " (SELECT phash FROM inference_cache ORDER BY seq DESC, rowid DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+        logger.info("Кэш распознавания: загружено %d записей", len(self._by_hash))
+
+    # ------------------ статистика ------------------
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.file_hits + self.hash_hits + self.misses
+            return {
+                "entries": len(self._by_hash),
+                "file_id_hits": self.file_hits,
+                "phash_hits": self.hash_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.file_hits + self.hash_hits) / lookups) if lookups else 0.0,
+            }
+
+
+def _to_signed(phash: int) -> int:
+    """SQLite INTEGER знаковый 64-битный."""
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
@@ -0,0 +1,318 @@
+"""
+Инференс в отдельных процессах.
+
+Каждый рабочий процесс один раз при старте загружает движок (load_engine) и
+дальше только прогоняет батчи. Картинки передаются через общую память: у
+каждого процесса свой сегмент на max_batch картинок, по каналу уходит лишь
+размер батча, тип данных и что посчитать (predict или embed), обратно — три
+небольших массива вероятностей или эмбеддинги.
+uint8-картинки переводятся в float32 [0, 1] уже в рабочем процессе, так что
+предобработка не занимает GIL процесса бота.
+
+Упавший или зависший процесс перезапускается: при следующем обращении к нему
+или фоновой проверкой. InferenceWorkerPool реализует тот же интерфейс
+InferenceEngine, его predict потокобезопасен и блокирует вызывающий поток
+(поток батчера), пока свободный процесс не вернёт результат.
+"""
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import InferenceEngine
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashed(RuntimeError):
+    """Рабочий процесс упал или завис во время прогона батча."""
+
+
+# ------------------ сторона рабочего процесса ------------------
+def _configure_threads(backend: str, intra_op_threads, inter_op_threads, cpus):
+    # Переменные окружения должны быть выставлены до первого импорта TF/onnxruntime
+    if intra_op_threads:
+        os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+        os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op_threads)
+    if inter_op_threads:
+        os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    if backend == "keras" and (intra_op_threads or inter_op_threads):
+        try:
+            import tensorflow as tf
+        except ImportError:
+            return
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def _worker_main(conn, shm_name: str, shape: tuple, backend: str, model_path: str, head_sizes,
+                 intra_op_threads, inter_op_threads, cpus):
+    from inference import load_engine
+
+    _configure_threads(backend, intra_op_threads, inter_op_threads, cpus)
+    engine = load_engine(backend, model_path, head_sizes, num_threads=intra_op_threads)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    as_uint8 = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    as_float32 = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    scaled = np.empty(shape, dtype=np.float32)
+    inv_255 = np.float32(1.0 / 255.0)
+
+    conn.send(("ready", os.getpid()))
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg is None:
+                break
+            n, dtype, op = msg
+            try:
+                if dtype == "uint8":
+                    x = np.multiply(as_uint8[:n], inv_255, out=scaled[:n])
+                else:
+                    x = as_float32[:n]
+                if op == "embed":
+                    conn.send(("ok", np.asarray(engine.embed(x))))
+                else:
+                    conn.send(("ok", [np.asarray(p) for p in engine.predict(x)]))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        del as_uint8, as_float32
+        shm.close()
+
+
+# ------------------ сторона бота ------------------
+class _Worker:
+    def __init__(self, index: int, shm: shared_memory.SharedMemory, shape: tuple):
+        self.index = index
+        self.shm = shm
+        self.as_uint8 = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        self.as_float32 = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+
+class InferenceWorkerPool(InferenceEngine):
+    """
+    workers процессов с движком backend. max_batch и image_shape (H, W, 3) задают
+    размер сегмента общей памяти; батчи больше max_batch режутся на части, которые
+    параллельно считают свободные процессы.
+    intra_op_threads / inter_op_threads — потоки TF (для tflite/onnx — num_threads),
+    pin_cpus — закрепить каждый процесс за своей долей ядер.
+    """
+
+    name = "workers"
+
+    def __init__(self, backend: str, model_path: str, head_sizes, workers: int = 2, max_batch: int = 16,
+                 image_shape=(224, 224, 3), intra_op_threads: int | None = None,
+                 inter_op_threads: int | None = None, pin_cpus: bool = False,
+                 start_timeout: float = 180.0, predict_timeout: float = 60.0,
+                 health_interval: float = 5.0):
+        if workers < 1:
+            raise ValueError("workers должен быть >= 1")
+        self.backend = backend
+        self.model_path = model_path
+        self.head_sizes = tuple(head_sizes)
+        self.max_batch = max_batch
+        self.shape = (max_batch,) + tuple(image_shape)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.start_timeout = start_timeout
+        self.predict_timeout = predict_timeout
+        self.health_interval = health_interval
+
+        self._ctx = mp.get_context("spawn")
+        self._cpus = self._split_cpus(workers) if pin_cpus else [None] * workers
+        self._idle: queue.Queue = queue.Queue()
+        self._fanout = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference-fanout")
+        self._stop = threading.Event()
+        self.restarts = 0
+        self.batches = 0
+
+        nbytes = int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        self._workers = []
+        try:
+            for i in range(workers):
+                shm = shared_memory.SharedMemory(create=True, size=nbytes)
+                worker = _Worker(i, shm, self.shape)
+                self._workers.append(worker)
+                self._start_process(worker)
+            # Модель грузится во всех процессах параллельно
+            for worker in self._workers:
+                self._wait_ready(worker)
+        except Exception:
+            self.close()
+            raise
+        for worker in self._workers:
+            self._idle.put(worker)
+
+        self._monitor = threading.Thread(target=self._monitor_loop, name="inference-workers", daemon=True)
+        self._monitor.start()
+
+    # ------------------ API ------------------
+    def predict(self, x: np.ndarray) -> list:
+        if x.shape[0] > self.max_batch:
+            return [np.concatenate(head, axis=0) for head in zip(*self._split(x, "predict"))]
+        return self._call(x, "predict")
+
+    def embed(self, x: np.ndarray) -> np.ndarray:
+        if x.shape[0] > self.max_batch:
+            return np.concatenate(self._split(x, "embed"), axis=0)
+        return self._call(x, "embed")
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "alive": sum(1 for w in self._workers if w.process is not None and w.process.is_alive()),
+            "idle": self._idle.qsize(),
+            "batches": self.batches,
+            "restarts": self.restarts,
+        }
+
+    def close(self):
+        self._stop.set()
+        self._fanout.shutdown(wait=False)
+        for worker in self._workers:
+            self._terminate(worker, graceful=True)
+            worker.as_uint8 = worker.as_float32 = None
+            worker.shm.close()
+            try:
+                worker.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ------------------ внутреннее ------------------
+    def _split(self, x: np.ndarray, op: str) -> list:
+        """Части по max_batch — каждая в своём процессе, одновременно; результаты по порядку."""
+        chunks = [x[i:i + self.max_batch] for i in range(0, x.shape[0], self.max_batch)]
+        return list(self._fanout.map(lambda chunk: self._call(chunk, op), chunks))
+
+    def _call(self, x: np.ndarray, op: str):
+        try:
+            worker = self._idle.get(timeout=self.predict_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Нет свободного процесса инференса за {self.predict_timeout:.0f} с") from None
+        try:
+            with worker.lock:
+                try:
+                    return self._run(worker, x, op)
+                except WorkerCrashed as e:
+                    # Один повтор на свежем процессе: падение могло быть не из-за этого батча
+                    logger.warning("Процесс инференса #%d упал (%s), перезапускаю", worker.index, e)
+                    self._respawn(worker)
+                    return self._run(worker, x, op)
+        finally:
+            self._idle.put(worker)
+
+    def _run(self, worker: _Worker, x: np.ndarray, op: str = "predict"):
+        if worker.process is None or not worker.process.is_alive():
+            raise WorkerCrashed("процесс не запущен")
+
+        n = x.shape[0]
+        if x.dtype == np.uint8:
+            worker.as_uint8[:n] = x
+            dtype = "uint8"
+        else:
+            worker.as_float32[:n] = x
+            dtype = "float32"
+
+        try:
+            worker.conn.send((n, dtype, op))
+            if not worker.conn.poll(self.predict_timeout):
+                raise WorkerCrashed(f"нет ответа за {self.predict_timeout:.0f} с")
+            status, payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(str(e) or type(e).__name__) from e
+
+        if status != "ok":
+            raise RuntimeError(f"Ошибка в процессе инференса #{worker.index}: {payload}")
+        self.batches += 1
+        return payload
+
+    def _start_process(self, worker: _Worker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, worker.shm.name, self.shape, self.backend, self.model_path, self.head_sizes,
+                  self.intra_op_threads, self.inter_op_threads, self._cpus[worker.index]),
+            name=f"inference-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process, worker.conn = process, parent_conn
+
+    def _wait_ready(self, worker: _Worker):
+        """Ждёт, пока процесс загрузит модель."""
+        parent_conn = worker.conn
+        if not parent_conn.poll(self.start_timeout):
+            self._terminate(worker)
+            raise WorkerCrashed(f"процесс инференса #{worker.index} не запустился за {self.start_timeout:.0f} с")
+        try:
+            status, worker.pid = parent_conn.recv()
+        except EOFError:
+            self._terminate(worker)
+            raise WorkerCrashed(f"процесс инференса #{worker.index} завершился при загрузке модели")
+        logger.info("Процесс инференса #%d запущен (pid %s, движок %s)", worker.index, worker.pid, self.backend)
+
+    def _respawn(self, worker: _Worker):
+        self._terminate(worker)
+        self.restarts += 1
+        self._start_process(worker)
+        self._wait_ready(worker)
+
+    def _terminate(self, worker: _Worker, graceful: bool = False):
+        process, conn = worker.process, worker.conn
+        worker.process = worker.conn = None
+        if process is None:
+            return
+        if graceful and process.is_alive():
+            try:
+                conn.send(None)
+                process.join(2.0)
+            except (OSError, EOFError):
+                pass
+        if process.is_alive():
+            process.kill()
+        process.join(1.0)
+        conn.close()
+
+    def _monitor_loop(self):
+        # Свободные процессы, упавшие сами по себе, поднимаем заранее, а не на пути запроса
+        while not self._stop.wait(self.health_interval):
+            for worker in self._workers:
+                if not worker.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if self._stop.is_set():
+                        return
+                    if worker.process is None or not worker.process.is_alive():
+                        logger.warning("Процесс инференса #%d не отвечает, перезапускаю", worker.index)
+                        self._respawn(worker)
+                except Exception as e:
+                    logger.error(f"Не удалось перезапустить процесс инференса #{worker.index}: {e}")
+                finally:
+                    worker.lock.release()
+
+    @staticmethod
+    def _split_cpus(workers: int) -> list:
+        if not hasattr(os, "sched_getaffinity"):
+            return [None] * workers
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cpus) // workers)
+        return [set(cpus[(i * per_worker) % len(cpus):][:per_worker]) for i in range(workers)]
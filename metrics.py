@@ -0,0 +1,226 @@
+"""
+Метрики бота: счётчики, гистограммы, таймеры стадий и /metrics в текстовом формате Prometheus.
+
+Пока метрики не включены через configure(enabled=True), все вызовы —
+пустые: span() отдаёт общий ничего не делающий контекстный менеджер,
+inc()/observe() выходят на первой проверке.
+"""
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = False
+_lock = threading.Lock()
+_metrics: dict = {}       # name -> _Metric
+_callbacks: list = []     # (name, type, help, fn)
+
+
+class _Metric:
+    def __init__(self, name: str, kind: str, help_text: str, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.buckets = tuple(buckets) if buckets else None
+        self.values: dict = {}    # labels -> float | [bucket_counts, sum, count]
+        self.lock = threading.Lock()
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _get(name: str, kind: str, help_text: str = "", buckets=None) -> _Metric:
+    metric = _metrics.get(name)
+    if metric is None:
+        with _lock:
+            metric = _metrics.get(name)
+            if metric is None:
+                metric = _Metric(name, kind, help_text or name, buckets)
+                _metrics[name] = metric
+    return metric
+
+
+# ------------------ настройка ------------------
+def configure(enabled: bool = True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def describe(name: str, kind: str, help_text: str, buckets=None):
+    """Заранее объявляет метрику с описанием и бакетами (для histogram)."""
+    _get(name, kind, help_text, buckets)
+
+
+def register_callback(name: str, kind: str, help_text: str, fn):
+    """
+    Значение считывается в момент запроса /metrics: fn() -> число
+    или {((метка, значение), ...): число}.
+    Удобно для глубины очередей, числа живых браузеров и счётчиков кэшей.
+    """
+    with _lock:
+        _callbacks.append((name, kind, help_text, fn))
+
+
+# ------------------ запись ------------------
+def inc(name: str, value: float = 1.0, **labels):
+    if not _enabled:
+        return
+    metric = _get(name, "counter")
+    key = _labels_key(labels)
+    with metric.lock:
+        metric.values[key] = metric.values.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    if not _enabled:
+        return
+    metric = _get(name, "gauge")
+    with metric.lock:
+        metric.values[_labels_key(labels)] = float(value)
+
+
+def observe(name: str, value: float, **labels):
+    if not _enabled:
+        return
+    metric = _get(name, "histogram", buckets=LATENCY_BUCKETS)
+    buckets = metric.buckets or LATENCY_BUCKETS
+    key = _labels_key(labels)
+    with metric.lock:
+        state = metric.values.get(key)
+        if state is None:
+            state = metric.values[key] = [[0] * len(buckets), 0.0, 0]
+        idx = bisect.bisect_left(buckets, value)
+        if idx < len(buckets):
+            state[0][idx] += 1
+        state[1] += value
+        state[2] += 1
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe("bot_stage_seconds", time.perf_counter() - self.started, stage=self.stage)
+        return False
+
+
+def span(stage: str):
+    """with metrics.span("model_predict"): ... — время стадии в гистограмму bot_stage_seconds."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+# ------------------ экспорт ------------------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: tuple, extra: tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+        callbacks = list(_callbacks)
+
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        with m.lock:
+            values = {k: (v if m.kind != "histogram" else [list(v[0]), v[1], v[2]])
+                      for k, v in m.values.items()}
+        for key, v in values.items():
+            if m.kind != "histogram":
+                lines.append(f"{m.name}{_fmt_labels(key)} {_fmt_value(v)}")
+                continue
+            counts, total, count = v
+            cumulative = 0
+            for bound, c in zip(m.buckets or LATENCY_BUCKETS, counts):
+                cumulative += c
+                lines.append(f"{m.name}_bucket{_fmt_labels(key, (('le', _fmt_value(bound)),))} {cumulative}")
+            lines.append(f"{m.name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{m.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            lines.append(f"{m.name}_count{_fmt_labels(key)} {count}")
+
+    for name, kind, help_text, fn in callbacks:
+        try:
+            value = fn()
+        except Exception as e:
+            logger.debug(f"Метрика {name} не посчиталась: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if isinstance(value, dict):
+            for key, v in value.items():
+                lines.append(f"{name}{_fmt_labels(tuple(key))} {_fmt_value(v)}")
+        else:
+            lines.append(f"{name} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Отдаёт /metrics на addr:port в фоновом потоке."""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", addr, port)
+    return server
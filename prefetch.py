@@ -0,0 +1,132 @@
+"""
+Упреждающий поиск, пока пользователь решает, нажать ли «Да» под распознанным фото.
+
+Сразу после распознавания поиск по предсказанному запросу (и по следующим по
+вероятности вариантам) уже запускается в фоне. Prefetcher помнит, какие поиски
+запущены для какого чата, и считает, пригодились ли они:
+- claim() — пользователь выбрал этот запрос: попадание, поиск дальше живёт как обычный;
+- discard() / release() — запрос больше не нужен: промах; идущий поиск, к которому
+  никто не присоединился, отменяется, и браузер возвращается в пул;
+- preempt() — браузер понадобился обычному поиску: самый старый ненужный
+  упреждающий поиск останавливается.
+Всё, что не выбрали за ttl секунд, снимается само.
+
+Используется только из event loop бота, поэтому без блокировок.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Owner:
+    __slots__ = ("streams", "timer")
+
+    def __init__(self, timer):
+        self.streams: dict = {}   # запрос -> SearchStream, в порядке запуска
+        self.timer = timer
+
+
+class Prefetcher:
+    """
+    start(owner, query) -> SearchStream или None — запускает поиск (или находит уже идущий);
+    None — запускать не стали: выдача уже есть или нет свободного бюджета.
+    ttl — сколько упреждающий поиск ждёт, что его выберут, с.
+    """
+
+    def __init__(self, start, ttl: float = 60.0):
+        self._start = start
+        self.ttl = ttl
+        self._owners: dict = {}   # chat_id -> _Owner
+
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.wasted = 0
+        self.preempted = 0
+
+    def speculate(self, owner, queries) -> int:
+        """Заменяет упреждающие поиски owner на поиски по queries. Возвращает, сколько запущено."""
+        self.release(owner)
+        entry = _Owner(asyncio.get_running_loop().call_later(self.ttl, self.release, owner))
+        for query in queries:
+            if query in entry.streams:
+                continue
+            stream = self._start(owner, query)
+            if stream is None:
+                self.skipped += 1
+                continue
+            entry.streams[query] = stream
+            self.started += 1
+        if entry.streams:
+            self._owners[owner] = entry
+        else:
+            entry.timer.cancel()
+        return len(entry.streams)
+
+    def claim(self, owner, query) -> bool:
+        """Пользователь выбрал query. True, если поиск по нему уже шёл (или прошёл) заранее."""
+        entry = self._owners.get(owner)
+        stream = entry.streams.pop(query, None) if entry is not None else None
+        if stream is None:
+            return False
+        self._forget_if_empty(owner, entry)
+        if stream.cancelled:
+            # Остановлен ради обычного поиска — уже посчитан в preempted
+            return False
+        self.hits += 1
+        return True
+
+    def discard(self, owner, query):
+        """query больше не нужен, остальные упреждающие поиски owner ещё могут пригодиться."""
+        entry = self._owners.get(owner)
+        stream = entry.streams.pop(query, None) if entry is not None else None
+        if stream is not None:
+            self._waste(stream)
+            self._forget_if_empty(owner, entry)
+
+    def release(self, owner):
+        """Ни один упреждающий поиск owner больше не нужен."""
+        entry = self._owners.pop(owner, None)
+        if entry is None:
+            return
+        entry.timer.cancel()
+        for stream in entry.streams.values():
+            self._waste(stream)
+
+    def preempt(self) -> bool:
+        """Останавливает самый старый упреждающий поиск, который ещё идёт и никому не нужен."""
+        for entry in self._owners.values():
+            for query, stream in entry.streams.items():
+                if not stream.done and not stream.cancelled and not stream.subscribers:
+                    logger.info(f"Упреждающий поиск '{query}' уступает браузер обычному поиску")
+                    self.preempted += 1
+                    stream.cancel()
+                    return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "active": sum(len(entry.streams) for entry in self._owners.values()),
+            "started": self.started,
+            "skipped": self.skipped,
+            "hits": self.hits,
+            "wasted": self.wasted,
+            "preempted": self.preempted,
+            "hit_ratio": self.hits / self.started if self.started else 0.0,
+            "waste_ratio": (self.wasted + self.preempted) / self.started if self.started else 0.0,
+        }
+
+    # ------------------ внутреннее ------------------
+    def _waste(self, stream):
+        if stream.cancelled:
+            return
+        self.wasted += 1
+        # К поиску мог присоединиться другой пользователь с тем же запросом — тогда он остаётся
+        if not stream.done and not stream.subscribers:
+            stream.cancel()
+
+    def _forget_if_empty(self, owner, entry: _Owner):
+        if not entry.streams and self._owners.get(owner) is entry:
+            entry.timer.cancel()
+            del self._owners[owner]
@@ -0,0 +1,180 @@
+"""
+Общее хранилище результатов поиска.
+
+Каждая выдача хранится один раз, в компактном виде: строки товаров упакованы
+по колонкам (title / price / link / image) в UTF-8 буферы со смещениями, а не
+лежат тысячами отдельных dict и str. Название и цена нормализуются один раз —
+при добавлении. Пользователи, искавшие одно и то же, читают одну выдачу;
+в user_data остаются только её id и позиция пользователя.
+
+Выдачи вытесняются по давности последнего обращения и по суммарному размеру.
+Используется только из event loop бота, поэтому без блокировок.
+"""
+import itertools
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("title", "price", "link", "image")
+
+
+class _PackedStrings:
+    """Список строк в одном bytearray; i-я строка — buf[offsets[i]:offsets[i + 1]]."""
+
+    __slots__ = ("_buf", "_offsets")
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._offsets = array("I", [0])
+
+    def append(self, s: str):
+        self._buf += s.encode("utf-8")
+        self._offsets.append(len(self._buf))
+
+    def __getitem__(self, i: int) -> str:
+        return self._buf[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buf) + self._offsets.itemsize * len(self._offsets)
+
+
+class ResultSet:
+    """
+    Выдача одного запроса. Ведёт себя как список товаров-dict: len, [i], [a:b], итерация.
+    normalize(product) -> (title, price) вызывается один раз на товар при добавлении.
+    """
+
+    def __init__(self, result_id: int, query: str, key=None, normalize=None):
+        self.id = result_id
+        self.query = query
+        self.key = key
+        self.done = False
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        self._normalize = normalize
+        self._columns = {field: _PackedStrings() for field in FIELDS}
+
+    def extend(self, products):
+        cols = self._columns
+        for product in products:
+            if self._normalize is not None:
+                title, price = self._normalize(product)
+            else:
+                title, price = product.get("title") or "", product.get("price") or ""
+            cols["title"].append(title)
+            cols["price"].append(price)
+            cols["link"].append(product.get("link") or "")
+            cols["image"].append(product.get("image") or "")
+
+    def append(self, product: dict):
+        self.extend([product])
+
+    def __len__(self) -> int:
+        return len(self._columns["title"])
+
+    def _item(self, i: int) -> dict:
+        return {field: col[i] for field, col in self._columns.items()}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._item(index)
+
+    def __iter__(self):
+        return (self._item(i) for i in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(col.nbytes for col in self._columns.values())
+
+
+class ResultStore:
+    """
+    max_bytes — предел суммарного размера упакованных выдач,
+    max_age — сколько хранить выдачу после последнего обращения, с,
+    first_id — с какого числа начинать id выдач.
+    Незавершённые выдачи (парсер ещё работает) не вытесняются.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20, max_age: float = 6 * 3600, normalize=None,
+                 first_id: int = 1):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.normalize = normalize
+        self._sets: OrderedDict = OrderedDict()   # id -> ResultSet, от давно читанных к свежим
+        self._by_query: dict = {}                 # ключ запроса -> id последней выдачи
+        self._ids = itertools.count(first_id)
+        self.hits = 0
+        self.evicted = 0
+
+    def create(self, query: str, key=None, products=None, done: bool = False, result_id=None) -> ResultSet:
+        """
+        Новая выдача; key (нормализованный запрос) позволяет потом найти её через find.
+        result_id — восстановить выдачу под прежним id (например, из другого процесса).
+        """
+        rs = ResultSet(next(self._ids) if result_id is None else result_id, query, key, self.normalize)
+        if products:
+            rs.extend(products)
+        rs.done = done
+        self._sets[rs.id] = rs
+        if key is not None:
+            self._by_query[key] = rs.id
+        self._evict()
+        return rs
+
+    def get(self, result_id) -> ResultSet | None:
+        rs = self._sets.get(result_id)
+        if rs is None:
+            return None
+        rs.last_access = time.time()
+        self._sets.move_to_end(result_id)
+        return rs
+
+    def find(self, key, max_age: float | None = None) -> ResultSet | None:
+        """Последняя завершённая непустая выдача по ключу запроса, не старше max_age."""
+        rs = self._sets.get(self._by_query.get(key))
+        if rs is None or not rs.done or not len(rs):
+            return None
+        if max_age is not None and time.time() - rs.created_at > max_age:
+            return None
+        self.hits += 1
+        return self.get(rs.id)
+
+    def stats(self) -> dict:
+        sets = list(self._sets.values())
+        return {
+            "sets": len(sets),
+            "items": sum(len(rs) for rs in sets),
+            "bytes": sum(rs.nbytes for rs in sets),
+            "hits": self.hits,
+            "evicted": self.evicted,
+        }
+
+    def _evict(self):
+        now = time.time()
+        total = sum(rs.nbytes for rs in self._sets.values())
+        # От давно читанных к свежим: сначала устаревшие, потом — пока не влезем в лимит
+        for rs in list(self._sets.values()):
+            if total <= self.max_bytes and now - rs.last_access <= self.max_age:
+                break
+            if not rs.done:
+                continue
+            del self._sets[rs.id]
+            if rs.key is not None and self._by_query.get(rs.key) == rs.id:
+                del self._by_query[rs.key]
+            total -= rs.nbytes
+            self.evicted += 1
+        if total > self.max_bytes:
+            logger.warning("Выдачи занимают %d байт при лимите %d: идут незавершённые поиски",
+                           total, self.max_bytes)
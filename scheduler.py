@@ -0,0 +1,187 @@
+"""
+Планировщик тяжёлых задач бота.
+
+Каждая полоса (Lane) ограничивает число одновременно выполняемых задач и длину
+очереди. Ожидающие задачи хранятся по ключам (chat_id) и выбираются по кругу,
+поэтому пользователь, приславший десять запросов, не задерживает остальных.
+Если очередь переполнена, submit сразу бросает LaneFull — бот вежливо отказывает,
+а не копит задачи в памяти.
+
+Используется только из event loop бота, поэтому без блокировок.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class LaneFull(Exception):
+    """Очередь полосы (или пользователя в ней) заполнена."""
+
+
+class Job:
+    """Задача в полосе. await job — результат fn()."""
+
+    def __init__(self, lane: "Lane", key, fn):
+        self.lane = lane
+        self.key = key
+        self.fn = fn
+        self.state = "queued"   # queued -> running -> done | cancelled
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def position(self) -> int:
+        """Сколько задач будет запущено раньше этой плюс один; 0 — уже выполняется."""
+        return self.lane._position(self) if self.state == "queued" else 0
+
+    def cancel(self) -> bool:
+        """
+        Снимает задачу с очереди. Уже запущенную не трогает — она останавливается
+        сама (поиск — по флагу отмены SearchStream). Возвращает True, если сняли.
+        """
+        if self.state != "queued":
+            return False
+        self.lane._remove(self)
+        self.state = "cancelled"
+        self.future.cancel()
+        return True
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class Lane:
+    """
+    concurrency — сколько задач выполняется одновременно.
+    max_queue — сколько задач может ждать всего, max_per_key — от одного пользователя.
+    threads — размер собственного пула потоков полосы (lane.executor) для блокирующей работы.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_per_key: int | None = None,
+                 threads: int | None = None):
+        if concurrency < 1:
+            raise ValueError("concurrency должен быть >= 1")
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_key = max_per_key
+        self.executor = ThreadPoolExecutor(max_workers=threads or concurrency, thread_name_prefix=name)
+
+        self._queues: OrderedDict = OrderedDict()   # key -> deque[Job], порядок — очередь обхода
+        self._queued = 0
+        self._running = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    # ------------------ API ------------------
+    def submit(self, key, fn) -> Job:
+        """
+        fn() — корутинная функция без аргументов, вызывается, когда подойдёт очередь.
+        Бросает LaneFull, если ждать уже некуда.
+        """
+        pending = self._queues.get(key)
+        if self._queued >= self.max_queue or (
+                self.max_per_key is not None and pending is not None and len(pending) >= self.max_per_key):
+            self.rejected += 1
+            raise LaneFull(self.name)
+
+        job = Job(self, key, fn)
+        if pending is None:
+            pending = self._queues[key] = deque()
+        pending.append(job)
+        self._queued += 1
+        self._dispatch()
+        return job
+
+    async def run(self, key, fn):
+        return await self.submit(key, fn)
+
+    def position(self, key) -> int:
+        """Позиция самой старой ожидающей задачи пользователя; 0 — у него ничего не ждёт."""
+        pending = self._queues.get(key)
+        return self._position(pending[0]) if pending else 0
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "queued": self._queued,
+            "users_waiting": len(self._queues),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        for pending in list(self._queues.values()):
+            for job in list(pending):
+                job.cancel()
+        self.executor.shutdown(wait=False)
+
+    # ------------------ внутреннее ------------------
+    def _dispatch(self):
+        while self._running < self.concurrency and self._queues:
+            key, pending = next(iter(self._queues.items()))
+            job = pending.popleft()
+            self._queued -= 1
+            # Пользователь уходит в конец круга, даже если у него есть ещё задачи
+            if pending:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._running += 1
+            job.state = "running"
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job: Job):
+        try:
+            result = await job.fn()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except BaseException as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            # Иначе "Future exception was never retrieved", если результат никто не ждёт
+            job.future.exception()
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            job.state = "done"
+            self._running -= 1
+            self._dispatch()
+
+    def _remove(self, job: Job):
+        pending = self._queues.get(job.key)
+        if pending is None or job not in pending:
+            return
+        pending.remove(job)
+        self._queued -= 1
+        self.cancelled += 1
+        if not pending:
+            del self._queues[job.key]
+
+    def _position(self, job: Job) -> int:
+        # При обходе по кругу перед i-й задачей пользователя успеют запуститься
+        # до i+1 задач каждого, кто стоит в круге раньше, и до i — каждого, кто позже
+        pending = self._queues.get(job.key)
+        if pending is None or job not in pending:
+            return 0
+        index = pending.index(job)
+        ahead = index
+        before = True
+        for key, other in self._queues.items():
+            if key == job.key:
+                before = False
+                continue
+            ahead += min(len(other), index + 1 if before else index)
+        return ahead + 1
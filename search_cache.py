@@ -0,0 +1,144 @@
+"""
+Общий для всех пользователей кэш результатов поиска в локальном SQLite.
+
+Ключ — нормализованный запрос. Записи живут ttl секунд; после этого ещё
+stale_ttl секунд они отдаются сразу с пометкой is_stale, а обновить запись —
+забота вызывающего (stale-while-revalidate; в боте это обычный живой поиск,
+его исход отмечается через count_refresh). При превышении max_entries
+вытесняются записи, к которым дольше всего не обращались (LRU).
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """'  Чёрные   ДЖИНСЫ!' -> 'черные джинсы'"""
+    q = (query or "").lower().replace("ё", "е")
+    q = re.sub(r"[^\w\s-]", " ", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+class SearchCache:
+    def __init__(self, path: str, ttl: float = 6 * 3600, stale_ttl: float = 24 * 3600,
+                 max_entries: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            " key TEXT PRIMARY KEY,"
+            " products TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS search_cache_accessed ON search_cache(accessed_at)"
+        )
+        self._conn.commit()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_deferred = 0
+
+    # ------------------ чтение / запись ------------------
+    def get(self, query: str):
+        """
+        Возвращает (products, is_stale) или None.
+        Записи старше ttl + stale_ttl считаются отсутствующими.
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT products, created_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl + self.stale_ttl:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE search_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            stale = now - row[1] > self.ttl
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+        return json.loads(row[0]), stale
+
+    def contains(self, query: str) -> bool:
+        """Есть ли запись, которую get ещё отдаст (свежая или устаревшая). Не влияет на LRU и счётчики."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at FROM search_cache WHERE key = ?", (normalize_query(query),)
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl + self.stale_ttl
+
+    def put(self, query: str, products: list):
+        key = normalize_query(query)
+        now = time.time()
+        payload = json.dumps(products, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, products, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, payload, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute(
+            "DELETE FROM search_cache WHERE created_at < ?", (now - self.ttl - self.stale_ttl,)
+        )
+        self._conn.execute(
+            "DELETE FROM search_cache WHERE key IN ("
+            " SELECT key FROM search_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    # ------------------ статистика ------------------
+    def count_refresh(self, outcome: str):
+        """Отмечает исход обновления устаревшей записи: 'started', 'failed' или 'deferred'."""
+        with self._lock:
+            if outcome == "started":
+                self.refreshes += 1
+            elif outcome == "failed":
+                self.refresh_errors += 1
+            elif outcome == "deferred":
+                self.refresh_deferred += 1
+            else:
+                raise ValueError(f"Неизвестный исход обновления: {outcome}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "refresh_deferred": self.refresh_deferred,
+                "hit_rate": ((self.hits + self.stale_hits) / lookups) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
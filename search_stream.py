@@ -0,0 +1,137 @@
+"""
+Потоковая выдача результатов поиска.
+
+Парсер работает в отдельном потоке и отдаёт товары пачками по мере прокрутки.
+SearchStream копит их в event loop бота, а хендлеры ждут ровно столько товаров,
+сколько нужно для очередной страницы.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SearchStream:
+    """
+    products — куда складывать товары: список (по умолчанию) или любой контейнер
+    с extend/len/итерацией, например ResultSet из общего хранилища выдач.
+    """
+
+    def __init__(self, query: str, products=None):
+        self.query = query
+        self.products = products if products is not None else []
+        self.done = False
+        self.error: BaseException | None = None
+        self.cancelled = False
+        self._changed = asyncio.Event()
+        self._callbacks = []
+        self._cancel_callbacks = []
+        self._subscribers = 0
+
+    # ------------------ сторона производителя (event loop) ------------------
+    def extend(self, items):
+        kept = []
+        for product in items:
+            title = (product.get("title") or "").strip()
+            link = (product.get("link") or "").strip()
+            if title or link:
+                kept.append(product)
+        self.products.extend(kept)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None):
+        self.done = True
+        self.error = error
+        self._notify()
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике завершения поиска '{self.query}': {e}")
+
+    def add_done_callback(self, fn):
+        """fn(stream) вызывается в event loop, когда поиск закончился (или сразу, если уже)."""
+        if self.done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def add_cancel_callback(self, fn):
+        """fn(stream) вызывается в event loop, когда поиск отменили."""
+        self._cancel_callbacks.append(fn)
+
+    def cancel(self):
+        """Производитель остановится на следующей пачке, браузер вернётся в пул."""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике отмены поиска '{self.query}': {e}")
+
+    # ------------------ подписчики ------------------
+    # Одну выдачу могут читать несколько пользователей с одинаковым запросом.
+    # Поиск останавливается, только когда от него отписались все.
+    def subscribe(self):
+        self._subscribers += 1
+
+    def unsubscribe(self):
+        self._subscribers -= 1
+        if self._subscribers <= 0 and not self.done:
+            self.cancel()
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    # ------------------ сторона потребителя ------------------
+    async def wait_for(self, count: int, timeout: float | None = None) -> bool:
+        """
+        Ждёт, пока наберётся count товаров или поиск закончится.
+        Возвращает True, если товаров уже хватает или больше не будет.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while len(self.products) < count and not self.done:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def start(self, producer, *args, executor=None):
+        """
+        Запускает producer(*args) в пуле потоков. producer — генератор, отдающий
+        списки товаров. Возвращает asyncio.Future фоновой задачи.
+        """
+        loop = asyncio.get_running_loop()
+
+        def run():
+            try:
+                gen = producer(*args)
+                try:
+                    for batch in gen:
+                        if self.cancelled:
+                            break
+                        if batch:
+                            loop.call_soon_threadsafe(self.extend, list(batch))
+                finally:
+                    gen.close()
+            except Exception as e:
+                logger.error(f"Ошибка парсера (поток выдачи '{self.query}'): {e}")
+                loop.call_soon_threadsafe(self.finish, e)
+                return
+            loop.call_soon_threadsafe(self.finish)
+
+        return loop.run_in_executor(executor, run)
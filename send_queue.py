@@ -0,0 +1,196 @@
+"""
+Очередь исходящих сообщений бота.
+
+SendQueue подключается к Application как rate limiter python-telegram-bot, поэтому
+через неё проходят все запросы к Bot API: reply_text, send_message, edit_* и т.д.
+Сообщения в один чат уходят по очереди: в среднем не чаще раза в chat_interval
+секунд (в группах — group_interval), короткой пачкой до chat_burst подряд; а все
+вместе — не чаще global_rate в секунду.
+На RetryAfter от Telegram очередь замирает на указанное время и повторяет запрос.
+
+Служебные сообщения ("ищу...", "вы N-й в очереди") отправляются с
+rate_limit_args=STATUS. Если такое сообщение ещё ждёт своей очереди, а в тот же
+чат пришло новое, служебное устарело: оно не отправляется, вызов возвращает True.
+
+Используется только из event loop бота, поэтому без блокировок.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+STATUS = {"status": True}
+
+# Запросы, которые порождают сообщение в чате и попадают под лимиты Telegram
+_CHAT_ENDPOINT_PREFIXES = ("send", "edit", "copyMessage", "forwardMessage")
+
+
+class _Pending:
+    __slots__ = ("status", "future", "callback", "args", "kwargs")
+
+    def __init__(self, status: bool, future: asyncio.Future, callback, args, kwargs):
+        self.status = status
+        self.future = future
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _Chat:
+    __slots__ = ("queue", "sent_at", "worker")
+
+    def __init__(self, burst: int):
+        self.queue: deque = deque()
+        self.sent_at: deque = deque(maxlen=burst)   # время последних отправок в чат
+        self.worker: asyncio.Task | None = None
+
+
+class SendQueue(BaseRateLimiter):
+    """
+    global_rate — сообщений в секунду на всего бота,
+    chat_interval — средняя пауза между сообщениями в личный чат, с,
+    group_interval — в группу (chat_id < 0), с,
+    chat_burst — сколько сообщений в чат может уйти подряд без паузы,
+    max_retries — сколько раз повторять запрос после RetryAfter.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_interval: float = 1.0, group_interval: float = 3.0,
+                 chat_burst: int = 3, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.chat_burst = max(1, chat_burst)
+        self.max_retries = max_retries
+
+        self._chats: dict = {}         # chat_id -> _Chat
+        self._next_global = 0.0        # время loop.time(), раньше которого следующий запрос не уйдёт
+
+        self.sent = 0
+        self.dropped = 0
+        self.retried = 0
+
+    @property
+    def global_rate(self) -> float:
+        return 1.0 / self.global_interval
+
+    @global_rate.setter
+    def global_rate(self, rate: float):
+        # Можно менять на ходу: следующий слот отсчитывается уже с новым интервалом
+        self.global_interval = 1.0 / rate
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        for chat in self._chats.values():
+            if chat.worker is not None:
+                chat.worker.cancel()
+            while chat.queue:
+                pending = chat.queue.popleft()
+                if not pending.future.done():
+                    pending.future.cancel()
+        self._chats.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.startswith(_CHAT_ENDPOINT_PREFIXES):
+            # answerCallbackQuery, getFile и т.п. — не сообщения, ждать им незачем
+            return await callback(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) > 1000:
+                self._forget_idle(loop.time())
+            chat = self._chats[chat_id] = _Chat(self.chat_burst)
+
+        # Всё служебное, что ещё не отправлено, вытесняется новым сообщением
+        for pending in chat.queue:
+            if pending.status and not pending.future.done():
+                pending.future.set_result(True)
+                self.dropped += 1
+
+        status = bool(rate_limit_args and rate_limit_args.get("status"))
+        pending = _Pending(status, loop.create_future(), callback, args, kwargs)
+        chat.queue.append(pending)
+        if chat.worker is None:
+            chat.worker = loop.create_task(self._drain(chat_id, chat))
+        return await pending.future
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(chat.queue) for chat in self._chats.values()),
+            "chats": sum(1 for chat in self._chats.values() if chat.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "retried": self.retried,
+        }
+
+    # ------------------ внутреннее ------------------
+    async def _drain(self, chat_id, chat: _Chat):
+        loop = asyncio.get_running_loop()
+        interval = self.group_interval if isinstance(chat_id, int) and chat_id < 0 else self.chat_interval
+        window = interval * self.chat_burst
+        try:
+            while chat.queue:
+                pending = chat.queue[0]
+                if pending.future.done():
+                    chat.queue.popleft()
+                    continue
+                # Сначала очередь чата, потом общий лимит; пока ждём, сообщение ещё можно вытеснить
+                if len(chat.sent_at) == self.chat_burst:
+                    await asyncio.sleep(max(0.0, chat.sent_at[0] + window - loop.time()))
+                if pending.future.done():
+                    continue
+                await self._global_slot(loop)
+                if pending.future.done():
+                    continue
+                chat.queue.popleft()
+                chat.sent_at.append(loop.time())
+                await self._send(loop, pending)
+        finally:
+            chat.worker = None
+
+    async def _global_slot(self, loop):
+        now = loop.time()
+        slot = max(now, self._next_global)
+        self._next_global = slot + self.global_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, loop, pending: _Pending):
+        future = pending.future
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await pending.callback(*pending.args, **pending.kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                logger.warning("Telegram просит подождать %.1f с, очередь отправки на паузе", delay)
+                self.retried += 1
+                # Лимит общий: остальные чаты тоже ждут
+                self._next_global = max(self._next_global, loop.time() + delay)
+                await self._global_slot(loop)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(result)
+                return
+
+    def _forget_idle(self, now: float):
+        for chat_id in [cid for cid, chat in self._chats.items()
+                        if not chat.queue and chat.worker is None
+                        and (not chat.sent_at or chat.sent_at[-1] + self.group_interval * self.chat_burst <= now)]:
+            del self._chats[chat_id]
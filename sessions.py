@@ -0,0 +1,272 @@
+"""
+Общее для всех процессов бота хранилище сессий пользователей в локальном SQLite.
+
+Когда апдейты разных чатов обрабатывают разные процессы (см. sharding.py), в памяти
+процесса нельзя держать ничего, что понадобится на следующем шаге диалога: чат может
+переехать в другой процесс, а процесс — перезапуститься. Поэтому здесь лежат:
+- user_data пользователя (last_prediction, id текущей выдачи, позиция) — в JSON;
+- сами выдачи, на которые ссылаются сессии, — сжатый JSON товаров, чтобы
+  «Показать ещё» работало в любом процессе.
+Выдача, которую парсер ещё наполняет, сохраняется по мере показа страниц
+и окончательно — когда поиск закончен; законченная выдача больше не меняется.
+
+SessionPersistence подключает хранилище к python-telegram-bot: user_data читается
+заново перед апдейтом и пишется после него. Сам SQLite-файл общий для процессов и
+может быть занят другим, поэтому обращения к нему идут в пуле потоков, а не в event loop.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    max_age — сколько хранить сессию и выдачу после последней записи, с.
+    Можно открывать из нескольких процессов одновременно (WAL).
+    """
+
+    def __init__(self, path: str, max_age: float = 30 * 24 * 3600, results_max_age: float = 6 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.results_max_age = results_max_age
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " products BLOB NOT NULL,"
+            " items INTEGER NOT NULL,"
+            " done INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_updated ON results(updated_at)")
+        self._conn.commit()
+
+        self.loads = 0
+        self.saves = 0
+        self.results_loaded = 0
+        self.results_saved = 0
+
+    # ------------------ сессии ------------------
+    def load_session(self, user_id: int) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            self.loads += 1
+        return json.loads(row[0]) if row is not None else {}
+
+    def save_session(self, user_id: int, data: dict):
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, payload, time.time()),
+            )
+            self._conn.commit()
+            self.saves += 1
+
+    def delete_session(self, user_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+    # ------------------ выдачи ------------------
+    def save_results(self, result_id: int, query: str, products, done: bool) -> bool:
+        """
+        Сохраняет выдачу (последовательность товаров-dict). Законченная выдача уже не
+        переписывается, незаконченная — только если товаров стало больше или она закончилась.
+        Проверка и запись — одна транзакция, так что процессы и потоки, сохраняющие
+        одну выдачу, не затирают более полную версию.
+        Возвращает True, если что-то записано.
+        """
+        items = len(products)
+        with self._lock:
+            row = self._conn.execute("SELECT items, done FROM results WHERE id = ?", (result_id,)).fetchone()
+        if row is not None and (row[1] or (not done and row[0] >= items)):
+            # Упаковывать незачем; окончательно это решит условие в транзакции
+            return False
+        payload = zlib.compress(json.dumps(list(products), ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                saved = self._conn.execute(
+                    "INSERT INTO results (id, query, products, items, done, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT(id) DO UPDATE SET query = excluded.query, products = excluded.products,"
+                    " items = excluded.items, done = excluded.done, updated_at = excluded.updated_at"
+                    " WHERE results.done = 0 AND (results.items < excluded.items OR excluded.done = 1)",
+                    (result_id, query, payload, items, int(done), time.time()),
+                ).rowcount > 0
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            if saved:
+                self.results_saved += 1
+        return saved
+
+    def load_results(self, result_id: int):
+        """(query, products, done) или None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT query, products, done FROM results WHERE id = ?", (result_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.results_loaded += 1
+        return row[0], json.loads(zlib.decompress(row[1])), bool(row[2])
+
+    # ------------------ обслуживание ------------------
+    def prune(self) -> int:
+        """Удаляет старые сессии и выдачи. Возвращает, сколько строк удалено."""
+        now = time.time()
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (now - self.max_age,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM results WHERE updated_at < ?", (now - self.results_max_age,)
+            ).rowcount
+            self._conn.commit()
+        if removed:
+            logger.info(f"Из хранилища сессий удалено устаревших записей: {removed}")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            results = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "sessions": sessions,
+            "results": results,
+            "loads": self.loads,
+            "saves": self.saves,
+            "results_loaded": self.results_loaded,
+            "results_saved": self.results_saved,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionPersistence(BasePersistence):
+    """
+    Хранит в SessionStore только user_data. Данные не грузятся все разом при старте:
+    refresh_user_data перечитывает сессию перед апдейтом, поэтому процесс видит то,
+    что записал процесс, обрабатывавший этот чат до него.
+
+    Апдейты одного пользователя обрабатываются параллельно и делят один user_data.
+    Если о них сообщают update_started / update_finished, сессия перечитывается только
+    первым апдейтом из идущих подряд: пока хоть один ещё в работе, user_data в памяти
+    свежее, чем в хранилище, и перечитывание стёрло бы то, что туда уже записано.
+    Апдейт, пришедший, пока первый ещё читает сессию, дожидается того же чтения.
+    """
+
+    def __init__(self, store: SessionStore, update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self._busy: dict = {}      # user_id -> апдейтов пользователя в работе
+        self._loaded: set = set()  # пользователи, чья сессия уже перечитана для идущих апдейтов
+        self._loading: dict = {}   # user_id -> идущее чтение сессии (Future)
+
+    def update_started(self, user_id: int):
+        self._busy[user_id] = self._busy.get(user_id, 0) + 1
+
+    def update_finished(self, user_id: int):
+        left = self._busy.get(user_id, 0) - 1
+        if left > 0:
+            self._busy[user_id] = left
+        else:
+            self._busy.pop(user_id, None)
+            self._loaded.discard(user_id)
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            # Сессию уже читает параллельный апдейт этого пользователя — он её и применит
+            await pending
+            return
+        if user_id in self._loaded:
+            return
+        loading = asyncio.get_running_loop().run_in_executor(None, self.store.load_session, user_id)
+        if user_id in self._busy:
+            self._loading[user_id] = loading
+        try:
+            data = await loading
+        finally:
+            if self._loading.get(user_id) is loading:
+                del self._loading[user_id]
+        user_data.clear()
+        user_data.update(data)
+        if user_id in self._busy:
+            self._loaded.add(user_id)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        # Снимок: пока запись идёт в потоке, хендлеры могут менять user_data
+        payload = dict(data)
+        await asyncio.get_running_loop().run_in_executor(None, self.store.save_session, user_id, payload)
+
+    async def drop_user_data(self, user_id: int):
+        await asyncio.get_running_loop().run_in_executor(None, self.store.delete_session, user_id)
+
+    # Остальное бот не хранит
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        # Каждая запись сразу коммитится
+        pass
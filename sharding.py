@@ -0,0 +1,536 @@
+"""
+Бот в несколько процессов: фронт принимает апдейты и раздаёт их воркерам по chat_id.
+
+    python sharding.py --workers 4
+    kill -USR1 <pid фронта>   # добавить воркер
+    kill -USR2 <pid фронта>   # убрать воркер: он доделает начатое и выйдет
+    kill -TERM <pid фронта>   # остановить всё, дав воркерам доделать начатое
+
+Фронт получает апдейты так же, как обычный бот (BOT_MODE=polling или webhook), но
+сам их не обрабатывает. Воркер — это app.py с BOT_MODE=worker: своя модель, свой
+пул браузеров, свои кэши в памяти. Воркеры подключаются к фронту по TCP и обмениваются
+с ним JSON-строками: фронт шлёт update, workers и drain, воркер — hello, done и draining.
+workers сообщает, сколько сейчас активных воркеров: общий на бота лимит отправки
+сообщений они делят поровну и пересчитывают долю при масштабировании.
+
+Чат закреплён за воркером рандеву-хэшированием: при добавлении или уходе воркера
+переезжает только доля чатов, которые ему достаются или были за ним. Сессии
+(user_data и выдачи) лежат в общем SQLite (sessions.py), поэтому переехавший чат
+продолжает диалог с того же места. Пока у старого воркера не закончились апдейты
+чата, новые апдейты этого чата придерживаются — два процесса не работают с одной
+сессией одновременно.
+
+Уход воркера (USR2, SIGTERM самому воркеру, масштабирование вниз): фронт перестаёт
+слать ему апдейты и присылает drain, воркер доделывает начатое, сохраняет сессии и
+выходит. Упавший воркер фронт перезапускает; его незавершённые апдейты теряются.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+from collections import deque
+
+from sessions import SessionPersistence
+
+logger = logging.getLogger(__name__)
+
+FRONT_LISTEN = "127.0.0.1"
+FRONT_PORT = int(os.environ.get("SHARD_FRONT_PORT", "8470"))
+FRONT_MAX_BUFFERED = 1000      # столько апдейтов ждут, пока нет ни одного воркера; дальше старые выбрасываются
+WORKER_RESTART_DELAY = 5.0     # пауза перед перезапуском упавшего воркера, с
+WORKER_CONNECT_TIMEOUT = 30.0  # сколько воркер пытается подключиться к фронту, с
+DRAIN_TIMEOUT = 60.0           # сколько воркер доделывает начатые апдейты при уходе, с
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def owner(chat_id: int, workers) -> str | None:
+    """Воркер, за которым закреплён чат: у кого больше хэш (воркер, чат)."""
+    best, best_score = None, -1
+    for worker_id in workers:
+        digest = hashlib.blake2b(f"{worker_id}:{chat_id}".encode(), digest_size=8).digest()
+        score = int.from_bytes(digest, "big")
+        if score > best_score:
+            best, best_score = worker_id, score
+    return best
+
+
+def update_chat_id(update) -> int:
+    """Чат апдейта; для апдейтов без чата — пользователь, иначе 0."""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return 0
+
+
+def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+# ================== ФРОНТ ==================
+class _Worker:
+    __slots__ = ("id", "writer", "inflight", "draining", "routed")
+
+    def __init__(self, worker_id: str, writer: asyncio.StreamWriter):
+        self.id = worker_id
+        self.writer = writer
+        self.inflight = 0
+        self.draining = False
+        self.routed = 0
+
+
+class ShardRouter:
+    """
+    Раздаёт апдейты подключённым воркерам. Используется только из event loop фронта,
+    поэтому без блокировок.
+    """
+
+    def __init__(self, max_buffered: int = FRONT_MAX_BUFFERED):
+        self.max_buffered = max_buffered
+        self._workers: dict = {}     # id -> _Worker
+        self._chats: dict = {}       # chat_id -> [id воркера, апдейтов в работе]
+        self._held: dict = {}        # chat_id -> deque апдейтов, ждущих, пока старый воркер доделает свои
+        self._buffer = deque()       # (chat_id, апдейт), пока некому отдавать
+
+        self.routed = 0
+        self.held = 0
+        self.buffered = 0
+        self.dropped = 0
+        self.lost = 0
+
+    @property
+    def active(self) -> list:
+        return [w.id for w in self._workers.values() if not w.draining]
+
+    @property
+    def connected(self) -> list:
+        return list(self._workers)
+
+    def is_connection(self, worker_id: str, writer: asyncio.StreamWriter) -> bool:
+        """Это соединение — текущее для воркера (а не старое, после которого он переподключился)."""
+        worker = self._workers.get(worker_id)
+        return worker is not None and worker.writer is writer
+
+    def route(self, chat_id: int, update: dict):
+        held = self._held.get(chat_id)
+        if held is not None:
+            # Порядок внутри чата сохраняется: за придержанными встают следующие
+            held.append(update)
+            self.held += 1
+            return
+        target = owner(chat_id, self.active)
+        if target is None:
+            if len(self._buffer) >= self.max_buffered:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append((chat_id, update))
+            self.buffered += 1
+            return
+        current = self._chats.get(chat_id)
+        if current is not None and current[0] != target:
+            # Чат переехал, а прежний воркер ещё не доделал его апдейты
+            self._held[chat_id] = deque([update])
+            self.held += 1
+            return
+        self._dispatch(chat_id, self._workers[target], update)
+
+    def _dispatch(self, chat_id: int, worker: _Worker, update: dict):
+        _send(worker.writer, {"op": "update", "chat": chat_id, "update": update})
+        worker.inflight += 1
+        worker.routed += 1
+        self.routed += 1
+        current = self._chats.setdefault(chat_id, [worker.id, 0])
+        current[1] += 1
+
+    def done(self, worker_id: str, chat_id: int):
+        worker = self._workers.get(worker_id)
+        if worker is not None and worker.inflight:
+            worker.inflight -= 1
+        current = self._chats.get(chat_id)
+        if current is None or current[0] != worker_id:
+            return
+        current[1] -= 1
+        if current[1] <= 0:
+            del self._chats[chat_id]
+            self._release(chat_id)
+
+    def _release(self, chat_id: int):
+        held = self._held.pop(chat_id, None)
+        while held:
+            self.route(chat_id, held.popleft())
+            if chat_id in self._held:
+                # Снова придержали (например, воркеры опять поменялись) — остальное за ними
+                self._held[chat_id].extend(held)
+                return
+
+    def add_worker(self, worker_id: str, writer: asyncio.StreamWriter):
+        if worker_id in self._workers:
+            self.remove_worker(worker_id)
+        self._workers[worker_id] = _Worker(worker_id, writer)
+        logger.info(f"Воркер {worker_id} подключился, активных: {len(self.active)}")
+        self._announce()
+        buffered, self._buffer = self._buffer, deque()
+        for chat_id, update in buffered:
+            self.route(chat_id, update)
+
+    def drain_worker(self, worker_id: str) -> bool:
+        """Больше не слать воркеру апдейты; drain — последнее, что он от фронта получит."""
+        worker = self._workers.get(worker_id)
+        if worker is None or worker.draining:
+            return False
+        worker.draining = True
+        _send(worker.writer, {"op": "drain"})
+        logger.info(f"Воркер {worker_id} уходит, доделывает апдейтов: {worker.inflight}")
+        self._announce()
+        return True
+
+    def remove_worker(self, worker_id: str):
+        """Воркер отключился. Его незавершённые апдейты считаются потерянными."""
+        worker = self._workers.pop(worker_id, None)
+        if worker is None:
+            return
+        orphaned = [chat_id for chat_id, (wid, _) in self._chats.items() if wid == worker_id]
+        for chat_id in orphaned:
+            self.lost += self._chats.pop(chat_id)[1]
+        if worker.inflight and not worker.draining:
+            logger.warning(f"Воркер {worker_id} отключился, не доделав апдейтов: {worker.inflight}")
+        if not worker.draining:
+            self._announce()
+        for chat_id in orphaned:
+            self._release(chat_id)
+
+    def _announce(self):
+        """Сообщает активным воркерам, сколько их теперь."""
+        active = [w for w in self._workers.values() if not w.draining]
+        for worker in active:
+            _send(worker.writer, {"op": "workers", "n": len(active)})
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.active),
+            "draining": sum(1 for w in self._workers.values() if w.draining),
+            "inflight": sum(w.inflight for w in self._workers.values()),
+            "pending": sum(len(q) for q in self._held.values()) + len(self._buffer),
+            "routed": self.routed,
+            "held": self.held,
+            "buffered": self.buffered,
+            "dropped": self.dropped,
+            "lost": self.lost,
+        }
+
+
+class ShardFront:
+    """Сервер для воркеров и запуск/перезапуск их процессов."""
+
+    def __init__(self, router: ShardRouter, listen: str = FRONT_LISTEN, port: int = FRONT_PORT,
+                 worker_env: dict | None = None):
+        self.router = router
+        self.listen = listen
+        self.port = port
+        self.worker_env = worker_env or {}
+        self._server = None
+        self._procs: dict = {}      # id -> asyncio.subprocess.Process
+        self._retiring: set = set()  # воркеры, которые уходят намеренно и не перезапускаются
+        self._watchers: set = set()
+        self._stopping = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_worker, self.listen, self.port)
+        logger.info(f"Фронт ждёт воркеров на {self.listen}:{self.port}")
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        try:
+            line = await reader.readline()
+            hello = json.loads(line) if line else {}
+            if hello.get("op") != "hello":
+                return
+            worker_id = hello["worker"]
+            self.router.add_worker(worker_id, writer)
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message["op"] == "done":
+                    self.router.done(worker_id, message["chat"])
+                elif message["op"] == "draining":
+                    # Воркер сам решил уйти (получил SIGTERM)
+                    self._retiring.add(worker_id)
+                    self.router.drain_worker(worker_id)
+        except (ConnectionError, ValueError, KeyError) as e:
+            logger.warning(f"Соединение с воркером {worker_id} прервано: {e}")
+        finally:
+            if worker_id is not None and self.router.is_connection(worker_id, writer):
+                self.router.remove_worker(worker_id)
+            writer.close()
+
+    # ------------------ процессы воркеров ------------------
+    def spawn(self, worker_id: str, total: int):
+        self._retiring.discard(worker_id)
+        watcher = asyncio.create_task(self._run_worker_process(worker_id, total))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+
+    async def _run_worker_process(self, worker_id: str, total: int):
+        index = int(worker_id.lstrip("w") or 0)
+        while not self._stopping and worker_id not in self._retiring:
+            env = dict(os.environ, **self.worker_env)
+            env.update({
+                "BOT_MODE": "worker",
+                "SHARD_FRONT": f"{self.listen}:{self.port}",
+                "SHARD_WORKER_ID": worker_id,
+                "SHARD_WORKERS": str(total),
+            })
+            if index:
+                # Обход каталога и пополнение визуального индекса — только в одном процессе
+                env["CATALOG_CRAWL"] = "0"
+                env["VISUAL_INDEX_WRITER"] = "0"
+            if "METRICS_PORT" in self.worker_env:
+                env["METRICS_PORT"] = str(int(self.worker_env["METRICS_PORT"]) + index)
+            proc = await asyncio.create_subprocess_exec(sys.executable, APP_PATH, env=env)
+            self._procs[worker_id] = proc
+            logger.info(f"Запущен воркер {worker_id}, pid {proc.pid}")
+            code = await proc.wait()
+            self._procs.pop(worker_id, None)
+            if self._stopping or worker_id in self._retiring:
+                logger.info(f"Воркер {worker_id} завершился (код {code})")
+                break
+            logger.error(f"Воркер {worker_id} упал (код {code}), перезапуск через {WORKER_RESTART_DELAY:.0f} с")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    def worker_ids(self) -> list:
+        return sorted(set(self._procs) - self._retiring, key=lambda w: int(w.lstrip("w") or 0))
+
+    def scale_up(self):
+        ids = set(self._procs) | set(self.router.connected)
+        index = next(i for i in range(len(ids) + 1) if f"w{i}" not in ids)
+        self.spawn(f"w{index}", len(self.worker_ids()) + 1)
+
+    def scale_down(self):
+        ids = self.worker_ids()
+        if len(ids) <= 1:
+            logger.warning("Последний воркер не убирается: остановите фронт")
+            return
+        self.retire(ids[-1])
+
+    def retire(self, worker_id: str):
+        self._retiring.add(worker_id)
+        if worker_id in self.router.connected:
+            self.router.drain_worker(worker_id)
+        else:
+            # Ещё не подключился — дренировать нечего
+            proc = self._procs.get(worker_id)
+            if proc is not None and proc.returncode is None:
+                proc.terminate()
+
+    async def stop(self):
+        """Дренирует все воркеры и ждёт, пока их процессы завершатся."""
+        self._stopping = True
+        for worker_id in list(self._procs):
+            self.retire(worker_id)
+        for worker_id in self.router.connected:
+            self.router.drain_worker(worker_id)
+        if self._watchers:
+            await asyncio.wait(list(self._watchers), timeout=DRAIN_TIMEOUT + 10)
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.kill()
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def _setup_front_metrics(router: ShardRouter, port: int, addr: str):
+    import metrics
+
+    metrics.configure(enabled=True)
+
+    def updates():
+        st = router.stats()
+        return {(("result", k),): st[k] for k in ("routed", "held", "buffered", "dropped", "lost")}
+
+    metrics.register_callback("bot_front_workers", "gauge", "Воркеры: активные и уходящие",
+                              lambda: {(("state", k),): router.stats()[k] for k in ("workers", "draining")})
+    metrics.register_callback("bot_front_inflight", "gauge", "Апдейты, отданные воркерам и ещё не обработанные",
+                              lambda: router.stats()["inflight"])
+    metrics.register_callback("bot_front_pending", "gauge", "Апдейты, ждущие воркера",
+                              lambda: router.stats()["pending"])
+    metrics.register_callback("bot_front_updates_total", "counter", "Апдейты по судьбе", updates)
+    metrics.start_http_server(port, addr)
+
+
+async def run_front(workers: int, listen: str = FRONT_LISTEN, port: int = FRONT_PORT):
+    # Настройки приёма апдейтов, Bot API и метрик — те же, что у обычного бота
+    import app
+
+    router = ShardRouter()
+    worker_env = {}
+    if app.METRICS_ENABLED and app.METRICS_PORT:
+        _setup_front_metrics(router, app.METRICS_PORT, app.METRICS_ADDR)
+        worker_env["METRICS_PORT"] = str(app.METRICS_PORT + 1)
+    front = ShardFront(router, listen, port, worker_env)
+    await front.start()
+    for i in range(workers):
+        front.spawn(f"w{i}", workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, front.scale_up)
+    loop.add_signal_handler(signal.SIGUSR2, front.scale_down)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # Application здесь только принимает апдейты: обработчиков нет, start() не вызывается
+    application = app.bot_builder().build()
+    await application.initialize()
+    if app.BOT_MODE == "webhook":
+        await application.updater.start_webhook(
+            listen=app.WEBHOOK_LISTEN,
+            port=app.WEBHOOK_PORT,
+            url_path=app.WEBHOOK_PATH,
+            webhook_url=app.WEBHOOK_URL or f"http://{app.WEBHOOK_LISTEN}:{app.WEBHOOK_PORT}/{app.WEBHOOK_PATH}",
+            secret_token=app.WEBHOOK_SECRET,
+            cert=app.WEBHOOK_CERT,
+            key=app.WEBHOOK_KEY,
+        )
+    else:
+        await application.updater.start_polling()
+
+    queue = application.update_queue
+    while not stop.is_set():
+        get = asyncio.ensure_future(queue.get())
+        stopped = asyncio.ensure_future(stop.wait())
+        await asyncio.wait({get, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if not get.done():
+            get.cancel()
+            break
+        update = get.result()
+        router.route(update_chat_id(update), update.to_dict())
+
+    logger.info("Фронт останавливается: новые апдейты не принимаются, воркеры доделывают начатое")
+    await application.updater.stop()
+    await application.shutdown()
+    await front.stop()
+    logger.info(f"Фронт остановлен: {router.stats()}")
+
+
+# ================== ВОРКЕР ==================
+async def _connect(host: str, port: int):
+    deadline = asyncio.get_running_loop().time() + WORKER_CONNECT_TIMEOUT
+    while True:
+        try:
+            return await asyncio.open_connection(host, port)
+        except OSError:
+            if asyncio.get_running_loop().time() > deadline:
+                raise
+            await asyncio.sleep(0.5)
+
+
+async def handle_update(application, data: dict):
+    """
+    Обрабатывает один апдейт (dict из Bot API) и сохраняет сессию пользователя.
+    SessionPersistence узнаёт, какие апдейты пользователя ещё в работе, чтобы
+    параллельный апдейт не перечитал user_data поверх несохранённых изменений.
+    """
+    from telegram import Update
+
+    persistence = application.persistence if isinstance(application.persistence, SessionPersistence) else None
+    update = Update.de_json(data, application.bot)
+    user_id = update.effective_user.id if persistence is not None and update.effective_user else None
+    if user_id is not None:
+        persistence.update_started(user_id)
+    try:
+        await application.update_processor.process_update(update, application.process_update(update))
+        await application.update_persistence()
+    finally:
+        if user_id is not None:
+            persistence.update_finished(user_id)
+
+
+async def serve_worker(application, front: str, worker_id: str, on_drain=None, on_workers=None):
+    """
+    Обрабатывает апдейты от фронта, пока тот не пришлёт drain (или не отключится).
+    Сессия пользователя сохраняется до того, как фронт узнает, что апдейт обработан.
+    on_drain() вызывается перед остановкой, когда начатые апдейты доделаны,
+    on_workers(n) — когда меняется число активных воркеров.
+    """
+    host, port = front.rsplit(":", 1)
+    reader, writer = await _connect(host, int(port))
+    await application.initialize()
+    await application.start()
+    if application.post_init is not None:
+        await application.post_init(application)
+
+    loop = asyncio.get_running_loop()
+    asking = []
+
+    def ask_to_drain():
+        # Уходим по своей инициативе: фронт перестанет слать апдейты и ответит drain
+        if not asking:
+            asking.append(True)
+            _send(writer, {"op": "draining"})
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, ask_to_drain)
+
+    async def process(chat_id: int, data: dict):
+        try:
+            await handle_update(application, data)
+        except Exception:
+            logger.exception("Ошибка при обработке апдейта от фронта")
+        finally:
+            _send(writer, {"op": "done", "chat": chat_id})
+
+    tasks: set = set()
+    _send(writer, {"op": "hello", "worker": worker_id, "pid": os.getpid()})
+    logger.info(f"Воркер {worker_id} подключён к фронту {front}")
+    try:
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message["op"] == "drain":
+                break
+            if message["op"] == "workers":
+                if on_workers is not None:
+                    on_workers(message["n"])
+                continue
+            if message["op"] == "update":
+                task = asyncio.create_task(process(message["chat"], message["update"]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        else:
+            logger.warning("Фронт отключился, воркер останавливается")
+    except ConnectionError as e:
+        logger.warning(f"Соединение с фронтом прервано: {e}")
+
+    if tasks:
+        logger.info(f"Воркер {worker_id} доделывает апдейтов: {len(tasks)}")
+        await asyncio.wait(list(tasks), timeout=DRAIN_TIMEOUT)
+    if on_drain is not None:
+        on_drain()
+    await application.update_persistence()
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
+    logger.info(f"Воркер {worker_id} остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот в нескольких процессах с общим хранилищем сессий")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="сколько воркеров запустить")
+    parser.add_argument("--listen", default=FRONT_LISTEN, help="адрес, на котором фронт ждёт воркеров")
+    parser.add_argument("--port", type=int, default=FRONT_PORT)
+    args = parser.parse_args()
+    asyncio.run(run_front(args.workers, args.listen, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Single-flight: одновременные одинаковые запросы выполняются один раз.
+
+Пока вызов по ключу не завершён, новые запросы с тем же ключом получают
+тот же объект вызова. Используется только из event loop бота, поэтому
+без блокировок.
+"""
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def run(self, key, start):
+        """
+        Возвращает идущий вызов с ключом key или запускает новый.
+
+        start() без аргументов создаёт и запускает вызов — объект с интерфейсом
+        SearchStream (done, cancelled, add_done_callback); исключения start()
+        пробрасываются. Возвращает (call, created): created=True, если вызов
+        только что запущен через start(), и False, если это уже идущий.
+        """
+        call = self._inflight.get(key)
+        if call is not None and not call.done and not call.cancelled:
+            self.coalesced += 1
+            return call, False
+
+        call = start()
+        self._inflight[key] = call
+        self.started += 1
+        call.add_done_callback(lambda c, key=key: self._forget(key, c))
+        return call, True
+
+    def _forget(self, key, call):
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
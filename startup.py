@@ -0,0 +1,157 @@
+"""
+Быстрый старт бота.
+
+LazyModule откладывает импорт тяжёлого модуля до первого обращения к атрибуту.
+Subsystem догружает тяжёлую часть бота (модель, браузеры) в фоновом потоке,
+пока бот уже принимает сообщения; хендлеры могут дождаться её с таймаутом.
+StartupReport собирает, сколько заняли импорты, сборка приложения и фоновые загрузки.
+"""
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self._steps = []    # (name, seconds, background)
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, name: str):
+        """Записывает время с предыдущей отметки — для последовательных шагов в основном потоке."""
+        now = time.perf_counter()
+        with self._lock:
+            self._steps.append((name, now - self._last_mark, False))
+            self._last_mark = now
+
+    @contextmanager
+    def step(self, name: str, background: bool = True):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._steps.append((name, time.perf_counter() - started, background))
+
+    def summary(self) -> str:
+        with self._lock:
+            steps = list(self._steps)
+        lines = [f"Старт бота, {self.elapsed():.2f} с с момента импорта:"]
+        for name, seconds, background in steps:
+            lines.append(f"  {name:<24}{seconds:>8.2f} с{'  (в фоне)' if background else ''}")
+        return "\n".join(lines)
+
+
+report = StartupReport()
+
+
+class LazyModule:
+    """uc = LazyModule("undetected_chromedriver"); модуль импортируется при первом uc.Chrome."""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                with report.step(f"import {self._name}"):
+                    self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._module or self._load()
+        return getattr(module, attr)
+
+
+class Subsystem:
+    """
+    loader() выполняется в фоновом потоке после start(). Пока подсистема не запущена,
+    она считается готовой: хендлеры идут старым ленивым путём. Ошибка загрузки
+    тоже не блокирует хендлеры — они попробуют загрузить подсистему сами.
+    """
+
+    def __init__(self, name: str, loader):
+        self.name = name
+        self.loader = loader
+        self.started = False
+        self.error: BaseException | None = None
+        self.seconds: float | None = None
+        self._done = threading.Event()
+        self._waiters = []   # (loop, future)
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return not self.started or self._done.is_set()
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._run, name=f"startup-{self.name}", daemon=True).start()
+
+    def add_done_callback(self, fn):
+        """fn(subsystem) вызывается в фоновом потоке по окончании загрузки (или сразу)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        """Ждёт готовности, не блокируя event loop. True — готова."""
+        if self.ready:
+            return True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._done.is_set():
+                return True
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            with report.step(self.name):
+                self.loader()
+        except Exception as e:
+            self.error = e
+            logger.exception("Фоновая загрузка %s не удалась: %s", self.name, e)
+        self.seconds = time.perf_counter() - started
+        if self.error is None:
+            logger.info("%s готово за %.2f с", self.name, self.seconds)
+
+        with self._lock:
+            self._done.set()
+            waiters, self._waiters = self._waiters, []
+            callbacks, self._callbacks = self._callbacks, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике готовности {self.name}: {e}")
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
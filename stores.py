@@ -0,0 +1,225 @@
+"""
+Адаптеры интернет-магазинов для парсера и параллельный опрос нескольких магазинов.
+
+StoreAdapter описывает всё, что в парсере зависит от конкретного сайта: адрес
+страницы поиска, как найти поле ввода, селекторы карточек, цен и картинок и
+как крутить выдачу. Сам обход страницы (ввод запроса, прокрутка, извлечение)
+общий и живёт в app.py.
+
+fan_out опрашивает несколько магазинов одновременно, каждый в своём потоке,
+и отдаёт пачки товаров по мере поступления, без повторов по ссылке. Магазин,
+не уложившийся в свой срок, просто перестаёт учитываться — остальных он не ждёт.
+"""
+import copy
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+
+class StoreAdapter:
+    """
+    name — короткий id магазина (ключ в STORES и в метриках).
+    search_url — страница с полем поиска; запрос вводится в поле и отправляется Enter.
+    results_selector — появление такого элемента означает, что выдача загрузилась.
+    product_path / catalog_path — подстроки ссылок на товар и на раздел каталога.
+    scroll_step, max_scrolls, no_change_limit, scroll_wait_timeout — как крутить выдачу.
+    deadline — собственный лимит времени магазина, с; None — общий лимит поиска.
+    """
+
+    def __init__(self, name: str, base_url: str, search_url: str, *,
+                 title: str | None = None,
+                 search_input_selectors=("input[type=\"search\"]", "input"),
+                 results_selector: str = 'a[href*="/product/"]',
+                 card_selectors=(".product-card",),
+                 anchor_fallback_selector: str = 'a[href*="/product/"]',
+                 product_anchor_selector: str = 'a[href*="/product/"]',
+                 title_selector: str = ".product-card__title",
+                 image_selectors=("img",),
+                 price_selectors=(".price",),
+                 product_path: str = "/product/",
+                 catalog_path: str = "/catalog/",
+                 scroll_step: int = 900,
+                 max_scrolls: int = 120,
+                 no_change_limit: int = 2,
+                 scroll_wait_timeout: float = 2.0,
+                 deadline: float | None = None):
+        self.name = name
+        self.title = title or name
+        self.base_url = base_url
+        self.search_url = search_url
+        self.search_input_selectors = list(search_input_selectors)
+        self.results_selector = results_selector
+        self.card_selectors = list(card_selectors)
+        self.anchor_fallback_selector = anchor_fallback_selector
+        self.product_anchor_selector = product_anchor_selector
+        self.title_selector = title_selector
+        self.image_selectors = list(image_selectors)
+        self.price_selectors = list(price_selectors)
+        self.product_path = product_path
+        self.catalog_path = catalog_path
+        self.scroll_step = scroll_step
+        self.max_scrolls = max_scrolls
+        self.no_change_limit = no_change_limit
+        self.scroll_wait_timeout = scroll_wait_timeout
+        self.deadline = deadline
+
+    def absolute(self, url: str) -> str:
+        return urljoin(self.base_url, url) if url.startswith("/") else url
+
+    def retarget(self, base_url: str) -> "StoreAdapter":
+        """
+        Копия адаптера, смотрящая на другой хост с тем же путём поиска, —
+        например на локальный сервер с сохранёнными страницами магазина.
+        """
+        adapter = copy.copy(self)
+        path = self.search_url[len(self.base_url):] if self.search_url.startswith(self.base_url) else "search"
+        adapter.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        adapter.search_url = urljoin(adapter.base_url, path)
+        return adapter
+
+    def __repr__(self):
+        return f"StoreAdapter({self.name!r}, {self.search_url!r})"
+
+
+GLORIA_JEANS = StoreAdapter(
+    "gloria-jeans",
+    "https://www.gloria-jeans.ru/",
+    "https://www.gloria-jeans.ru/search",
+    title="Gloria Jeans",
+    search_input_selectors=[
+        'input[type="search"]',
+        'input[name*="search"]',
+        'input[placeholder*="Поиск"]',
+        'input[placeholder*="поиск"]',
+        'input[aria-label*="Поиск"]',
+        'input[aria-label*="search"]',
+        '.header-controls_control input',
+        '.search-input input',
+        'input'
+    ],
+    results_selector='a[href*="/product/"]',
+    card_selectors=[
+        'gj-product-mini-card',
+        '.product-mini-card',
+        '.listing-grid__col',
+        '.product-mini-card__image-wrapper',
+        '.product-card',
+        '.product-item',
+        '.catalog-card',
+        '.catalog__item',
+        '[data-testid="product-card"]',
+        'article'
+    ],
+    anchor_fallback_selector='a[href*="/product/"], a[href*="/catalog/"]',
+    product_anchor_selector='.product-mini-card__name a, a[href*="/product/"]',
+    title_selector='.product-mini-card__name, .product-mini-card__name a, .product-mini-card__name span',
+    image_selectors=['img.product-mini-card__image, img.product-mini-card__img', 'img', 'picture img'],
+    price_selectors=[
+        'span.button__label',
+        '.button__label',
+        'span.price-new',
+        'span.price-old',
+        'span.price',
+        '.product-card__price-current',
+        '.product-card__price',
+        '.price-current',
+        '.price',
+        'gj-button-price'
+    ],
+)
+
+STORES = {GLORIA_JEANS.name: GLORIA_JEANS}
+
+
+def register(adapter: StoreAdapter):
+    STORES[adapter.name] = adapter
+
+
+# ------------------ параллельный опрос магазинов ------------------
+def _pump(name: str, source, stop: threading.Event, out: queue.Queue):
+    """Прокачивает пачки одного магазина в общую очередь, пока не велят остановиться."""
+    try:
+        batches = source()
+        try:
+            for batch in batches:
+                out.put((name, "batch", batch))
+                if stop.is_set():
+                    break
+        finally:
+            # Закрываем генератор в своём потоке — браузер вернётся в пул отсюда
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+        out.put((name, "done", None))
+    except Exception as e:
+        out.put((name, "error", e))
+
+
+def fan_out(sources: dict, deadlines: dict, max_results: int, report: dict | None = None):
+    """
+    sources: магазин -> source() -> итератор пачек товаров (list[dict]),
+    deadlines: магазин -> момент time.monotonic(), после которого магазин не ждём.
+    Отдаёт пачки по мере поступления от любого магазина, без повторов по ссылке,
+    всего не больше max_results товаров. report (если передан) получает по каждому
+    магазину {"status": ok | timeout | error | cancelled, "items": n, "seconds": t}.
+    """
+    report = {} if report is None else report
+    out: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    started = time.monotonic()
+    pending = set(sources)
+    for name in sources:
+        report[name] = {"status": "cancelled", "items": 0, "seconds": 0.0}
+
+    for name, source in sources.items():
+        threading.Thread(target=_pump, args=(name, source, stop, out), name=f"store-{name}",
+                         daemon=True).start()
+
+    seen_links = set()
+    found = 0
+    try:
+        while pending and found < max_results:
+            now = time.monotonic()
+            for name in [n for n in pending if deadlines[n] <= now]:
+                pending.discard(name)
+                report[name].update(status="timeout", seconds=now - started)
+                logger.warning("Магазин %s не уложился в срок, найдено %d товаров",
+                               name, report[name]["items"])
+            if not pending:
+                break
+
+            try:
+                name, kind, payload = out.get(timeout=min(deadlines[n] for n in pending) - now)
+            except queue.Empty:
+                continue
+            if name not in pending:
+                # Ответ магазина, который уже сняли по сроку
+                continue
+
+            if kind == "batch":
+                batch = []
+                for item in payload:
+                    link = item.get("link")
+                    if link and link not in seen_links and found + len(batch) < max_results:
+                        seen_links.add(link)
+                        batch.append(item)
+                report[name]["items"] += len(batch)
+                found += len(batch)
+                if batch:
+                    yield batch
+                continue
+
+            pending.discard(name)
+            report[name]["seconds"] = time.monotonic() - started
+            if kind == "done":
+                report[name]["status"] = "ok"
+            else:
+                report[name]["status"] = "error"
+                logger.error(f"Поиск в магазине {name} упал: {payload}")
+    finally:
+        # Досрочное закрытие или сбор max_results: оставшиеся магазины остановятся после текущей пачки
+        stop.set()
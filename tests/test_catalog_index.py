@@ -0,0 +1,43 @@
+import pytest
+
+from catalog_index import parse_price, parse_price_filter, stem, terms
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("черные джинсы до 2000", ("черные джинсы", None, 2000.0)),
+    ("куртка дешевле 1 999 руб", ("куртка", None, 1999.0)),
+    ("куртка от 1 500 р.", ("куртка", 1500.0, None)),
+    ("джинсы дороже 3 000 ₽ синие", ("джинсы синие", 3000.0, None)),
+    ("платье 500-1500₽", ("платье", 500.0, 1500.0)),
+    ("джинсы 1 000-3 000 руб", ("джинсы", 1000.0, 3000.0)),
+    ("платье 1500 - 2 500", ("платье", 1500.0, 2500.0)),
+    ("размер 42 джинсы", ("размер 42 джинсы", None, None)),
+    ("", ("", None, None)),
+])
+def test_parse_price_filter(query, expected):
+    assert parse_price_filter(query) == expected
+
+
+@pytest.mark.parametrize("price, expected", [
+    ("1 999 ₽", 1999.0),
+    ("12 345,50 руб.", 12345.5),
+    ("от 990 ₽", 990.0),
+    ("нет в наличии", None),
+    (None, None),
+])
+def test_parse_price(price, expected):
+    assert parse_price(price) == expected
+
+
+@pytest.mark.parametrize("words, expected", [
+    (("черные", "чёрный", "черная"), "черн"),
+    (("джинсы", "джинсов"), "джинс"),
+    (("куртка", "куртки", "куртку"), "куртк"),
+    (("красивейший", "красивые"), "красив"),
+])
+def test_stem_groups_word_forms(words, expected):
+    assert {stem(w) for w in words} == {expected}
+
+
+def test_terms_skip_stop_words_and_repeats():
+    assert terms("Черные джинсы для мужчин, черные") == ["черн", "джинс", "мужчин"]
@@ -0,0 +1,19 @@
+from classify_images import JsonlWriter
+
+
+def test_resume_skips_errors_only_when_asked(tmp_path):
+    writer = JsonlWriter(str(tmp_path / "labels.jsonl"))
+    writer.write([{"path": "a.jpg", "type": "jeans", "error": None},
+                  {"path": "b.jpg", "error": "OSError: truncated"},
+                  {"path": "c.jpg", "error": "OSError: truncated"}])
+    writer.write([{"path": "c.jpg", "type": "shirt", "error": None}])   # повторная разметка удалась
+
+    assert writer.done_paths() == {"a.jpg", "b.jpg", "c.jpg"}
+    assert writer.done_paths(with_errors=False) == {"a.jpg", "c.jpg"}
+
+
+def test_truncated_last_line_is_dropped(tmp_path):
+    path = tmp_path / "labels.jsonl"
+    path.write_text('{"path": "a.jpg", "error": null}\n{"path": "b.j', encoding="utf-8")
+    assert JsonlWriter(str(path)).done_paths() == {"a.jpg"}
+    assert path.read_text(encoding="utf-8") == '{"path": "a.jpg", "error": null}\n'
@@ -0,0 +1,64 @@
+from inference_cache import InferenceCache
+
+# Записи кэша — то, что возвращают classify_photo / predict_labels_batch:
+# (type_label, color_label, print_label, alternatives), alternatives — [[type, color, p], ...]
+JEANS = ("jeans", "blue", "no_print", [["pants", "blue", 0.12], ["jeans", "black", 0.08]])
+JACKET = ("jacket", "black", "no_print", [["hoodie", "black", 0.2]])
+SHIRT = ("shirt", "white", "with_print", [])
+
+
+def test_lru_order_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = InferenceCache(max_entries=2, max_distance=0, path=path)
+    # Хэши специально идут не по возрастанию: порядок должен быть по обращениям
+    cache.put(30, JEANS, file_unique_id="a")
+    cache.put(10, JACKET, file_unique_id="b")
+    assert cache.get_by_file_id("a") is not None   # 30 теперь свежее 10
+    cache.flush()
+
+    cache = InferenceCache(max_entries=2, max_distance=0, path=path)
+    cache.put(20, SHIRT)
+    assert cache.get_by_hash(10) is None
+    assert cache.get_by_file_id("a") == JEANS
+
+
+def test_reload_truncates_to_most_recent(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = InferenceCache(max_entries=3, max_distance=0, path=path)
+    for phash, labels in ((5, JEANS), (1, JACKET), (3, SHIRT)):
+        cache.put(phash, labels)
+    cache.get_by_hash(5)
+    cache.flush()
+
+    cache = InferenceCache(max_entries=2, max_distance=0, path=path)
+    assert cache.stats()["entries"] == 2
+    assert cache.get_by_hash(1) is None
+    assert cache.get_by_hash(5) == JEANS
+
+    cache = InferenceCache(max_entries=3, max_distance=0, path=path)
+    assert cache.stats()["entries"] == 2
+
+
+def test_writes_are_batched_until_flush(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = InferenceCache(max_entries=10, max_distance=0, path=path, commit_every=3, commit_interval=3600)
+    cache.put(1, JEANS, file_unique_id="a")
+    cache.put(2, JACKET)
+    assert InferenceCache(path=path).stats()["entries"] == 0
+
+    cache.put(3, SHIRT)   # третья запись — пачка уходит на диск
+    assert InferenceCache(path=path).stats()["entries"] == 3
+
+    cache.get_by_hash(2, file_unique_id="b")
+    cache.flush()
+    reloaded = InferenceCache(path=path, max_distance=0)
+    assert reloaded.get_by_file_id("b") == JACKET
+    assert reloaded.get_by_file_id("a") == JEANS
+
+
+def test_old_entries_without_alternatives_reload(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = InferenceCache(max_distance=0, path=path)
+    cache.put(7, ("tshirt", "red", "with_print"))   # запись прошлых версий, без alternatives
+    cache.flush()
+    assert InferenceCache(path=path, max_distance=0).get_by_hash(7) == ("tshirt", "red", "with_print")
@@ -0,0 +1,111 @@
+import asyncio
+
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from sessions import SessionPersistence, SessionStore
+from sharding import handle_update
+
+
+def _application(api: FakeBotAPI, store: SessionStore):
+    return (ApplicationBuilder().token("1:TEST")
+            .base_url(f"{api.base_url}/bot").base_file_url(f"{api.base_url}/file/bot")
+            .updater(None).concurrent_updates(True)
+            .persistence(SessionPersistence(store, update_interval=3600))
+            .build())
+
+
+def test_overlapping_updates_keep_user_data(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.save_session(7, {"last_prediction": "Джинсы"})
+    seen = {}
+
+    async def main():
+        first_wrote = asyncio.Event()
+        second_done = asyncio.Event()
+
+        async def handler(update, context):
+            if update.message.text == "first":
+                context.user_data["result_id"] = 5
+                first_wrote.set()
+                await second_done.wait()
+                seen["first"] = dict(context.user_data)
+            else:
+                context.user_data["cursor"] = 15
+                seen["second"] = dict(context.user_data)
+                second_done.set()
+
+        with FakeBotAPI() as api:
+            application = _application(api, store)
+            application.add_handler(MessageHandler(filters.TEXT, handler))
+            await application.initialize()
+            first = asyncio.create_task(handle_update(application, dict(api.text_update(7, "first"), update_id=1)))
+            await asyncio.wait_for(first_wrote.wait(), 10)
+            await handle_update(application, dict(api.text_update(7, "second"), update_id=2))
+            await first
+            await application.shutdown()
+
+    asyncio.run(main())
+
+    expected = {"last_prediction": "Джинсы", "result_id": 5, "cursor": 15}
+    assert seen["second"] == expected
+    assert seen["first"] == expected
+    assert store.load_session(7) == expected
+
+
+def test_refresh_reads_store_between_updates(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    persistence = SessionPersistence(store)
+    user_data = {}
+
+    async def main():
+        persistence.update_started(7)
+        await persistence.refresh_user_data(7, user_data)
+        user_data["result_id"] = 5
+        await persistence.update_user_data(7, user_data)
+        persistence.update_finished(7)
+
+        # Чат переехал в другой процесс и вернулся: сессию переписали там
+        store.save_session(7, {"result_id": 9})
+        persistence.update_started(7)
+        await persistence.refresh_user_data(7, user_data)
+        persistence.update_finished(7)
+
+    asyncio.run(main())
+    assert user_data == {"result_id": 9}
+
+
+def test_concurrent_refreshes_share_one_read(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.save_session(7, {"result_id": 5})
+    persistence = SessionPersistence(store)
+    user_data = {}
+    reads = []
+    load_session = store.load_session
+    store.load_session = lambda user_id: reads.append(user_id) or load_session(user_id)
+
+    async def main():
+        persistence.update_started(7)
+        persistence.update_started(7)
+        first = asyncio.create_task(persistence.refresh_user_data(7, user_data))
+        second = asyncio.create_task(persistence.refresh_user_data(7, user_data))
+        await first
+        user_data["cursor"] = 15  # первый апдейт пишет, пока второй ещё не закончил
+        await second
+        persistence.update_finished(7)
+        persistence.update_finished(7)
+
+    asyncio.run(main())
+    assert reads == [7]
+    assert user_data == {"result_id": 5, "cursor": 15}
+
+
+def test_save_results_keeps_most_complete_version(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    products = [{"title": f"товар {i}", "link": f"https://shop/{i}"} for i in range(30)]
+
+    assert store.save_results(1, "джинсы", products[:15], done=False)
+    assert not store.save_results(1, "джинсы", products[:10], done=False)   # запоздавшая запись
+    assert store.save_results(1, "джинсы", products[:20], done=True)
+    assert not store.save_results(1, "джинсы", products, done=False)
+    assert store.load_results(1) == ("джинсы", products[:20], True)
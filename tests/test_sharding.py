@@ -0,0 +1,130 @@
+import json
+
+from sharding import ShardRouter, owner
+
+
+class FakeWriter:
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data: bytes):
+        self.messages.extend(json.loads(line) for line in data.decode("utf-8").splitlines())
+
+    def ops(self, op: str) -> list:
+        return [m for m in self.messages if m["op"] == op]
+
+
+def test_workers_learn_current_count():
+    router = ShardRouter()
+    writers = {wid: FakeWriter() for wid in ("w0", "w1", "w2")}
+    for wid, writer in writers.items():
+        router.add_worker(wid, writer)
+    assert writers["w0"].ops("workers")[-1]["n"] == 3
+    assert writers["w2"].ops("workers")[-1]["n"] == 3
+
+    router.drain_worker("w2")
+    assert writers["w0"].ops("workers")[-1]["n"] == 2
+    assert writers["w2"].messages[-1] == {"op": "drain"}
+
+    router.remove_worker("w2")
+    router.remove_worker("w1")   # упал, не уходя
+    assert writers["w0"].ops("workers")[-1]["n"] == 1
+
+
+def _connect(router: ShardRouter, *worker_ids) -> dict:
+    writers = {}
+    for wid in worker_ids:
+        writers[wid] = FakeWriter()
+        router.add_worker(wid, writers[wid])
+    return writers
+
+
+def _updates(writer: FakeWriter) -> list:
+    return [(m["chat"], m["update"]["n"]) for m in writer.ops("update")]
+
+
+def _chat_owned_by(worker_id: str, workers) -> int:
+    return next(chat for chat in range(1, 10000) if owner(chat, workers) == worker_id)
+
+
+def test_owner_is_stable_and_moves_only_affected_chats():
+    before = {chat: owner(chat, ["w0", "w1", "w2"]) for chat in range(1000)}
+    after = {chat: owner(chat, ["w0", "w1", "w2", "w3"]) for chat in range(1000)}
+    moved = [chat for chat in before if before[chat] != after[chat]]
+    assert moved and all(after[chat] == "w3" for chat in moved)
+    assert owner(5, []) is None
+
+
+def test_route_and_done():
+    router = ShardRouter()
+    writers = _connect(router, "w0", "w1")
+    chat = _chat_owned_by("w1", ["w0", "w1"])
+
+    router.route(chat, {"n": 1})
+    router.route(chat, {"n": 2})
+    assert _updates(writers["w1"]) == [(chat, 1), (chat, 2)]
+    assert router.stats()["inflight"] == 2
+
+    router.done("w1", chat)
+    router.done("w1", chat)
+    assert router.stats()["inflight"] == 0
+    assert router.stats()["routed"] == 2
+
+
+def test_scale_up_holds_migrating_chat_until_old_worker_is_done():
+    router = ShardRouter()
+    writers = _connect(router, "w0")
+    chat = _chat_owned_by("w1", ["w0", "w1"])
+    router.route(chat, {"n": 1})
+
+    writers.update(_connect(router, "w1"))
+    router.route(chat, {"n": 2})
+    router.route(chat, {"n": 3})
+    # Пока w0 не доделал апдейт чата, новый воркер его апдейтов не получает
+    assert _updates(writers["w1"]) == []
+    assert router.stats()["pending"] == 2
+
+    router.done("w0", chat)
+    assert _updates(writers["w1"]) == [(chat, 2), (chat, 3)]
+    assert _updates(writers["w0"]) == [(chat, 1)]
+    assert router.stats()["pending"] == 0
+
+
+def test_scale_down_moves_chats_of_drained_worker():
+    router = ShardRouter()
+    writers = _connect(router, "w0", "w1")
+    chat = _chat_owned_by("w1", ["w0", "w1"])
+    router.route(chat, {"n": 1})
+
+    router.drain_worker("w1")
+    router.route(chat, {"n": 2})
+    assert _updates(writers["w0"]) == []
+
+    router.done("w1", chat)
+    router.remove_worker("w1")
+    assert _updates(writers["w0"]) == [(chat, 2)]
+    assert router.stats()["lost"] == 0
+
+
+def test_remove_crashed_worker_releases_held_updates():
+    router = ShardRouter()
+    writers = _connect(router, "w0", "w1")
+    chat = _chat_owned_by("w1", ["w0", "w1"])
+    router.route(chat, {"n": 1})
+    router.route(chat, {"n": 2})
+
+    router.drain_worker("w1")
+    router.route(chat, {"n": 3})
+    router.remove_worker("w1")   # упал, не доделав двух апдейтов
+    assert router.stats()["lost"] == 2
+    assert _updates(writers["w0"]) == [(chat, 3)]
+
+
+def test_updates_are_buffered_without_workers():
+    router = ShardRouter(max_buffered=2)
+    for n in range(3):
+        router.route(7, {"n": n})
+    assert router.stats()["dropped"] == 1
+
+    writers = _connect(router, "w0")
+    assert _updates(writers["w0"]) == [(7, 1), (7, 2)]
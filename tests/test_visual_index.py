@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+from visual_index import VisualIndex
+
+
+def _products(start: int, n: int) -> list:
+    return [{"title": f"товар {i}", "link": f"https://shop/{i}"} for i in range(start, start + n)]
+
+
+def test_ivf_appends_without_rewriting_centroids(tmp_path):
+    rng = np.random.default_rng(0)
+    index = VisualIndex(str(tmp_path), dim=8)
+    index.add(rng.normal(size=(40, 8)), _products(0, 40))
+    index.build_ivf(nlist=4)
+    centroids_mtime = os.stat(tmp_path / "ivf_centroids.npy").st_mtime_ns
+
+    extra = rng.normal(size=(5, 8))
+    index.add(extra, _products(40, 5))
+    assert len(index.ivf["assign"]) == 45
+    assert os.stat(tmp_path / "ivf_centroids.npy").st_mtime_ns == centroids_mtime
+    assert os.path.getsize(tmp_path / "ivf_codes.i8") == 45 * 8
+
+    reopened = VisualIndex(str(tmp_path), dim=8)
+    assert reopened.ivf is not None
+    score, product = reopened.search(extra[2], k=1, nprobe=4)[0]
+    assert product["link"] == "https://shop/42"
+    assert score > 0.99
+
+
+def test_stale_ivf_is_ignored(tmp_path):
+    rng = np.random.default_rng(1)
+    index = VisualIndex(str(tmp_path), dim=8)
+    index.add(rng.normal(size=(20, 8)), _products(0, 20))
+    index.build_ivf(nlist=2)
+    with open(tmp_path / "ivf_assign.i32", "r+b") as f:
+        f.truncate(4 * 19)   # процесс упал, не дописав назначения
+    assert VisualIndex(str(tmp_path), dim=8).ivf is None
+
+
+def test_orphan_meta_lines_are_dropped_on_open(tmp_path):
+    rng = np.random.default_rng(2)
+    index = VisualIndex(str(tmp_path), dim=8)
+    index.add(rng.normal(size=(3, 8)), _products(0, 3))
+    with open(tmp_path / "meta.jsonl", "a", encoding="utf-8") as f:
+        # процесс упал после дозаписи meta, не обновив header.json
+        f.write('{"title": "товар 3", "link": "https://shop/3"}\n{"title": "тов')
+
+    reader = VisualIndex(str(tmp_path), dim=8, writable=False)
+    assert len(reader) == 3
+
+    reopened = VisualIndex(str(tmp_path), dim=8)
+    assert len(reopened) == 3 and "https://shop/3" not in reopened
+    extra = rng.normal(size=(1, 8))
+    reopened.add(extra, _products(3, 1))
+    assert VisualIndex(str(tmp_path), dim=8).search(extra[0], k=1)[0][1]["link"] == "https://shop/3"
+
+
+def test_reader_picks_up_vectors_added_by_writer(tmp_path):
+    rng = np.random.default_rng(3)
+    writer = VisualIndex(str(tmp_path), dim=8, initial_capacity=4)
+    writer.add(rng.normal(size=(40, 8)), _products(0, 40))
+    writer.build_ivf(nlist=4)
+    reader = VisualIndex(str(tmp_path), dim=8, writable=False)
+    assert len(reader) == 40 and reader.ivf is not None
+
+    extra = rng.normal(size=(30, 8))
+    writer.add(extra, _products(40, 30))   # vectors.f32 вырос: читатель переотображает его
+    score, product = reader.search(extra[25], k=1, nprobe=4)[0]
+    assert product["link"] == "https://shop/65"
+    assert score > 0.99
+    assert len(reader) == 70 and len(reader.ivf["assign"]) == 70
+    assert "https://shop/65" in reader
@@ -0,0 +1,490 @@
+"""
+Обучение многозадачной модели бота (тип / цвет / принт) — то же, что в ноутбуке
+Модель_классификации_одежды.ipynb, но без повторной работы на каждой эпохе.
+
+Примеры:
+    python train_model.py --data-root /content --cache train_cache
+    python train_model.py --data-root /content --cache train_cache --epochs-finetune 0
+    python train_model.py --data-root /content --cache train_cache --unfreeze 30 --out model.keras
+
+Ноутбук на каждой эпохе заново декодирует и уменьшает все JPEG, а на этапе с
+замороженным MobileNetV2 ещё и гоняет backbone по каждому батчу, хотя его признаки
+от эпохи к эпохе не меняются. Здесь:
+1. картинки один раз декодируются так же, как в боте (load_image + image_to_uint8),
+   и складываются в memory-mapped шарды uint8 в папке --cache;
+2. пулинговые признаки замороженного backbone считаются один раз (аугментаций нет),
+   и головы type_output / color_output / print_output учатся прямо на них;
+3. дообучение всей сети читает батчи из шардов.
+Шарды и признаки переиспользуются при следующих запусках на тех же картинках.
+
+Вход модели — float32 [0, 1], как его готовит бот (preprocess_image); перевод в
+[-1, 1], которого ждёт MobileNetV2, сделан слоем внутри модели.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app import COLOR_CLASSES, IMG_SIZE, TYPE_CLASSES
+from classify_images import decoded
+from inference import HEAD_NAMES, build_embedding_model
+
+# articleType датасета -> наши укрупнённые классы
+TYPE_MAP = {
+    "Tshirts": "tshirt",
+    "Shirts": "shirt",
+    "Sweatshirts": "hoodie",
+    "Sweaters": "sweater",
+    "Jackets": "jacket",
+    "Jeans": "jeans",
+    "Track Pants": "pants",
+    "Trousers": "pants",
+    "Shorts": "shorts",
+    "Casual Shoes": "sneakers",
+    "Sports Shoes": "sneakers",
+    "Flip Flops": "sandals",
+    "Sandals": "sandals",
+}
+
+# baseColour -> цветовая группа; остальное (Multi, Gold, Silver, ...) выбрасывается
+COLOR_GROUP_MAP = {
+    "Black": "black", "Charcoal": "black",
+    "Grey": "grey", "Grey Melange": "grey",
+    "White": "white", "Off White": "white", "Cream": "white",
+    "Blue": "blue", "Navy Blue": "blue", "Turquoise Blue": "blue", "Teal": "blue",
+    "Green": "green", "Olive": "green", "Sea Green": "green", "Fluorescent Green": "green",
+    "Lime Green": "green", "Khaki": "green",
+    "Brown": "brown", "Coffee Brown": "brown", "Mushroom Brown": "brown", "Tan": "brown",
+    "Taupe": "brown", "Beige": "brown",
+    "Red": "red", "Maroon": "red", "Burgundy": "red", "Rust": "red",
+    "Pink": "pink", "Peach": "pink", "Magenta": "pink",
+    "Purple": "purple", "Lavender": "purple", "Mauve": "purple",
+    "Yellow": "yellow", "Mustard": "yellow",
+    "Orange": "orange",
+}
+
+# Грубая эвристика ноутбука: есть такое слово в названии — есть принт
+PRINT_KEYWORDS = (
+    "printed", "print", "graphic", "logo", "striped", "stripe", "check", "checked",
+    "pattern", "patterned", "embroidery", "embroidered",
+)
+
+BATCH_SIZE = 32
+FEATURE_BATCH_SIZE = 128   # батч прогона backbone при расчёте признаков
+SHARD_SIZE = 2048          # картинок в одном файле шарда
+EPOCHS_FROZEN = 5
+EPOCHS_FINETUNE = 5
+LR_FROZEN = 1e-3
+LR_FINETUNE = 1e-5         # меньше lr при fine-tuning
+VAL_SIZE = 0.2
+SEED = 42
+
+_INV_255 = np.float32(1.0 / 255.0)
+
+
+def _keras():
+    try:
+        from tensorflow import keras
+    except ImportError:
+        import keras
+    return keras
+
+
+# ================== ДАТАСЕТ ==================
+def load_samples(data_root: str):
+    """
+    Пути images/{id}.jpg и метки из styles.csv.
+    Возвращает (paths, labels), labels — {"type", "color", "print"} -> массивы.
+    """
+    paths, types, colors, prints = [], [], [], []
+    with open(os.path.join(data_root, "styles.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # Строки с лишними запятыми в названии — как on_bad_lines="skip" в ноутбуке
+            if None in row:
+                continue
+            type_label = TYPE_MAP.get(row.get("articleType"))
+            color_label = COLOR_GROUP_MAP.get(row.get("baseColour"))
+            name = row.get("productDisplayName")
+            if not row.get("id") or type_label is None or color_label is None or not name:
+                continue
+            path = os.path.join(data_root, "images", f"{row['id']}.jpg")
+            if not os.path.exists(path):
+                continue
+            paths.append(path)
+            types.append(TYPE_CLASSES.index(type_label))
+            colors.append(COLOR_CLASSES.index(color_label))
+            name = name.lower()
+            prints.append(float(any(kw in name for kw in PRINT_KEYWORDS)))
+
+    labels = {
+        "type": np.asarray(types, dtype=np.int32),
+        "color": np.asarray(colors, dtype=np.int32),
+        "print": np.asarray(prints, dtype=np.float32),
+    }
+    return paths, labels
+
+
+def stratified_split(strata: np.ndarray, val_size: float = VAL_SIZE, seed: int = SEED):
+    """(train_idx, val_idx): в валидацию уходит доля val_size каждого класса strata."""
+    rng = np.random.default_rng(seed)
+    train, val = [], []
+    for value in np.unique(strata):
+        idx = rng.permutation(np.flatnonzero(strata == value))
+        n_val = int(round(len(idx) * val_size))
+        val.append(idx[:n_val])
+        train.append(idx[n_val:])
+    return np.sort(np.concatenate(train)), np.sort(np.concatenate(val))
+
+
+# ================== ШАРДЫ ==================
+def _digest(paths: list, labels: dict) -> str:
+    h = hashlib.sha1(f"{IMG_SIZE}".encode())
+    for p in paths:
+        h.update(p.encode("utf-8", "surrogateescape"))
+        h.update(b"\0")
+    for name in sorted(labels):
+        h.update(np.ascontiguousarray(labels[name]).tobytes())
+    return h.hexdigest()
+
+
+class ImageShards:
+    """
+    Файлы в папке path:
+      images-NNNNN.u8  — uint8 (до shard_size, H, W, 3), memmap
+      labels.npz       — метки type / color / print по порядку картинок
+      header.json      — размер картинок и шардов, пути, хэш путей и меток; пишется последним
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "header.json"), encoding="utf-8") as f:
+            self.header = json.load(f)
+        self.count = self.header["count"]
+        self.shard_size = self.header["shard_size"]
+        self.shape = tuple(self.header["shape"])
+        self.paths = self.header["paths"]
+        with np.load(os.path.join(path, "labels.npz")) as data:
+            self.labels = {k: data[k] for k in data.files}
+        self._shards = []
+        for i in range(0, self.count, self.shard_size):
+            n = min(self.shard_size, self.count - i)
+            self._shards.append(np.memmap(self._shard_path(path, len(self._shards)), dtype=np.uint8,
+                                          mode="r", shape=(n,) + self.shape))
+
+    @staticmethod
+    def _shard_path(path: str, i: int) -> str:
+        return os.path.join(path, f"images-{i:05d}.u8")
+
+    @classmethod
+    def build(cls, path: str, paths: list, labels: dict, workers: int | None = None,
+              shard_size: int = SHARD_SIZE) -> "ImageShards":
+        """Декодирует картинки в шарды. Нечитаемые картинки пропускаются вместе с метками."""
+        os.makedirs(path, exist_ok=True)
+        header_path = os.path.join(path, "header.json")
+        if os.path.exists(header_path):
+            os.remove(header_path)
+
+        shape = (IMG_SIZE[1], IMG_SIZE[0], 3)
+        kept, errors = [], 0
+        shard, n_shards = np.empty((shard_size,) + shape, dtype=np.uint8), 0
+        fill = 0
+
+        def flush():
+            nonlocal n_shards, fill
+            out = cls._shard_path(path, n_shards)
+            mm = np.memmap(out + ".tmp", dtype=np.uint8, mode="w+", shape=(fill,) + shape)
+            mm[:] = shard[:fill]
+            mm.flush()
+            del mm
+            os.replace(out + ".tmp", out)
+            n_shards += 1
+            fill = 0
+
+        started = time.perf_counter()
+        index = {p: i for i, p in enumerate(paths)}
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+            for p, image, error in decoded(paths, executor, prefetch=256):
+                if image is None:
+                    errors += 1
+                    print(f"  пропущена {p}: {error}")
+                    continue
+                shard[fill] = image
+                fill += 1
+                kept.append(index[p])
+                if fill == shard_size:
+                    flush()
+                    print(f"  шардов: {n_shards}, картинок: {len(kept)}/{len(paths)}, "
+                          f"{len(kept) / (time.perf_counter() - started):.0f} карт./с")
+            if fill:
+                flush()
+
+        kept = np.asarray(kept, dtype=np.int64)
+        np.savez(os.path.join(path, "labels.npz"), **{k: v[kept] for k, v in labels.items()})
+        header = {
+            "count": int(len(kept)),
+            "shard_size": shard_size,
+            "shape": list(shape),
+            "source_digest": _digest(paths, labels),
+            "errors": errors,
+            "paths": [paths[i] for i in kept],
+        }
+        with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False)
+        os.replace(header_path + ".tmp", header_path)
+        return cls(path)
+
+    @classmethod
+    def open_or_build(cls, path: str, paths: list, labels: dict, workers: int | None = None) -> "ImageShards":
+        """Готовые шарды, если они собраны из тех же картинок того же размера, иначе собирает заново."""
+        try:
+            shards = cls(path)
+            if shards.header["source_digest"] == _digest(paths, labels):
+                return shards
+        except (OSError, ValueError, KeyError):
+            pass
+        print(f"Собираю шарды в {path} из {len(paths)} картинок")
+        return cls.build(path, paths, labels, workers)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def gather(self, indices, out: np.ndarray | None = None) -> np.ndarray:
+        """uint8 (len(indices), H, W, 3) — картинки по номерам."""
+        if out is None:
+            out = np.empty((len(indices),) + self.shape, dtype=np.uint8)
+        for j, i in enumerate(indices):
+            out[j] = self._shards[i // self.shard_size][i % self.shard_size]
+        return out
+
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self._shards)
+
+
+def _targets(labels: dict, idx) -> dict:
+    return {
+        "type_output": labels["type"][idx],
+        "color_output": labels["color"][idx],
+        "print_output": labels["print"][idx],
+    }
+
+
+def batches(shards: ImageShards, indices: np.ndarray, batch_size: int = BATCH_SIZE,
+            shuffle: bool = True, seed: int = SEED):
+    """
+    Бесконечный поток (x float32 [0, 1], метки) для model.fit из шардов.
+    Каждую эпоху (len(indices) / batch_size батчей) порядок перемешивается заново.
+    """
+    rng = np.random.default_rng(seed)
+    u8 = np.empty((batch_size,) + shards.shape, dtype=np.uint8)
+    while True:
+        order = rng.permutation(indices) if shuffle else indices
+        for start in range(0, len(order), batch_size):
+            # Внутри батча читаем по возрастанию — шард открывается подряд, а не вразнобой
+            idx = np.sort(order[start:start + batch_size])
+            n = len(idx)
+            shards.gather(idx, out=u8[:n])
+            # Новый массив на каждый батч: fit может держать предыдущий в очереди
+            x = np.multiply(u8[:n], _INV_255, dtype=np.float32)
+            yield x, _targets(shards.labels, idx)
+
+
+def _steps(n: int, batch_size: int) -> int:
+    return (n + batch_size - 1) // batch_size
+
+
+# ================== МОДЕЛЬ ==================
+def build_model(weights: str | None = "imagenet"):
+    """
+    Модель как в ноутбуке: MobileNetV2 с пулингом и три головы после Dropout.
+    Возвращает (model, backbone); backbone заморожен.
+    """
+    keras = _keras()
+    layers = keras.layers
+
+    inputs = keras.Input(shape=(IMG_SIZE[1], IMG_SIZE[0], 3))
+    # [0, 1] -> [-1, 1], как preprocess_input у MobileNetV2
+    x = layers.Rescaling(2.0, offset=-1.0, name="mobilenet_v2_preprocess")(inputs)
+    backbone = keras.applications.MobileNetV2(
+        include_top=False,
+        weights=weights,
+        input_shape=(IMG_SIZE[1], IMG_SIZE[0], 3),
+        pooling="avg",
+    )
+    backbone.trainable = False
+    outputs = _heads(layers, backbone(x))
+    model = keras.Model(inputs=inputs, outputs=outputs, name="clothing_multitask_mobilenetv2")
+    return model, backbone
+
+
+def _heads(layers, features) -> list:
+    x = layers.Dropout(0.3)(features)
+    return [
+        layers.Dense(len(TYPE_CLASSES), activation="softmax", name="type_output")(x),
+        layers.Dense(len(COLOR_CLASSES), activation="softmax", name="color_output")(x),
+        layers.Dense(1, activation="sigmoid", name="print_output")(x),
+    ]
+
+
+def build_head_model(dim: int):
+    """Только головы: вход — закэшированные признаки backbone."""
+    keras = _keras()
+    inputs = keras.Input(shape=(dim,))
+    return keras.Model(inputs=inputs, outputs=_heads(keras.layers, inputs), name="clothing_heads")
+
+
+def compile_model(model, learning_rate: float):
+    keras = _keras()
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate),
+        loss={
+            "type_output": "sparse_categorical_crossentropy",
+            "color_output": "sparse_categorical_crossentropy",
+            "print_output": "binary_crossentropy",
+        },
+        metrics={name: ["accuracy"] for name in HEAD_NAMES},
+    )
+
+
+def epoch_timer(title: str, images_per_epoch: int):
+    """Callback, печатающий время каждой эпохи; секунды копятся в возвращаемом списке."""
+    keras = _keras()
+    seconds = []
+    started = [0.0]
+
+    def on_epoch_begin(epoch, logs=None):
+        started[0] = time.perf_counter()
+
+    def on_epoch_end(epoch, logs=None):
+        took = time.perf_counter() - started[0]
+        seconds.append(took)
+        print(f"  {title}, эпоха {epoch + 1}: {took:.1f} с, {images_per_epoch / took:.0f} карт./с")
+
+    callback = keras.callbacks.LambdaCallback(on_epoch_begin=on_epoch_begin, on_epoch_end=on_epoch_end)
+    return callback, seconds
+
+
+# ================== ПРИЗНАКИ BACKBONE ==================
+def cached_features(path: str, shards: ImageShards, model, backbone,
+                    batch_size: int = FEATURE_BATCH_SIZE) -> np.ndarray:
+    """
+    Пулинговые признаки замороженного backbone для всех картинок шардов,
+    features.f32 (count, dim) в папке path. Считаются один раз на набор шардов.
+    """
+    extractor = build_embedding_model(model)
+    dim = int(extractor.output_shape[-1])
+    data_path = os.path.join(path, "features.f32")
+    header_path = os.path.join(path, "features.json")
+    key = {"source_digest": shards.header["source_digest"], "count": shards.count, "dim": dim,
+           "backbone": backbone.name}
+
+    if os.path.exists(header_path):
+        with open(header_path, encoding="utf-8") as f:
+            if json.load(f) == key:
+                return np.memmap(data_path, dtype=np.float32, mode="r", shape=(shards.count, dim))
+        os.remove(header_path)
+
+    print(f"Считаю признаки backbone для {shards.count} картинок")
+    features = np.memmap(data_path, dtype=np.float32, mode="w+", shape=(shards.count, dim))
+    u8 = np.empty((batch_size,) + shards.shape, dtype=np.uint8)
+    x = np.empty(u8.shape, dtype=np.float32)
+    started = time.perf_counter()
+    for start in range(0, shards.count, batch_size):
+        n = min(batch_size, shards.count - start)
+        shards.gather(range(start, start + n), out=u8[:n])
+        np.multiply(u8[:n], _INV_255, out=x[:n])
+        features[start:start + n] = np.asarray(extractor.predict_on_batch(x[:n]))
+    features.flush()
+    took = time.perf_counter() - started
+    print(f"  признаки посчитаны за {took:.1f} с, {shards.count / took:.0f} карт./с")
+
+    with open(header_path, "w", encoding="utf-8") as f:
+        json.dump(key, f)
+    return features
+
+
+# ================== ОБУЧЕНИЕ ==================
+def train(args) -> dict:
+    paths, labels = load_samples(args.data_root)
+    print(f"Примеров после фильтрации: {len(paths)}")
+    shards = ImageShards.open_or_build(args.cache, paths, labels, args.decoders)
+    print(f"Шарды: {len(shards)} картинок, {shards.nbytes() / 2 ** 20:.0f} МБ")
+    train_idx, val_idx = stratified_split(shards.labels["type"], args.val_size, args.seed)
+
+    model, backbone = build_model()
+    report = {"images": len(shards), "train": len(train_idx), "val": len(val_idx)}
+
+    # 1. Головы на закэшированных признаках замороженного backbone
+    started = time.perf_counter()
+    features = cached_features(args.cache, shards, model, backbone)
+    report["features_seconds"] = time.perf_counter() - started
+    if args.epochs_frozen:
+        heads = build_head_model(features.shape[1])
+        compile_model(heads, args.lr_frozen)
+        timer, seconds = epoch_timer("головы", len(train_idx))
+        heads.fit(
+            np.asarray(features[train_idx]),
+            _targets(shards.labels, train_idx),
+            validation_data=(np.asarray(features[val_idx]), _targets(shards.labels, val_idx)),
+            batch_size=args.batch_size,
+            epochs=args.epochs_frozen,
+            callbacks=[timer],
+        )
+        for name in HEAD_NAMES:
+            model.get_layer(name).set_weights(heads.get_layer(name).get_weights())
+        report["frozen_epoch_seconds"] = seconds
+
+    # 2. Дообучение всей сети из шардов
+    if args.epochs_finetune:
+        backbone.trainable = True
+        if args.unfreeze:
+            for layer in backbone.layers[:-args.unfreeze]:
+                layer.trainable = False
+        compile_model(model, args.lr_finetune)
+        timer, seconds = epoch_timer("дообучение", len(train_idx))
+        model.fit(
+            batches(shards, train_idx, args.batch_size, shuffle=True, seed=args.seed),
+            steps_per_epoch=_steps(len(train_idx), args.batch_size),
+            validation_data=batches(shards, val_idx, args.batch_size, shuffle=False),
+            validation_steps=_steps(len(val_idx), args.batch_size),
+            epochs=args.epochs_finetune,
+            callbacks=[timer],
+        )
+        report["finetune_epoch_seconds"] = seconds
+
+    model.save(args.out)
+    print(f"Модель сохранена: {args.out}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение модели бота на датасете ноутбука")
+    parser.add_argument("--data-root", required=True, help="папка с styles.csv и images/")
+    parser.add_argument("--cache", default="train_cache", help="папка для шардов и признаков")
+    parser.add_argument("--out", default="clothing_multitask_mobilenetv2.keras")
+    parser.add_argument("--epochs-frozen", type=int, default=EPOCHS_FROZEN)
+    parser.add_argument("--epochs-finetune", type=int, default=EPOCHS_FINETUNE)
+    parser.add_argument("--unfreeze", type=int, default=0,
+                        help="сколько верхних слоёв backbone дообучать (0 — все)")
+    parser.add_argument("--lr-frozen", type=float, default=LR_FROZEN)
+    parser.add_argument("--lr-finetune", type=float, default=LR_FINETUNE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--val-size", type=float, default=VAL_SIZE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--decoders", type=int, default=None, help="потоков декодирования при сборке шардов")
+    args = parser.parse_args()
+
+    r = train(args)
+    print(f"Картинок: {r['images']} (обучение {r['train']}, проверка {r['val']}), "
+          f"признаки: {r['features_seconds']:.1f} с")
+    for key, title in (("frozen_epoch_seconds", "головы"), ("finetune_epoch_seconds", "дообучение")):
+        if r.get(key):
+            print(f"  {title}: {len(r[key])} эпох, в среднем {np.mean(r[key]):.1f} с на эпоху")
+
+
+if __name__ == "__main__":
+    main()
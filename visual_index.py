@@ -0,0 +1,405 @@
+"""
+Локальный индекс визуальных эмбеддингов товаров для поиска "похожие по фото".
+
+Эмбеддинг — выход пулинга MobileNetV2 из той же многозадачной модели (вход
+голов type/color/print). Векторы L2-нормированы и лежат в memory-mapped файле,
+поэтому индекс открывается мгновенно и дописывается по мере парсинга.
+
+Поиск по умолчанию — полный перебор (матрица @ вектор). Для больших каталогов
+можно построить IVF: k-means центроиды + int8-коды векторов; тогда
+просматриваются только nprobe ближайших кластеров, а кандидаты
+пересчитываются по точным float32-векторам.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import urllib.request
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _quantize(x: np.ndarray) -> np.ndarray:
+    """int8-коды нормированных векторов."""
+    return np.clip(np.round(x * 127.0), -127, 127).astype(np.int8)
+
+
+class VisualIndex:
+    """
+    Файлы в папке path:
+      vectors.f32   — float32 матрица (capacity, dim), memmap
+      meta.jsonl    — по строке на товар (title, price, link, image)
+      header.json   — dim и число векторов
+      ivf_centroids.npy, ivf_assign.i32, ivf_codes.i8 — (необязательно) IVF: центроиды,
+                      номера кластеров и int8-коды векторов. Центроиды пишутся только
+                      при build_ivf, назначения и коды новых товаров дописываются в
+                      конец файлов и читаются через memmap.
+
+    Пополняет индекс один процесс (writable=True); остальные открывают его с
+    writable=False, файлов не меняют, а search у них сначала подхватывает
+    дописанное пишущим процессом (новые строки meta, выросший vectors.f32, IVF).
+    """
+
+    def __init__(self, path: str, dim: int, initial_capacity: int = 1024, writable: bool = True):
+        self.path = path
+        self.dim = dim
+        self.writable = writable
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._meta_path = os.path.join(path, "meta.jsonl")
+        self._header_path = os.path.join(path, "header.json")
+        self._centroids_path = os.path.join(path, "ivf_centroids.npy")
+        self._assign_path = os.path.join(path, "ivf_assign.i32")
+        self._codes_path = os.path.join(path, "ivf_codes.i8")
+
+        self.count = 0
+        if os.path.exists(self._header_path):
+            with open(self._header_path, encoding="utf-8") as f:
+                header = json.load(f)
+            if header["dim"] != dim:
+                raise ValueError(f"Индекс в {path} построен для dim={header['dim']}, а не {dim}")
+            self.count = header["count"]
+
+        self.meta: list = []
+        self._meta_offset = 0   # байт в meta.jsonl, до которого строки уже прочитаны
+        self._load_meta(self.count)
+        if writable:
+            self._drop_orphan_meta()
+        self.count = len(self.meta)
+        self._links = {m.get("link") for m in self.meta}
+
+        capacity = max(initial_capacity, self.count)
+        if os.path.exists(self._vectors_path):
+            capacity = max(capacity, os.path.getsize(self._vectors_path) // (4 * dim))
+        self._open(capacity)
+
+        self.ivf = None
+        self._seen = self._files_state()
+        if os.path.exists(self._centroids_path):
+            self._open_ivf(np.load(self._centroids_path))
+            if self.ivf is None:
+                logger.warning("IVF-индекс устарел, пересоберите его (build_ivf)")
+
+    # ------------------ хранение ------------------
+    def _load_meta(self, count: int):
+        """Дочитывает meta.jsonl до count строк. Строки дальше count в header.json не учтены."""
+        if len(self.meta) >= count or not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # строку ещё дописывают (или процесс упал посреди записи)
+                self.meta.append(json.loads(line))
+                self._meta_offset += len(line)
+                if len(self.meta) == count:
+                    break
+
+    def _drop_orphan_meta(self):
+        """
+        Обрезает строки meta.jsonl, не попавшие в header.json: процесс упал между
+        дозаписью meta и обновлением заголовка. Иначе следующий add допишет свои
+        строки после них, и номера строк разойдутся с номерами векторов.
+        """
+        if os.path.exists(self._meta_path) and os.path.getsize(self._meta_path) > self._meta_offset:
+            logger.warning("В meta.jsonl визуального индекса есть строки сверх header.json, обрезаю")
+            with open(self._meta_path, "r+b") as f:
+                f.truncate(self._meta_offset)
+
+    def _open(self, capacity: int):
+        if not self.writable:
+            # Файл растит пишущий процесс — отображаем столько, сколько в нём есть
+            size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+            self.capacity = size // (4 * self.dim)
+            self.vectors = (np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                      shape=(self.capacity, self.dim))
+                            if self.capacity else np.zeros((0, self.dim), dtype=np.float32))
+            return
+        size = capacity * self.dim * 4
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.capacity = capacity
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity != self.capacity:
+            self.vectors.flush()
+            del self.vectors
+            self._open(capacity)
+
+    def _files_state(self) -> tuple:
+        """Состояние файлов, которые меняет пишущий процесс: header.json и IVF."""
+        state = []
+        for path in (self._header_path, self._centroids_path, self._assign_path):
+            try:
+                st = os.stat(path)
+                state.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _reload(self):
+        """У читателя: подхватывает то, что пишущий процесс дописал с прошлого раза."""
+        state = self._files_state()
+        if state == self._seen:
+            return
+        self._seen = state
+        if state[0] is not None:
+            with open(self._header_path, encoding="utf-8") as f:
+                count = json.load(f)["count"]
+            if count > self.count:
+                self._load_meta(count)
+                self._links.update(m.get("link") for m in self.meta[self.count:])
+                self.count = len(self.meta)
+                if self.count > self.capacity:
+                    self._open(0)
+        # IVF дописывается после заголовка, а центроиды меняет build_ivf — переоткрываем
+        self.ivf = None
+        if state[1] is not None:
+            self._open_ivf(np.load(self._centroids_path))
+
+    def _write_header(self):
+        tmp = self._header_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp, self._header_path)
+
+    def __len__(self):
+        if not self.writable:
+            with self._lock:
+                self._reload()
+        return self.count
+
+    def __contains__(self, link: str):
+        return link in self._links
+
+    # ------------------ запись ------------------
+    def add(self, embeddings: np.ndarray, products: list) -> int:
+        """Добавляет товары, которых ещё нет в индексе (по ссылке). Возвращает число добавленных."""
+        if not self.writable:
+            raise RuntimeError("Визуальный индекс открыт только для чтения")
+        with self._lock:
+            rows, metas = [], []
+            for emb, product in zip(embeddings, products):
+                link = product.get("link")
+                if not link or link in self._links:
+                    continue
+                self._links.add(link)
+                rows.append(emb)
+                metas.append({k: product.get(k, "") for k in ("title", "price", "link", "image")})
+            if not rows:
+                return 0
+
+            vecs = _normalize(np.stack(rows))
+            start = self.count
+            self._grow(start + len(rows))
+            self.vectors[start:start + len(rows)] = vecs
+            self.vectors.flush()
+
+            with open(self._meta_path, "a", encoding="utf-8") as f:
+                for m in metas:
+                    f.write(json.dumps(m, ensure_ascii=False) + "\n")
+            self.meta.extend(metas)
+            self.count += len(rows)
+            self._write_header()
+
+            if self.ivf is not None:
+                self._ivf_append(vecs)
+            return len(rows)
+
+    # ------------------ поиск ------------------
+    def search(self, query: np.ndarray, k: int = 15, nprobe: int = 8) -> list:
+        """Топ-k товаров по косинусной близости: список (score, product)."""
+        q = _normalize(query.reshape(-1))
+        with self._lock:
+            if not self.writable:
+                self._reload()
+            n = self.count
+            if n == 0:
+                return []
+            if self.ivf is not None:
+                ids = self._ivf_candidates(q, max(k * 4, 64), nprobe)
+                scores = self.vectors[ids] @ q
+            else:
+                ids = np.arange(n)
+                scores = self.vectors[:n] @ q
+
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.meta[int(ids[i])]) for i in top]
+
+    # ------------------ IVF + int8 ------------------
+    def build_ivf(self, nlist: int = 64, iterations: int = 10, seed: int = 0):
+        """Кластеризует векторы (k-means) и квантует их в int8. Имеет смысл от десятков тысяч товаров."""
+        if not self.writable:
+            raise RuntimeError("Визуальный индекс открыт только для чтения")
+        with self._lock:
+            n = self.count
+            if n < nlist:
+                raise ValueError(f"Слишком мало векторов ({n}) для {nlist} кластеров")
+            data = np.asarray(self.vectors[:n])
+            rng = np.random.default_rng(seed)
+            centroids = data[rng.choice(n, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = data[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            assign = np.argmax(data @ centroids.T, axis=1)
+
+            self.ivf = None
+            # Центроиды — последними: по ним при открытии понятно, что IVF есть
+            for path, array in ((self._assign_path, assign.astype(np.int32)),
+                                (self._codes_path, _quantize(data))):
+                array.tofile(path + ".tmp")
+                os.replace(path + ".tmp", path)
+            with open(self._centroids_path + ".tmp", "wb") as f:
+                np.save(f, centroids.astype(np.float32))
+            os.replace(self._centroids_path + ".tmp", self._centroids_path)
+            self._open_ivf(centroids.astype(np.float32))
+
+    def _open_ivf(self, centroids: np.ndarray):
+        """Открывает назначения и коды через memmap; если их меньше, чем векторов, IVF выключается."""
+        n = os.path.getsize(self._assign_path) // 4 if os.path.exists(self._assign_path) else 0
+        codes = os.path.getsize(self._codes_path) if os.path.exists(self._codes_path) else 0
+        if n != self.count or n == 0 or codes != n * self.dim:
+            self.ivf = None
+            return
+        self.ivf = {
+            "centroids": centroids,
+            "assign": np.memmap(self._assign_path, dtype=np.int32, mode="r", shape=(n,)),
+            "codes": np.memmap(self._codes_path, dtype=np.int8, mode="r", shape=(n, self.dim)),
+        }
+
+    def _ivf_append(self, vecs: np.ndarray):
+        # Без переобучения: новые векторы относятся к ближайшим из прежних центроидов
+        assign = np.argmax(vecs @ self.ivf["centroids"].T, axis=1).astype(np.int32)
+        with open(self._assign_path, "ab") as f:
+            f.write(assign.tobytes())
+        with open(self._codes_path, "ab") as f:
+            f.write(_quantize(vecs).tobytes())
+        self._open_ivf(self.ivf["centroids"])
+
+    def _ivf_candidates(self, q: np.ndarray, limit: int, nprobe: int) -> np.ndarray:
+        probes = np.argsort(-(self.ivf["centroids"] @ q))[:nprobe]
+        ids = np.flatnonzero(np.isin(self.ivf["assign"], probes))
+        if len(ids) > limit:
+            # Грубая оценка по int8-кодам, точный пересчёт — только для лучших
+            approx = self.ivf["codes"][ids].astype(np.float32) @ q
+            ids = ids[np.argpartition(-approx, limit)[:limit]]
+        return ids
+
+
+class VisualIndexer:
+    """
+    Фоновое пополнение индекса: скачивает картинки новых товаров,
+    считает эмбеддинги пачками и дописывает их в индекс.
+    """
+
+    def __init__(self, index: VisualIndex, embed_fn, load_fn, batch_size: int = 32,
+                 max_pending: int = 5000, fetch_timeout: float = 10.0):
+        self.index = index
+        self.embed_fn = embed_fn      # (N, H, W, 3) float32 -> (N, dim)
+        self.load_fn = load_fn        # bytes -> (1, H, W, 3) float32
+        self.batch_size = batch_size
+        self.fetch_timeout = fetch_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._loop, name="visual-indexer", daemon=True)
+        self._thread.start()
+
+        self.indexed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, products: list):
+        for product in products:
+            if not product.get("image") or product.get("link") in self.index:
+                continue
+            try:
+                self._queue.put_nowait(product)
+            except queue.Full:
+                self.dropped += 1
+
+    def _fetch(self, url: str) -> bytes:
+        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(req, timeout=self.fetch_timeout) as resp:
+            return resp.read()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            tensors, products = [], []
+            for product in batch:
+                if product.get("link") in self.index:
+                    continue
+                try:
+                    tensors.append(self.load_fn(self._fetch(product["image"])))
+                    products.append(product)
+                except Exception as e:
+                    self.failed += 1
+                    logger.debug(f"Не удалось скачать картинку {product.get('image')}: {e}")
+            if not tensors:
+                continue
+
+            try:
+                embeddings = self.embed_fn(np.concatenate(tensors, axis=0))
+                self.indexed += self.index.add(embeddings, products)
+            except Exception as e:
+                self.failed += len(products)
+                logger.error(f"Ошибка при пополнении визуального индекса: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "index_size": len(self.index),
+            "pending": self._queue.qsize(),
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание визуального индекса")
+    parser.add_argument("path", help="папка индекса")
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--build-ivf", type=int, metavar="NLIST", default=0,
+                        help="построить IVF с NLIST кластерами и int8-кодами")
+    args = parser.parse_args()
+
+    index = VisualIndex(args.path, args.dim)
+    print(f"Векторов в индексе: {len(index)}")
+    if args.build_ivf:
+        index.build_ivf(nlist=args.build_ivf)
+        print(f"IVF построен: {args.build_ivf} кластеров")
+
+
+if __name__ == "__main__":
+    main()